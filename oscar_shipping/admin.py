@@ -4,6 +4,9 @@ from oscar.core.loading import get_model
 
 ShippingCompany = get_model('shipping', 'ShippingCompany')
 ShippingContainer = get_model('shipping', 'ShippingContainer')
+CarrierLocation = get_model('shipping', 'CarrierLocation')
+ShippingRate = get_model('shipping', 'ShippingRate')
+FallbackQuote = get_model('shipping', 'FallbackQuote')
 
     
 class ShippingCompanyAdmin(admin.ModelAdmin):
@@ -13,8 +16,29 @@ class ShippingCompanyAdmin(admin.ModelAdmin):
 
 class ShippingContainerAdmin(admin.ModelAdmin):
     list_display = ('name', 'height', 'width', 'length', 'max_load')
+
+
+class CarrierLocationAdmin(admin.ModelAdmin):
+    list_display = ('title', 'code', 'carrier', 'region', 'parent_code', 'date_updated')
+    list_filter = ('carrier',)
+    search_fields = ('title', 'code', 'region')
+
+
+class ShippingRateAdmin(admin.ModelAdmin):
+    list_display = ('method', 'origin_code', 'dest_code', 'weight', 'volume', 'charge', 'date_updated')
+    list_filter = ('method',)
+    search_fields = ('dest_code',)
+
+
+class FallbackQuoteAdmin(admin.ModelAdmin):
+    list_display = ('method', 'origin_code', 'dest_code', 'weight', 'charge', 'date_updated')
+    list_filter = ('method',)
+    search_fields = ('dest_code',)
     
 
 
 admin.site.register(ShippingCompany, ShippingCompanyAdmin)
-admin.site.register(ShippingContainer, ShippingContainerAdmin)
\ No newline at end of file
+admin.site.register(ShippingContainer, ShippingContainerAdmin)
+admin.site.register(CarrierLocation, CarrierLocationAdmin)
+admin.site.register(ShippingRate, ShippingRateAdmin)
+admin.site.register(FallbackQuote, FallbackQuoteAdmin)
\ No newline at end of file
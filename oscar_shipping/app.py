@@ -10,6 +10,7 @@ class ShippingApplication(Application):
     name = 'shipping'
     city_lookup_view = views.CityLookupView
     shipping_details_view = views.ShippingDetailsView
+    shipping_estimate_view = views.ShippingEstimateView
     
     def get_urls(self):
         urlpatterns = super(ShippingApplication, self).get_urls()
@@ -21,6 +22,11 @@ class ShippingApplication(Application):
             url(r'^details/(?P<slug>[\w-]+)/$', cache_page(60*10)(self.shipping_details_view.as_view()),
                 name='charge-details'),
         )
+        # estimates are cached by the view itself
+        urlpatterns += patterns('',
+            url(r'^estimate/(?P<pk>\d+)/$', self.shipping_estimate_view.as_view(),
+                name='estimate'),
+        )
         return self.post_process_urls(urlpatterns)
 
 
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Encoding layer for the large values stored by facades in the shared cache.
+Value is serialized to json, compressed and split into chunks
+which are small enough for memcached. The chunks are listed in the manifest
+stored under the key given.
+"""
+import json
+import zlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+# memcached item limit is 1Mb by default, keep some room for the key and flags
+CHUNK_SIZE = getattr(settings, 'OSCAR_SHIPPING_CACHE_CHUNK_SIZE', 900 * 1024)
+
+COMPRESS_LEVEL = getattr(settings, 'OSCAR_SHIPPING_CACHE_COMPRESS_LEVEL', 6)
+
+
+def get_chunk_keys(key, manifest):
+    return ['%s:%s:%d' % (key, manifest['version'], i) for i in range(manifest['chunks'])]
+
+
+def set_large(key, value, timeout=None, meta=None):
+    """
+    Stores json-serializable value given as compressed chunks.
+    Chunks are stored before the manifest, so readers never see
+    partially written value. Chunks of the previous value are deleted then.
+    Small meta given is kept in the manifest (see get_large_meta()).
+    """
+    previous = cache.get(key)
+    payload = zlib.compress(json.dumps(value, separators=(',', ':')).encode('utf-8'),
+                            COMPRESS_LEVEL)
+    chunks = [payload[i:i + CHUNK_SIZE] for i in range(0, len(payload), CHUNK_SIZE)] or [b'']
+    manifest = {'version': uuid.uuid4().hex[:8],
+                'chunks': len(chunks),
+                'size': len(payload),
+                'meta': meta}
+    cache.set_many(dict(zip(get_chunk_keys(key, manifest), chunks)), timeout)
+    cache.set(key, manifest, timeout)
+    if isinstance(previous, dict) and 'chunks' in previous:
+        cache.delete_many(get_chunk_keys(key, previous))
+
+
+def get_large_meta(key, default=None):
+    """
+    Returns meta stored with the value by set_large() without
+    reading the chunks, so it's cheap to check whether value was changed
+    """
+    manifest = cache.get(key)
+    if not isinstance(manifest, dict) or manifest.get('meta') is None:
+        return default
+    return manifest['meta']
+
+
+def get_large(key, default=None):
+    """
+    Returns value stored by set_large() or default if manifest
+    or any of chunks are missing
+    """
+    manifest = cache.get(key)
+    if not isinstance(manifest, dict) or 'chunks' not in manifest:
+        return default
+    keys = get_chunk_keys(key, manifest)
+    chunks = cache.get_many(keys)
+    if len(chunks) != len(keys):
+        return default
+    payload = b''.join(chunks[k] for k in keys)
+    if len(payload) != manifest['size']:
+        return default
+    try:
+        return json.loads(zlib.decompress(payload).decode('utf-8'))
+    except (zlib.error, ValueError):
+        return default
+
+
+def delete_large(key):
+    manifest = cache.get(key)
+    cache.delete(key)
+    if isinstance(manifest, dict) and 'chunks' in manifest:
+        cache.delete_many(get_chunk_keys(key, manifest))
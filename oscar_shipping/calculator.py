@@ -0,0 +1,435 @@
+# -*- coding: utf-8 -*-
+import logging
+
+from decimal import Decimal as D
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.urlresolvers import reverse_lazy
+from django.utils.encoding import force_text
+from django.utils.translation import ugettext_lazy as _
+
+from oscar.core import prices
+
+from .utils import Deadline
+from .facade.base import BATCH_WORKERS
+from .exceptions import (FacadeError,
+                         OriginCityNotFoundError,
+                         CityNotFoundError,
+                         ApiOfflineError,
+                         RateLimitExceeded,
+                         DeadlineExceeded,
+                         TooManyFoundError,
+                         CalculationError)
+
+logger = logging.getLogger('oscar_shipping')
+
+weight_precision = getattr(settings, 'OSCAR_SHIPPING_WEIGHT_PRECISION', D('0.000'))
+
+CHANGE_DESTINATION = getattr(settings, 'OSCAR_SHIPPING_CHANGE_DESTINATION', True)
+
+# max time API calls could take while charge is calculated, seconds (None means no limit)
+CHECKOUT_DEADLINE = getattr(settings, 'OSCAR_SHIPPING_CHECKOUT_DEADLINE', 5)
+
+
+class ShippingQuote(object):
+    """
+    Immutable result of the shipping charge calculation.
+    Services are tuples (service, charge) offered by the carrier.
+    Extra form is built by the facade for the current request
+    so it's not serialized.
+    """
+    LIVE, CACHED, FALLBACK, ESTIMATE = 'live', 'cached', 'fallback', 'estimate'
+
+    __slots__ = ('method_code', 'charge', 'currency', 'services', 'origin_code',
+                 'dest_code', 'messages', 'errors', 'provenance', 'extra_form')
+
+    def __init__(self, method_code, charge, currency, services=(), origin_code=None,
+                 dest_code=None, messages=(), errors=(), provenance=None, extra_form=None):
+        values = (method_code, charge, currency, tuple(services), origin_code,
+                  dest_code, tuple(messages), tuple(errors), provenance, extra_form)
+        for name, value in zip(self.__slots__, values):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ShippingQuote is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("ShippingQuote is immutable")
+
+    def __repr__(self):
+        return "<ShippingQuote %s: %s %s (%s)>" % (self.method_code, self.charge,
+                                                   self.currency, self.provenance)
+
+    @property
+    def is_valid(self):
+        return not self.errors
+
+    @property
+    def price(self):
+        # Zero tax is assumed...
+        return prices.Price(currency=self.currency,
+                            excl_tax=self.charge,
+                            incl_tax=self.charge)
+
+    def to_dict(self):
+        return {'method_code': self.method_code,
+                'charge': force_text(self.charge),
+                'currency': self.currency,
+                'services': [(force_text(s), force_text(c)) for s, c in self.services],
+                'origin_code': self.origin_code and force_text(self.origin_code),
+                'dest_code': self.dest_code and force_text(self.dest_code),
+                'messages': [force_text(m) for m in self.messages],
+                'errors': [force_text(e) for e in self.errors],
+                'provenance': self.provenance}
+
+    @classmethod
+    def from_dict(cls, data):
+        data = dict(data)
+        data['charge'] = D(data['charge'])
+        data['services'] = [(s, D(c)) for s, c in data.get('services', ())]
+        return cls(**data)
+
+    def __getstate__(self):
+        return self.to_dict()
+
+    def __setstate__(self, state):
+        quote = self.from_dict(state)
+        for name in self.__slots__:
+            object.__setattr__(self, name, getattr(quote, name))
+
+
+class ShippingCalculator(object):
+    """
+    Calculates charges of the shipping method given.
+    Nothing is stored on the method, results are returned as ShippingQuote.
+    """
+
+    def __init__(self, method, deadline=CHECKOUT_DEADLINE):
+        self.method = method
+        self.facade = method.facade
+        # seconds API calls could take for the single calculation
+        # or Deadline shared by all calculations of the request
+        self.deadline = deadline
+
+    def get_deadline(self):
+        if isinstance(self.deadline, Deadline):
+            return self.deadline
+        return Deadline(self.deadline) if self.deadline else None
+
+    def get_weight(self, basket):
+        # Note, when weighing the basket, we don't check whether the item
+        # requires shipping or not.  It is assumed that if something has a
+        # weight, then it requires shipping.
+        # weights are taken from the cached product profiles shared with packer
+        return self.method.get_packer().weigh_basket(basket).quantize(weight_precision)
+
+    def get_packs(self, basket):
+        # Should be a list of dicts { 'weight': weight, 'container' : container }
+        return self.method.get_packer().pack_basket(basket)
+
+    def get_profile(self, basket):
+        """
+        Returns tuple (weight, packs) of the basket
+        """
+        return self.get_weight(basket), self.get_packs(basket)
+
+    def get_extra_form(self, **kwargs):
+        # origin code lookup could fail while API is offline, form is optional then
+        try:
+            return self.facade.get_extra_form(origin=self.method.origin, **kwargs)
+        except (FacadeError, ImproperlyConfigured):
+            return None
+
+    def get_route_message(self, weight, destination):
+        return _(u"""Approximated shipping price
+                   for {weight} kg from {origin}
+                   to {destination}\n""").format(weight=weight,
+                                                 origin=self.method.origin,
+                                                 destination=destination.city)
+
+    def parse_results(self, results, destination, weight, packs, provenance):
+        """
+        Returns tuple (charge, messages, errors, extra form, services)
+        for the results of the quote given. Live quotes are stored
+        as the last known good ones.
+        """
+        (charge, msg,
+         err, extra_form) = self.facade.parse_results(results,
+                                                      origin=self.method.origin,
+                                                      dest=destination,
+                                                      weight=weight,
+                                                      packs=packs)
+        services = ()
+        if not err:
+            services = self.facade.get_quote_services(results)
+            if provenance == ShippingQuote.LIVE:
+                self.method.store_quote(weight, results, destination)
+        return charge, [msg] if msg else [], [err] if err else [], extra_form, services
+
+    def calculate(self, basket, destination=None, options=None, profile=None):
+        """
+        Returns ShippingQuote for the basket given.
+        Basket profile (weight, packs) is calculated if not given.
+        """
+        method, facade = self.method, self.facade
+        results = []
+        charge = D('0.0')
+        messages = []
+        errors = []
+        services = ()
+        extra_form = None
+        provenance = None
+        origin_code = dest_code = None
+        weight, packs = profile or self.get_profile(basket)
+        deadline = self.get_deadline()
+        if not destination:
+            errors.append(_("ERROR! There is no shipping address for charge calculation!\n"))
+        else:
+            messages.append(self.get_route_message(weight, destination))
+
+            # Assuming cases like http protocol suggests:
+            # e=200  - OK. Result contains charge value and extra info such as Branch code, etc
+            # e=404  - Result is empty, no destination found via API, redirect
+            #          to address form or prompt to API city-codes selector
+            # e=503  - API is offline. Skip this method.
+            # e=300  - Too many choices found, Result contains list of charges-codes.
+            #          Prompt to found dest-codes selector
+
+            # an URL for AJAXed city-to-city charge lookup
+            details_url = reverse_lazy('shipping:charge-details', kwargs={'slug': method.code})
+            # an URL for AJAXed code by city lookup using Select2 widget
+            lookup_url = reverse_lazy('shipping:city-lookup', kwargs={'slug': method.code})
+
+            # if options set make a short call to API for final calculation
+            if options:
+                fallback = None
+                origin_code, dest_code = options['senderCityId'], options['receiverCityId']
+                try:
+                    results, api_errors = facade.get_charge(origin_code, dest_code, packs,
+                                                            deadline=deadline)
+                    if api_errors:
+                        raise CalculationError("%s -> %s" % (origin_code, dest_code), api_errors)
+                except (RateLimitExceeded, DeadlineExceeded):
+                    # the order shouldn't fail because API is busy or slow right now
+                    fallback = method.get_fallback_charge(weight, packs, destination, use_rates=True)
+                    if fallback is None:
+                        errors.append(_(u"%s API is busy. Please, try again later.") % method.name)
+                        messages.append(_(u"Please, choose another shipping method!"))
+                except ApiOfflineError:
+                    fallback = method.get_fallback_charge(weight, packs, destination)
+                    if fallback is None:
+                        errors.append(_(u"""%s API is offline. Can't
+                                        calculate anything. Sorry!""") % method.name)
+                        messages.append(_(u"Please, choose another shipping method!"))
+                except CalculationError as e:
+                    fallback = method.get_fallback_charge(weight, packs, destination)
+                    if fallback is None:
+                        errors.append("Post-calculation error: %s" % e.errors)
+                        messages.append(e.title)
+                else:
+                    (charge, msg,
+                     err, extra_form) = facade.parse_results(results,
+                                                             options=options)
+                    if msg:
+                        messages.append(msg)
+                    if err:
+                        errors.append(err)
+                    else:
+                        provenance = ShippingQuote.LIVE
+                        services = facade.get_quote_services(results)
+                if fallback is not None:
+                    charge, msg, extra_form, provenance = fallback
+                    messages.append(msg)
+            else:
+                estimate = fallback = None
+                try:
+                    estimate = method.estimate_charge(weight, packs, destination=destination)
+                    if estimate is None:
+                        origin_code, dest_code = facade.get_city_codes(method.origin, destination,
+                                                                       deadline)
+                        results = facade.get_cached_quote(origin_code, dest_code, packs)
+                        provenance = ShippingQuote.CACHED
+                        if results is None:
+                            results = facade.get_charges(weight, packs, method.origin, destination,
+                                                         deadline=deadline)
+                            provenance = ShippingQuote.LIVE
+                except (RateLimitExceeded, DeadlineExceeded):
+                    # API is overloaded or too slow for now, answer from the rates table
+                    # or the last known good quote if possible
+                    fallback = method.get_fallback_charge(weight, packs, destination, use_rates=True)
+                    if fallback is None:
+                        errors.append(_(u"%s API is busy. Please, try again later.") % method.name)
+                        messages.append(_(u"Please, choose another shipping method!"))
+                except ApiOfflineError:
+                    fallback = method.get_fallback_charge(weight, packs, destination)
+                    if fallback is None:
+                        errors.append(_(u"""%s API is offline. Can't
+                                        calculate anything. Sorry!""") % method.name)
+                        messages.append(_(u"Please, choose another shipping method!"))
+                except OriginCityNotFoundError as e:
+                    # Paranoid mode as ImproperlyConfigured should be raised by facade
+                    errors.append(_(u"""City of origin '%s' not found
+                                      in the shipping company
+                                      postcodes to calculate charge.""") % e.title)
+                    messages.append(_(u"""It seems like we couldn't find code
+                                        for the city of origin (%s).
+                                        Please, select it manually, choose another
+                                        address or another shipping method.
+                                    """) % e.title)
+                except ImproperlyConfigured as e:  # upraised error handling
+                    errors.append("ImproperlyConfigured error (%s)" % e.message)
+                    messages.append("Please, select another shipping method or call site administrator!")
+                except CityNotFoundError as e:
+                    errors.append(_(u"""Can't find destination city '{title}'
+                                      to calculate charge.
+                                      Errors: {errors}""").format(title=e.title, errors=e.errors))
+                    messages.append(_(u"""It seems like we can't find code
+                                        for the city of destination (%s).
+                                        Please, choose
+                                        another address or another shipping method.
+                                    """) % e.title)
+                    if CHANGE_DESTINATION:
+                        messages.append(_("Also, you can choose city of destination manually"))
+                        extra_form = self.get_extra_form(lookup_url=lookup_url,
+                                                         details_url=details_url)
+                except TooManyFoundError as e:
+                    errors.append(_(u"Found too many destinations for given city (%s)") % e.title)
+                    if CHANGE_DESTINATION:
+                        messages.append(_("Please refine your shipping address"))
+                        extra_form = self.get_extra_form(choices=e.results,
+                                                         details_url=details_url)
+                except CalculationError as e:
+                    fallback = method.get_fallback_charge(weight, packs, destination)
+                    if fallback is None:
+                        errors.append(_(u"""Error occurred during charge
+                                        calculation for given city (%s)""") % e.title)
+                        messages.append(_(u"API error was: %s") % e.errors)
+                        if CHANGE_DESTINATION:
+                            extra_form = self.get_extra_form(details_url=details_url,
+                                                             lookup_url=lookup_url)
+                except:
+                    raise
+                else:
+                    if estimate is not None:
+                        origin_code, dest_code = estimate[2:]
+                        fallback = method.use_estimate(estimate)
+                    else:
+                        (charge, msgs, errs,
+                         extra_form, services) = self.parse_results(results, destination,
+                                                                    weight, packs, provenance)
+                        messages.extend(msgs)
+                        errors.extend(errs)
+                if fallback is not None:
+                    charge, msg, extra_form, provenance = fallback
+                    messages.append(msg)
+        if errors:
+            provenance = None
+
+        return ShippingQuote(method.code, charge, basket.currency,
+                             services=services,
+                             origin_code=origin_code,
+                             dest_code=dest_code,
+                             messages=messages,
+                             errors=errors,
+                             provenance=provenance,
+                             extra_form=extra_form)
+
+    def calculate_many(self, jobs, workers=BATCH_WORKERS):
+        """
+        Returns list of ShippingQuote for the jobs (basket, destination, options) given.
+        Every basket is weighed and packed once, identical routes and packs
+        are quoted once, the rest API calls are sent concurrently.
+        """
+        method, facade = self.method, self.facade
+        deadline = self.get_deadline()
+        quotes = [None] * len(jobs)
+        profiles = {}
+        requests = []
+        for i, (basket, destination, options) in enumerate(jobs):
+            key = basket.pk or id(basket)
+            if key not in profiles:
+                profiles[key] = self.get_profile(basket)
+            weight, packs = profiles[key]
+            if options or not destination:
+                quotes[i] = self.calculate_job(basket, destination, options, profiles[key])
+                continue
+            try:
+                estimate = method.estimate_charge(weight, packs, destination=destination)
+                if estimate is None:
+                    origin_code, dest_code = facade.get_city_codes(method.origin, destination,
+                                                                   deadline)
+            except (FacadeError, ImproperlyConfigured):
+                # errors are reported the same way as for the single basket
+                quotes[i] = self.calculate_job(basket, destination, options, profiles[key])
+                continue
+            except Exception as e:
+                # the rest jobs are quoted anyway
+                logger.exception("Can't resolve codes for %s by %s", destination, method.code)
+                quotes[i] = self.make_error_quote(basket, destination, weight, e)
+                continue
+            if estimate is not None:
+                quotes[i] = self.make_fallback_quote(basket, destination, weight,
+                                                     method.use_estimate(estimate),
+                                                     *estimate[2:])
+                continue
+            requests.append((origin_code, dest_code, packs, i, weight))
+
+        cached, pending = facade.split_cached_requests(requests)
+        for request, results in cached:
+            quotes[request[3]] = self.make_batch_quote(jobs[request[3]], request, results, None,
+                                                       ShippingQuote.CACHED)
+        for reqs, results, errors in facade.quote_requests(pending, workers):
+            for request in reqs:
+                quotes[request[3]] = self.make_batch_quote(jobs[request[3]], request, results, errors,
+                                                           ShippingQuote.LIVE)
+        return quotes
+
+    def calculate_job(self, basket, destination, options, profile):
+        try:
+            return self.calculate(basket, destination, options, profile)
+        except Exception as e:
+            logger.exception("Can't calculate charge for %s by %s", destination, self.method.code)
+            return self.make_error_quote(basket, destination, profile[0], e)
+
+    def make_error_quote(self, basket, destination, weight, errors,
+                         origin_code=None, dest_code=None):
+        return ShippingQuote(self.method.code, D('0.0'), basket.currency,
+                             origin_code=origin_code,
+                             dest_code=dest_code,
+                             messages=[self.get_route_message(weight, destination),
+                                       _(u"API error was: %s") % errors],
+                             errors=[_(u"""Error occurred during charge
+                                       calculation for given city (%s)""") % getattr(destination, 'city',
+                                                                                    destination)])
+
+    def make_fallback_quote(self, basket, destination, weight, fallback,
+                            origin_code=None, dest_code=None):
+        charge, msg, extra_form, provenance = fallback
+        return ShippingQuote(self.method.code, charge, basket.currency,
+                             origin_code=origin_code,
+                             dest_code=dest_code,
+                             messages=[self.get_route_message(weight, destination), msg],
+                             provenance=provenance,
+                             extra_form=extra_form)
+
+    def make_batch_quote(self, job, request, results, errors, provenance):
+        basket, destination, options = job
+        origin_code, dest_code, packs, i, weight = request
+        if errors:
+            fallback = self.method.get_fallback_charge(weight, packs, destination)
+            if fallback is not None:
+                return self.make_fallback_quote(basket, destination, weight, fallback,
+                                                origin_code, dest_code)
+            return self.make_error_quote(basket, destination, weight, errors,
+                                         origin_code, dest_code)
+        (charge, messages, errs,
+         extra_form, services) = self.parse_results(results, destination, weight, packs, provenance)
+        return ShippingQuote(self.method.code, charge, basket.currency,
+                             services=services,
+                             origin_code=origin_code,
+                             dest_code=dest_code,
+                             messages=[self.get_route_message(weight, destination)] + messages,
+                             errors=errs,
+                             provenance=None if errs else provenance,
+                             extra_form=extra_form)
@@ -8,6 +8,8 @@ from oscar.apps.checkout import exceptions
 from oscar.core.loading import get_class
 
 from oscar_shipping.methods import is_prepaid_shipping
+from oscar_shipping.calculator import CHECKOUT_DEADLINE
+from oscar_shipping.utils import Deadline
 
 Repository = get_class('shipping.repository', 'Repository')
 
@@ -25,13 +27,52 @@ class CheckoutSessionMixin(CoreCheckoutSessionMixin):
         # and the shipping address (so we pass all these things to the
         # repository).  I haven't come across a scenario that doesn't fit this
         # system.
-        return Repository().get_shipping_methods(
+        methods = Repository().get_shipping_methods(
             basket=self.request.basket, user=self.request.user,
             shipping_addr=self.get_shipping_address(self.request.basket),
             request=self.request)
+        return self.use_shipping_deadline(methods)
+
+    def get_shipping_method(self, basket, shipping_address=None, **kwargs):
+        method = super(CheckoutSessionMixin, self).get_shipping_method(
+            basket, shipping_address, **kwargs)
+        if method is not None:
+            self.use_shipping_deadline([method])
+        return method
+
+    def get_shipping_deadline(self):
+        """
+        Returns the Deadline shared by all charge calculations of the request,
+        so the page waits for CHECKOUT_DEADLINE at most, not for every method in turn
+        """
+        if not CHECKOUT_DEADLINE:
+            return None
+        deadline = getattr(self.request, '_shipping_deadline', None)
+        if deadline is None:
+            deadline = self.request._shipping_deadline = Deadline(CHECKOUT_DEADLINE)
+        return deadline
+
+    def use_shipping_deadline(self, methods):
+        deadline = self.get_shipping_deadline()
+        for m in methods:
+            # API-based methods only
+            if hasattr(m, 'deadline'):
+                m.deadline = deadline
+        return methods
 
     def get_shipping_kwargs(self):
         return self.checkout_session._get('shipping', 'options')
+
+    def calculate_shipping_charge(self, method, basket):
+        """
+        Returns the final charge of the method chosen. The calculation
+        has its own deadline, it's not limited by the time left after
+        the methods listing of the request
+        """
+        if hasattr(method, 'deadline'):
+            method.deadline = Deadline(CHECKOUT_DEADLINE) if CHECKOUT_DEADLINE else None
+        shipping_kwargs = self.get_shipping_kwargs()
+        return method.calculate(basket, shipping_kwargs or None)
     
     def get_shipping_charge(self, basket):
         shipping_charge = prices.Price(
@@ -40,8 +81,7 @@ class CheckoutSessionMixin(CoreCheckoutSessionMixin):
         shipping_method = self.get_shipping_method(
             basket, shipping_address)
         if shipping_method:
-            shipping_kwargs = self.get_shipping_kwargs()
-            shipping_charge = shipping_method.calculate(basket, shipping_kwargs or None)
+            shipping_charge = self.calculate_shipping_charge(shipping_method, basket)
         else:
             # It's unusual to get here as a shipping method should be set by
             # the time this skip-condition is called. In the absence of any
@@ -84,7 +124,7 @@ class CheckoutSessionMixin(CoreCheckoutSessionMixin):
             # add shipping charge if only method has prepaid payment type set as true
             # or has not payment_type attr (for simple methods)
             if is_prepaid_shipping(shipping_method):
-                shipping_charge = shipping_method.calculate(basket, shipping_kwargs or None)
+                shipping_charge = self.calculate_shipping_charge(shipping_method, basket)
             total = self.get_order_totals(
                 basket, shipping_charge=shipping_charge)
         submission = {
@@ -21,6 +21,8 @@ OSCAR_SHIPPING_VOLUME_RATIO = D('1.3')
 # default city of origin to calculate shipping cost via APIs
 OSCAR_SHIPPING_DEFAULT_ORIGIN = u'Санкт-Петербург'
 
+# facades are imported on first use only. Third-party facades registered
+# via 'oscar_shipping.facades' entry points should be listed here too
 OSCAR_SHIPPING_API_ENABLED = ['pecom', 'emspost']
 
 # Workaround for javascripted form fields (such as KLADR) which should be cleaned before, e.g. "г. Москва" -> "Москва"
@@ -33,4 +35,125 @@ OSCAR_SHIPPING_LIST_SEPARATOR = ';'
 OSCAR_SHIPPING_CHANGE_DESTINATION = True
 
 # is method available or not if no destination's code found for charge calculation
-OSCAR_SHIPPING_IF_NOT_FOUND = True
\ No newline at end of file
+OSCAR_SHIPPING_IF_NOT_FOUND = True
+
+# carrier directories (branches, cities) cache lifetime, seconds.
+# Stale data (older than soft TTL) is served while being refreshed in background,
+# data older than hard TTL is dropped from the cache.
+OSCAR_SHIPPING_DIRECTORY_SOFT_TTL = 60 * 60 * 6
+OSCAR_SHIPPING_DIRECTORY_HARD_TTL = 60 * 60 * 24 * 7
+OSCAR_SHIPPING_DIRECTORY_REFRESH_TIMEOUT = 60 * 5
+
+# carrier API is considered broken after that number of failures in a row
+# and skipped by the background jobs for the cooldown period, seconds
+OSCAR_SHIPPING_CIRCUIT_FAILURES = 5
+OSCAR_SHIPPING_CIRCUIT_COOLDOWN = 60
+
+# warm_shipping_caches command: number of the most popular destinations
+# taken from the orders placed during the period given, days
+OSCAR_SHIPPING_WARM_TOP_DESTINATIONS = 100
+OSCAR_SHIPPING_WARM_PERIOD = 30
+
+# local directory to keep carrier directory snapshots in, e.g. os.path.join(BASE_DIR, 'var', 'shipping').
+# Snapshots are used on the empty cache instead of API calls, so workers start warm
+# and city lookups work during API outages. Disabled if None.
+OSCAR_SHIPPING_SNAPSHOT_DIR = None
+
+# large values (such as carrier directories) are stored in the cache
+# compressed and split into chunks of that size, bytes
+OSCAR_SHIPPING_CACHE_CHUNK_SIZE = 900 * 1024
+OSCAR_SHIPPING_CACHE_COMPRESS_LEVEL = 6
+
+# resolve destination city codes via local index over the cached carrier directory.
+# City names are compared case-insensitive, 'ё' = 'е', settlement types like "г." or "пос." are stripped.
+# API is called only if there is no exact match
+OSCAR_SHIPPING_LOCAL_CITY_MATCH = True
+
+# if there are some destination codes found for the city, the one matched address region (state)
+# is chosen. Region could be also guessed from postcode prefix using this mapping,
+# e.g. {'101': u'Москва', '19': u'Санкт-Петербург'}
+# Works for PEC only: EMS directory doesn't tell regions of the cities
+OSCAR_SHIPPING_POSTCODE_REGIONS = {}
+
+# use CarrierLocation table (see sync_carrier_locations command) for codes validation
+# and city lookups instead of scanning the cached carrier directories
+OSCAR_SHIPPING_USE_LOCATION_TABLE = False
+OSCAR_SHIPPING_SYNC_BATCH_SIZE = 500
+
+# resolve carriers' destination codes in background when user's or order's shipping address saved,
+# so checkout skips city resolution. Resolved codes are stored in the cache for the TTL, seconds
+OSCAR_SHIPPING_RESOLVE_ON_ADDRESS_SAVE = False
+OSCAR_SHIPPING_ADDRESS_CODES_TTL = 60 * 60 * 24 * 30
+
+# answer from the rates tables built by build_shipping_rates command if route is covered.
+# Charge is interpolated between weight bands and flagged as estimate
+OSCAR_SHIPPING_USE_RATE_TABLES = True
+# bands of the rates tables, kg and m3
+OSCAR_SHIPPING_RATE_WEIGHT_BANDS = (1, 3, 5, 10, 20, 30, 50, 100)
+OSCAR_SHIPPING_RATE_VOLUME_BANDS = ('0.01', '0.05', '0.1', '0.25', '0.5', '1')
+OSCAR_SHIPPING_RATE_TOP_DESTINATIONS = 50
+# rates are updated for the quoted bands only, nothing is stored if greater part of requests failed
+OSCAR_SHIPPING_RATE_MAX_FAILURES = 0.5
+
+# valid quotes are cached for that time, seconds
+OSCAR_SHIPPING_QUOTE_CACHE_TTL = 60 * 60
+# batch quoting (facade.get_charges_batch()): concurrent API calls and max calls per second
+OSCAR_SHIPPING_BATCH_WORKERS = 4
+OSCAR_SHIPPING_BATCH_RATE = 5
+
+# product page shipping estimates (shipping:estimate url): cache time, seconds, quantity bands
+# and whether call carrier's API (city lookups and quotes) if estimate is not found
+# in the rates tables and quotes cache. The endpoint is public, so it's off by default
+OSCAR_SHIPPING_ESTIMATE_CACHE_TTL = 60 * 60
+OSCAR_SHIPPING_ESTIMATE_QTY_BANDS = (1, 2, 3, 5, 10, 20, 50, 100)
+OSCAR_SHIPPING_ESTIMATE_LIVE_QUOTES = False
+
+# bulk_quote command reads, quotes and writes rows by chunks of that size
+OSCAR_SHIPPING_BULK_QUOTE_CHUNK_SIZE = 100
+
+# per-carrier token buckets shared by all workers: {<facade name>: (<calls per second>, <burst>)},
+# e.g. {'pecom': (5, 10)}, and how long to wait for a free token, seconds (checkout and background jobs)
+OSCAR_SHIPPING_RATE_LIMITS = {}
+OSCAR_SHIPPING_RATE_LIMIT_WAIT = 1.0
+OSCAR_SHIPPING_BACKGROUND_RATE_LIMIT_WAIT = 30.0
+
+# max time carrier API calls could take while charge is calculated at checkout, seconds.
+# Calls could be hedged: the same call is sent once more if there is no answer after
+# the delay given or 95th percentile of the recent calls latency if delay is None
+OSCAR_SHIPPING_CHECKOUT_DEADLINE = 5
+OSCAR_SHIPPING_HEDGE_REQUESTS = False
+OSCAR_SHIPPING_HEDGE_DELAY = None
+
+# last successful live quotes are stored per route and weight band and used
+# when API is offline, fails or too slow: max age of the quote, seconds, and markup (0.1 is +10%)
+OSCAR_SHIPPING_FALLBACK_QUOTES = True
+OSCAR_SHIPPING_FALLBACK_MAX_AGE = 60 * 60 * 24 * 7
+OSCAR_SHIPPING_FALLBACK_MARKUP = '0.1'
+OSCAR_SHIPPING_FALLBACK_WEIGHT_BANDS = (1, 3, 5, 10, 20, 30, 50, 100)
+
+# packer picks containers with the least chargeable weight, the greater of actual
+# and volumetric one: volume (cm3) / divisor, {<API type>: <divisor>}.
+# Basket could be packed to not more than max packs containers of the same type
+OSCAR_SHIPPING_VOLUMETRIC_DIVISORS = {'pecom': 4000, 'emspost': 5000}
+OSCAR_SHIPPING_MAX_PACKS = 10
+
+# EMS max parcel weight, kg. Heavier baskets are split to parcels quoted separately
+OSCAR_SHIPPING_EMS_MAX_WEIGHT = '31.5'
+
+# products' sizes and weights used by packer are cached for that time, seconds (0 disables the cache)
+OSCAR_SHIPPING_PRODUCT_PROFILE_TTL = 60 * 60 * 24 * 7
+
+# quote the basket in background for user's default shipping address when its lines
+# are added, changed or removed, so checkout renders from the quotes cache
+OSCAR_SHIPPING_PREQUOTE_ON_BASKET_CHANGE = False
+# basket changes made before the scheduled prequote task has started don't schedule
+# another one, unless task hasn't started within that time, seconds
+OSCAR_SHIPPING_PREQUOTE_DEBOUNCE = 30
+# dotted path to callable runner(func, *args) for background tasks (e.g. task queue wrapper),
+# None runs them in the local daemon thread. Tasks are sent once the transaction is committed,
+# Django without transaction.on_commit() (older than 1.9) doesn't run them at all
+OSCAR_SHIPPING_TASK_RUNNER = None
+
+# active methods configuration (incl. containers and destination lists) is cached
+# for that time, seconds (0 disables the cache). It's invalidated on any change anyway
+OSCAR_SHIPPING_METHODS_CACHE_TTL = 60 * 60 * 24
@@ -11,6 +11,31 @@ class ApiOfflineError(FacadeError):
     """
     pass
 
+class RateLimitExceeded(ApiOfflineError):
+    """Raised when no API call allowed by the rate limiter
+        during the wait budget given
+
+    Attributes:
+        title -- name of the facade
+    """
+    def __init__(self, title):
+        self.title = title
+
+    def __str__(self):
+        return "Rate limit of %s API exceeded" % self.title
+
+class DeadlineExceeded(ApiOfflineError):
+    """Raised when API didn't answer before the deadline
+
+    Attributes:
+        title -- name of the facade
+    """
+    def __init__(self, title):
+        self.title = title
+
+    def __str__(self):
+        return "%s API didn't answer in time" % self.title
+
 # WARNING! Inheriting exception classes may cause strange behavior
 # while raising it. 
 class CityNotFoundError(FacadeError):
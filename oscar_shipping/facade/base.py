@@ -1,4 +1,9 @@
 import json
+import time
+import hashlib
+import logging
+
+from collections import OrderedDict, namedtuple
 
 from decimal import Decimal as D
 
@@ -6,15 +11,42 @@ from django.conf import settings
 from django.core.cache import cache
 from django.core.exceptions import ImproperlyConfigured
 from django.utils.translation import ugettext_lazy as _
+from django.utils.encoding import force_text
+from django.utils import six
+from django.utils.six.moves import queue
+
+from oscar.core.loading import get_model
 
-from ..exceptions import (OriginCityNotFoundError,
+from ..utils import run_in_background, imap_concurrently, Throttle, LatencyTracker
+from ..cache import get_large, get_large_meta, set_large
+from ..ratelimit import get_bucket
+from ..snapshots import read_snapshot, write_snapshot
+from ..matching import CityIndex, narrow_by_region, normalize_city, normalize_region
+from ..exceptions import (FacadeError,
+                          RateLimitExceeded,
+                          DeadlineExceeded,
+                          OriginCityNotFoundError,
                           CityNotFoundError,
                           ApiOfflineError,
                           TooManyFoundError,
                           CalculationError)
 
+logger = logging.getLogger('oscar_shipping')
+
+# per-call charge request and result, immutable so could be shared between threads
+ChargeRequest = namedtuple('ChargeRequest', ('origin', 'dest', 'packs', 'options'))
+ChargeResult = namedtuple('ChargeResult', ('results', 'errors'))
+
 # local cache
 origin_code = {}
+# process-wide copies of decoded carrier directories {name: (updated, data)}
+directories = {}
+# process-wide city indexes over carrier directories {name: (updated, index)}
+city_indexes = {}
+# process-wide limiters of batch API calls {(name, rate): Throttle}
+throttles = {}
+# process-wide latencies of API calls {(name, method): LatencyTracker}
+latencies = {}
 
 # this is workaround for that cases when city name was filled in the shipping address form
 # via third-party plugins and APIs, such as KLADR-API or Dadata
@@ -23,6 +55,49 @@ origin_code = {}
 # So put this setting implicitly if you want enable this feature
 CITY_PREFIX_SEPARATOR = getattr(settings, 'OSCAR_CITY_PREFIX_SEPARATOR', None)
 
+# Carrier directories (branches, cities) are served from the cache
+# for the soft TTL, after that stale data still returned immediately
+# but refreshed in background. Only the empty cache blocks the request.
+DIRECTORY_SOFT_TTL = getattr(settings, 'OSCAR_SHIPPING_DIRECTORY_SOFT_TTL', 60 * 60 * 6)
+DIRECTORY_HARD_TTL = getattr(settings, 'OSCAR_SHIPPING_DIRECTORY_HARD_TTL', 60 * 60 * 24 * 7)
+# for how long other workers wait for the directory refresh started
+DIRECTORY_REFRESH_TIMEOUT = getattr(settings, 'OSCAR_SHIPPING_DIRECTORY_REFRESH_TIMEOUT', 60 * 5)
+
+# resolve city codes using local index over the cached directory,
+# API's findbytitle() is called only if there is no exact match
+LOCAL_CITY_MATCH = getattr(settings, 'OSCAR_SHIPPING_LOCAL_CITY_MATCH', True)
+
+# use CarrierLocation table synced by the sync_carrier_locations command
+# for codes validation and lookups instead of scanning the cached directory
+USE_LOCATION_TABLE = getattr(settings, 'OSCAR_SHIPPING_USE_LOCATION_TABLE', False)
+
+# for how long destination codes resolved for addresses are stored, seconds
+ADDRESS_CODES_TTL = getattr(settings, 'OSCAR_SHIPPING_ADDRESS_CODES_TTL', 60 * 60 * 24 * 30)
+
+# successful quotes are cached for that time, seconds
+QUOTE_CACHE_TTL = getattr(settings, 'OSCAR_SHIPPING_QUOTE_CACHE_TTL', 60 * 60)
+
+# batch quoting: number of concurrent API calls and max calls per second per carrier
+BATCH_WORKERS = getattr(settings, 'OSCAR_SHIPPING_BATCH_WORKERS', 4)
+BATCH_RATE = getattr(settings, 'OSCAR_SHIPPING_BATCH_RATE', 5)
+
+# for how long API call waits for the rate limiter token, seconds.
+# RateLimitExceeded raised if no token could be taken in time
+RATE_LIMIT_WAIT = getattr(settings, 'OSCAR_SHIPPING_RATE_LIMIT_WAIT', 1.0)
+# the same for background jobs (management commands etc)
+BACKGROUND_RATE_LIMIT_WAIT = getattr(settings, 'OSCAR_SHIPPING_BACKGROUND_RATE_LIMIT_WAIT', 30.0)
+
+# API calls made with a deadline could be hedged: the same call is sent once more
+# if there is no answer after the delay given (seconds) or 95th percentile
+# of the recent calls latency if delay isn't set. The first answer is used.
+HEDGE_REQUESTS = getattr(settings, 'OSCAR_SHIPPING_HEDGE_REQUESTS', False)
+HEDGE_DELAY = getattr(settings, 'OSCAR_SHIPPING_HEDGE_DELAY', None)
+
+# Circuit breaker: after that number of API failures in a row the carrier
+# is considered broken for the cooldown period (seconds)
+CIRCUIT_FAILURES = getattr(settings, 'OSCAR_SHIPPING_CIRCUIT_FAILURES', 5)
+CIRCUIT_COOLDOWN = getattr(settings, 'OSCAR_SHIPPING_CIRCUIT_COOLDOWN', 60)
+
 
 class AbstractShippingFacade(object):
     
@@ -30,27 +105,179 @@ class AbstractShippingFacade(object):
     # should be initiated in __init__
     api = None 
     name = ''
+    # timestamp of the directory returned by get_all_branches() last time
+    branches_updated = None
+    # could be increased for background jobs
+    rate_limit_wait = RATE_LIMIT_WAIT
+
+    def call_api(self, method, *args, **kwargs):
+        """
+            Calls API method given when rate limiter allows.
+            If deadline keyword argument is set the call is made in the separate
+            thread and DeadlineExceeded raised if API hasn't answered in time,
+            hedged call is sent if the first one is too slow (see get_hedge_delay()).
+        """
+        deadline = kwargs.pop('deadline', None)
+        wait = self.rate_limit_wait
+        if deadline is not None:
+            if deadline.expired():
+                raise DeadlineExceeded(self.name)
+            wait = min(wait, deadline.remaining())
+        bucket = get_bucket(self.name)
+        if not bucket.acquire(wait):
+            raise RateLimitExceeded(self.name)
+        if deadline is None:
+            return self.timed_call(method, *args, **kwargs)
+
+        answers = queue.Queue()
+
+        def call():
+            try:
+                answers.put((True, self.timed_call(method, *args, **kwargs)))
+            except Exception as e:
+                answers.put((False, e))
+
+        # calls which missed the deadline are left to finish in background
+        run_in_background(call)
+        hedge_delay = self.get_hedge_delay(method)
+        try:
+            if hedge_delay is not None and hedge_delay < deadline.remaining():
+                try:
+                    ok, res = answers.get(timeout=hedge_delay)
+                except queue.Empty:
+                    # hedged call is never sent beyond the rate limit
+                    if bucket.acquire(0):
+                        run_in_background(call)
+                    ok, res = answers.get(timeout=deadline.remaining())
+            else:
+                ok, res = answers.get(timeout=deadline.remaining())
+        except queue.Empty:
+            self.record_failure()
+            raise DeadlineExceeded(self.name)
+        if not ok:
+            raise res
+        return res
 
-    def get_cached_origin_code(self, origin):
+    def call_lookup_api(self, method, *args, **kwargs):
+        """
+            call_api() for directory and lookup methods answering (result, errors):
+            rate limiter and deadline failures are returned as errors, so
+            callers degrade the same way as on API errors
+        """
+        try:
+            return self.call_api(method, *args, **kwargs)
+        except ApiOfflineError as e:
+            return None, e
+
+    def create_api(self):
+        """
+            Returns new instance of the API client. SDK clients aren't
+            thread-safe, so every call in flight (hedged, abandoned after
+            the deadline or batch ones) takes its own client.
+            Subclasses should implement it, the only client is shared otherwise.
+        """
+        return self.api
+
+    def acquire_api(self):
+        pool = self.__dict__.get('_api_pool')
+        if pool is None:
+            pool = self.__dict__.setdefault('_api_pool', queue.Queue())
+            pool.put(self.api)
+        try:
+            return pool.get_nowait()
+        except queue.Empty:
+            return self.create_api()
+
+    def release_api(self, api):
+        self._api_pool.put(api)
+
+    def timed_call(self, method, *args, **kwargs):
+        started = time.time()
+        api = self.acquire_api()
+        try:
+            res = getattr(api, method)(*args, **kwargs)
+        except Exception:
+            self.record_failure()
+            raise
+        finally:
+            self.release_api(api)
+        latencies.setdefault((self.name, method), LatencyTracker()).add(time.time() - started)
+        if self.is_failed_answer(res):
+            self.record_failure()
+        else:
+            self.record_success()
+        return res
+
+    def is_failed_answer(self, res):
+        """
+            Returns True if API answer means carrier is unavailable.
+            SDKs return tuples (result, errors) with the exception
+            as errors if API couldn't be reached.
+        """
+        return isinstance(res, tuple) and len(res) == 2 and isinstance(res[1], Exception)
+
+    def get_hedge_delay(self, method):
+        """
+            Returns delay (seconds) to send hedged call after
+            or None if calls shouldn't be hedged
+        """
+        if not HEDGE_REQUESTS:
+            return None
+        if HEDGE_DELAY is not None:
+            return HEDGE_DELAY
+        tracker = latencies.get((self.name, method))
+        return tracker.percentile(95) if tracker else None
+
+    def get_circuit_cache_key(self):
+        return "%s_circuit" % self.name
+
+    def is_circuit_open(self):
+        return (cache.get(self.get_circuit_cache_key()) or 0) >= CIRCUIT_FAILURES
+
+    def record_failure(self):
+        cache_key = self.get_circuit_cache_key()
+        # counter expires in CIRCUIT_COOLDOWN after the first failure
+        if not cache.add(cache_key, 1, CIRCUIT_COOLDOWN):
+            try:
+                cache.incr(cache_key)
+            except ValueError:
+                pass
+
+    def record_success(self):
+        # failures are counted in a row, any successful call resets the counter
+        cache.delete(self.get_circuit_cache_key())
+
+    def get_cached_origin_code(self, origin, deadline=None):
         code = None
         cache_key = ':'.join([self.name, origin])
+        shared_key = ':'.join([self.name, 'origin', origin])
         try:
             code = origin_code[cache_key]
         except KeyError:
-            pass
+            code = cache.get(shared_key)
         if code:
+            origin_code[cache_key] = code
             return code
         else:
-            cities, error = self.api.findbytitle(origin)
+            cities, error = self.call_lookup_api('findbytitle', origin, deadline=deadline)
+            if isinstance(error, ApiOfflineError):
+                # origin is fine, API just can't answer right now
+                raise error
             if not error and len(cities) > 0:
                 # WARNING! The only first found code used as origin
                 origin_code[cache_key] = cities[0][0]
+                cache.set(shared_key, origin_code[cache_key], DIRECTORY_HARD_TTL)
                 return origin_code[cache_key]
             else:
                 raise ImproperlyConfigured("It seems like origin point '%s'"
                                            "could'nt be validated for the method. Errors: %s" % (origin, error))
 
-    def get_cached_codes(self, city):
+    def get_cached_codes(self, city, use_api=True, deadline=None):
+        """
+            Returns tuple (codes, errors) of the city given, errors are
+            API records if some codes found. Only cache and local index
+            are searched if use_api is False.
+        """
         errors = False
         codes = []
         res = []
@@ -58,7 +285,11 @@ class AbstractShippingFacade(object):
         
         res = cache.get(cache_key)  # should returns list of tuples like facade do but as json
         if not res:
-            res, errors = self.api.findbytitle(city)
+            res = self.match_city(city, deadline)
+            if res is None and not use_api:
+                return [], False
+            if res is None:
+                res, errors = self.call_lookup_api('findbytitle', city, deadline=deadline)
             if not errors:
                 cache.set(cache_key, json.dumps(res))
             else:
@@ -73,6 +304,53 @@ class AbstractShippingFacade(object):
         
         return codes, errors
 
+    def get_city_records(self):
+        """
+            Returns carrier's directory as list of tuples
+            (<city code>, <city title>, <branch title or type>)
+            like API's findbytitle() do.
+
+            Subclasses should implement it.
+        """
+        raise NotImplementedError
+
+    def get_record_region(self, record):
+        """
+            Returns region-like title of the directory record
+            (see get_city_records()) used for disambiguation.
+            Carriers' branches usually named after region capitals.
+        """
+        return record[2]
+
+    def get_city_index(self, deadline=None):
+        """
+            Returns local CityIndex over the cached directory
+            or None if directory is not available
+        """
+        qs = self.get_all_branches(deadline)
+        if not qs or not isinstance(qs, list):
+            return None
+        try:
+            updated, index = city_indexes[self.name]
+        except KeyError:
+            updated = index = None
+        if index is None or updated != self.branches_updated:
+            index = CityIndex(self.get_city_records())
+            city_indexes[self.name] = (self.branches_updated, index)
+        return index
+
+    def match_city(self, city, deadline=None):
+        """
+            Returns list of directory records matched the city given
+            or None if local index is unsure and API should be called
+        """
+        if not LOCAL_CITY_MATCH:
+            return None
+        index = self.get_city_index(deadline)
+        if index is None:
+            return None
+        return index.lookup(city)
+
     def clean_city_name(self, city):
         if CITY_PREFIX_SEPARATOR:
             try:
@@ -82,48 +360,159 @@ class AbstractShippingFacade(object):
                 pass
         return city
 
-    def get_city_codes(self, origin, dest):
+    def get_address_cache_key(self, addr):
+        # addresses of the same city, region and postcode share the code
+        key = u'|'.join([normalize_city(self.clean_city_name(addr.line4 or '')),
+                         u' '.join(normalize_region(getattr(addr, 'state', ''))),
+                         force_text(getattr(addr, 'postcode', '') or '').strip()])
+        return "%s_address:%s" % (self.name, hashlib.md5(key.encode('utf-8')).hexdigest())
+
+    def get_stored_code(self, addr):
         """
-            Returns tuple of verified origin and destination codes
+            Returns destination code resolved for the address before
+        """
+        if not getattr(addr, 'line4', None):
+            return None
+        return cache.get(self.get_address_cache_key(addr))
+
+    def store_code(self, addr, code):
+        if getattr(addr, 'line4', None):
+            cache.set(self.get_address_cache_key(addr), code, ADDRESS_CODES_TTL)
+
+    def resolve_address_code(self, addr):
+        """
+            Resolves and stores destination code for the address given,
+            so checkout skips city resolution. Returns code or None.
+        """
+        try:
+            return self.get_dest_code(addr)
+        except (CityNotFoundError, TooManyFoundError):
+            return None
+
+    def get_dest_code(self, dest, deadline=None):
+        """
+            Returns verified destination code for the code or address given
         """
-        origin_code = None # city or branch code 
         dest_codes = []    # city or branch codes list
-        calc_result = err = errors = None
+        errors = None
         city = ''
+        region = None
 
-        origin_code = self.validate_code(origin) or self.get_cached_origin_code(origin)
-        if origin_code is None:
-            raise OriginCityNotFoundError(origin)
-        
-        dest_codes.append(self.validate_code(dest))
+        code = self.get_stored_code(dest)
+        if code:
+            return code
+
+        dest_codes.append(self.validate_code(dest, deadline))
         if not dest_codes[0]:
             city = dest.line4
             region = dest.state        
             if not city:
                 raise CityNotFoundError('city_not_set')
-            dest_codes, errors = self.get_cached_codes(self.clean_city_name(city))
+            dest_codes, errors = self.get_cached_codes(self.clean_city_name(city),
+                                                       deadline=deadline)
+            if isinstance(errors, ApiOfflineError):
+                # city is unknown as API is busy or too slow, not missing
+                raise errors
         
         if not dest_codes:
             raise CityNotFoundError(city or dest, errors)
-        if len(dest_codes) > 1: 
-            raise TooManyFoundError(city or dest, errors)
+        if len(dest_codes) > 1:
+            # try to choose the only destination by address region or postcode
+            found = narrow_by_region(errors, region, getattr(dest, 'postcode', None),
+                                     get_region=self.get_record_region)
+            if len(found) != 1:
+                raise TooManyFoundError(city or dest, found)
+            code = found[0][0]
         else:
-            return origin_code, dest_codes[0]
+            code = dest_codes[0]
+        self.store_code(dest, code)
+        return code
 
-    def get_all_branches(self):
-        cache_key = "%s_branches" % self.name
-        errors = False
-        res = cache.get(cache_key)
+    def get_city_codes(self, origin, dest, deadline=None):
+        """
+            Returns tuple of verified origin and destination codes.
+            Lookups are made with the deadline given.
+        """
+        origin_code = None # city or branch code 
+
+        origin_code = (self.validate_code(origin, deadline) or
+                       self.get_cached_origin_code(origin, deadline))
+        if origin_code is None:
+            raise OriginCityNotFoundError(origin)
+        
+        return origin_code, self.get_dest_code(dest, deadline)
+
+    def get_branches_cache_key(self):
+        return "%s_branches" % self.name
+
+    def fetch_branches(self, deadline=None):
+        """
+            Loads carrier's directory via API and puts it into the cache.
+            Returns tuple (result, errors) like API do.
+        """
+        res, errors = self.call_lookup_api('get_branches', deadline=deadline)
+        if not errors:
+            updated = self.branches_updated = time.time()
+            self.store_branches(updated, res)
+            write_snapshot(self.name, res, updated)
+        return res, errors
+
+    def refresh_branches(self):
+        """
+            Refreshes stale directory. Only one refresh runs at once,
+            the lock expires by itself if refresh failed so next attempt
+            will be made not earlier than DIRECTORY_REFRESH_TIMEOUT.
+        """
+        res, errors = self.fetch_branches()
+        if not errors:
+            cache.delete(self.get_branches_cache_key() + '_refresh')
+
+    def store_branches(self, updated, data):
+        # directory timestamp is kept in the manifest, so readers
+        # decode directory only if it was changed
+        set_large(self.get_branches_cache_key(),
+                  {'ts': updated, 'data': data},
+                  DIRECTORY_HARD_TTL,
+                  meta={'ts': updated})
+        directories[self.name] = (updated, data)
+
+    def read_branches(self):
+        """
+            Returns tuple (updated, data) of the cached directory or None.
+            Process-wide decoded copy is used while cached directory isn't changed.
+        """
+        cache_key = self.get_branches_cache_key()
+        meta = get_large_meta(cache_key)
+        local = directories.get(self.name)
+        if meta is not None and local is not None and local[0] == meta['ts']:
+            return local
+        res = get_large(cache_key)
         if not res:
-            res, errors = self.api.get_branches()
-            if not errors:
-                cache.set(cache_key, json.dumps(res))
-            else:
-                res = []
+            return None
+        directories[self.name] = (res['ts'], res['data'])
+        return directories[self.name]
+
+    def get_all_branches(self, deadline=None):
+        cache_key = self.get_branches_cache_key()
+        errors = False
+        # directories are too large to be stored as a single cache item
+        res = self.read_branches()
+        if res:
+            updated, res = res
         else:
-            res = json.loads(res)
-        
-        return errors or res
+            # try local snapshot before calling API
+            snapshot = read_snapshot(self.name)
+            if snapshot is None:
+                res, errors = self.fetch_branches(deadline)
+                # callers iterate the directory, so nothing is returned on errors
+                return [] if errors else res
+            updated, res = snapshot
+            self.store_branches(updated, res)
+        self.branches_updated = updated
+        if time.time() - updated > DIRECTORY_SOFT_TTL:
+            if cache.add(cache_key + '_refresh', 1, DIRECTORY_REFRESH_TIMEOUT):
+                run_in_background(self.refresh_branches)
+        return res
 
     def get_by_code(self, code):
         """
@@ -143,27 +532,151 @@ class AbstractShippingFacade(object):
         """
         pass
 
-    def validate_code(self, code):
+    def validate_code(self, code, deadline=None):
         """
             Returns False if code is not valid PEC city code,
-            if not, returns code casted to int
+            if not, returns code casted to int.
+            Directory is loaded with the deadline given if not cached.
             
             Subclasses should implement it.
         """
         raise NotImplementedError
     
-    def get_charges(self, weight, packs, origin, dest):
+    def get_charges(self, weight, packs, origin, dest, deadline=None):
         """
             Subclasses should implement it.
+            API calls should be made with deadline given (see call_api()).
         """
         raise NotImplementedError
     
-    def get_charge(self, origin, dest, packs, options=None):
+    def get_charge(self, origin, dest, packs, options=None, deadline=None):
         """
+            Returns ChargeResult for the route and packs given.
+            Subclasses should implement it.
+        """
+        raise NotImplementedError
+
+    def build_charge_options(self, request):
+        """
+            Returns new dict of API calculation options for the ChargeRequest given.
+            Neither module-wide defaults nor request options should be modified.
+
             Subclasses should implement it.
         """
         raise NotImplementedError
     
+    def get_packs_signature(self, packs):
+        """
+            Returns json-serializable list describing packs
+            so identical requests could be found
+        """
+        return [[force_text(p['weight']),
+                 force_text(p['container'].length),
+                 force_text(p['container'].width),
+                 force_text(p['container'].height)] for p in packs]
+
+    def get_quote_cache_key(self, origin, dest, packs):
+        key = json.dumps([force_text(origin), force_text(dest), self.get_packs_signature(packs)])
+        return "%s_quote:%s" % (self.name, hashlib.md5(key.encode('utf-8')).hexdigest())
+
+    def get_cached_charge(self, origin, dest, packs, deadline=None):
+        """
+            get_charge() backed by the quote cache.
+            Returns tuple (results, errors) like get_charge() do.
+        """
+        res = self.get_cached_quote(origin, dest, packs)
+        if res is not None:
+            return ChargeResult(res, None)
+        res, errors = self.get_charge(origin, dest, packs, deadline=deadline)
+        # only valid quotes are cached
+        if not errors and self.get_quote_charge(res) is not None:
+            cache.set(self.get_quote_cache_key(origin, dest, packs), json.dumps(res), QUOTE_CACHE_TTL)
+        return ChargeResult(res, errors)
+
+    def get_cached_quote(self, origin, dest, packs):
+        """
+            Returns results of the valid quote cached or None
+        """
+        res = cache.get(self.get_quote_cache_key(origin, dest, packs))
+        return json.loads(res) if res is not None else None
+
+    def get_batch_charge(self, origin, dest, packs):
+        """
+            Calls get_charge() for batch quoting.
+            Returns tuple (results, errors) where errors set
+            if API returned no valid quote.
+
+            Subclasses should implement it.
+        """
+        raise NotImplementedError
+
+    def get_charges_batch(self, requests, workers=BATCH_WORKERS, rate=BATCH_RATE):
+        """
+            Quotes many requests at once. Requests should be tuples like
+            (<origin code>, <destination code>, <packs>, ...), extra items
+            are ignored but request is yielded back as is.
+            Identical requests are quoted once, cached ones are served from the cache,
+            the rest are sent concurrently not faster than rate calls per second.
+            Yields tuples (request, results, errors) as soon as they're ready.
+        """
+        cached, pending = self.split_cached_requests(requests)
+        for r, res in cached:
+            yield r, res, None
+        for reqs, res, errors in self.quote_requests(pending, workers, rate):
+            for r in reqs:
+                yield r, res, errors
+
+    def split_cached_requests(self, requests):
+        """
+            Groups identical requests and looks them up in the quote cache at once.
+            Returns tuple of lists ([(request, results)], [(cache key, [requests])])
+            of the cached requests and the groups to be quoted via API.
+        """
+        groups = OrderedDict()
+        for r in requests:
+            groups.setdefault(self.get_quote_cache_key(*r[:3]), []).append(r)
+
+        found, pending = [], []
+        cached = cache.get_many(list(groups.keys()))
+        for cache_key, reqs in groups.items():
+            if cache_key in cached:
+                res = json.loads(cached[cache_key])
+                found.extend([(r, res) for r in reqs])
+            else:
+                pending.append((cache_key, reqs))
+        return found, pending
+
+    def quote_requests(self, pending, workers=BATCH_WORKERS, rate=BATCH_RATE):
+        """
+            Quotes groups of identical requests returned by split_cached_requests()
+            concurrently. Yields tuples ([requests], results, errors).
+        """
+        if not pending:
+            return
+        # batches sent with different rates are throttled separately
+        key = (self.name, rate)
+        throttle = throttles.get(key)
+        if throttle is None:
+            throttle = throttles.setdefault(key, Throttle(rate))
+
+        def quote(item):
+            cache_key, reqs = item
+            throttle.wait()
+            try:
+                res, errors = self.get_batch_charge(*reqs[0][:3])
+            except FacadeError as e:
+                res, errors = None, e
+            except Exception as e:
+                # SDK errors are reported per request, the rest of batch goes on
+                logger.exception("%s batch quote failed", self.name)
+                res, errors = None, e
+            if not errors:
+                cache.set(cache_key, json.dumps(res), QUOTE_CACHE_TTL)
+            return reqs, res, errors
+
+        for res in imap_concurrently(quote, pending, workers):
+            yield res
+
     def parse_results(self, results, **kwargs):
         """
             Parses results returned by get_charges() method.
@@ -174,6 +687,31 @@ class AbstractShippingFacade(object):
         """
         raise NotImplementedError
     
+    def get_quote_charge(self, results):
+        """
+            Returns tuple (charge, service) of the cheapest service
+            from the results returned by get_charge() or None.
+
+            Subclasses should implement it.
+        """
+        raise NotImplementedError
+
+    def get_quote_services(self, results):
+        """
+            Returns list of tuples (service, charge) offered by the carrier
+            in the results returned by get_charge()
+        """
+        quote = self.get_quote_charge(results)
+        return [(quote[1], quote[0])] if quote is not None else []
+
+    def get_estimate_form(self, origin_code, dest_code, service=None):
+        """
+            Returns extra form for the charge estimated using rates table
+            so the same codes are used for the final calculation
+        """
+        return self.get_extra_form(initial={'senderCityId': origin_code,
+                                            'receiverCityId': dest_code})
+
     def get_queryset(self):
         """ Return normalized queryset-like list of dicts
             { 'id' : <city code>, 'branch' : <branch title>, 'text': <city title> }
@@ -198,3 +736,48 @@ class AbstractShippingFacade(object):
             Subclasses should implement it.
         """
         raise NotImplementedError
+
+    def iter_locations(self):
+        """ Yields directory entries as dicts
+            { 'code' : <city code>, 'title' : <city title>,
+              'region' : <region or branch title>, 'parent_code' : <branch code> }
+            to be stored in the CarrierLocation table.
+
+            Subclasses should implement it.
+        """
+        raise NotImplementedError
+
+    def location_to_dict(self, location):
+        """ Converts CarrierLocation instance to the dict
+            like get_queryset() returns.
+
+            Subclasses should implement it.
+        """
+        raise NotImplementedError
+
+    def get_locations(self):
+        """ Returns CarrierLocation queryset for the carrier
+            or None if location table is not used
+        """
+        if not USE_LOCATION_TABLE:
+            return None
+        CarrierLocation = get_model('shipping', 'CarrierLocation')
+        return CarrierLocation.objects.for_carrier(self.name)
+
+    def get_location(self, code):
+        qs = self.get_locations()
+        if qs is None or not isinstance(code, six.string_types + six.integer_types):
+            return None
+        return qs.filter(code=force_text(code)).first()
+
+    def lookup(self, term):
+        """ Returns normalized queryset-like list of dicts (see get_queryset())
+            for the cities matched the term given.
+            Titles are matched by prefix in the location table to use the index.
+        """
+        qs = self.get_locations()
+        if qs is not None:
+            qs = qs.filter(title_normalized__startswith=normalize_city(term))
+            return [self.location_to_dict(l) for l in qs]
+        term = term.lower()
+        return [i for i in self.get_queryset() if term in i['text'].lower()]
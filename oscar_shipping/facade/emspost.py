@@ -1,8 +1,10 @@
+import copy
 import json
 import itertools
 
 from decimal import Decimal as D
 
+from django.conf import settings
 from django.core.cache import cache
 from django.core.exceptions import ImproperlyConfigured
 from django.template.loader import render_to_string
@@ -11,8 +13,9 @@ from django.utils.html import format_html_join
 
 from emspost_api import emspost
 
-from ..utils import del_key
-from .base import AbstractShippingFacade
+from ..utils import del_key, imap_concurrently
+from ..packers import Container
+from .base import AbstractShippingFacade, ChargeRequest, ChargeResult
 from ..exceptions import ( OriginCityNotFoundError, 
                            CityNotFoundError, 
                            ApiOfflineError, 
@@ -31,6 +34,13 @@ API_OBJ_TYPES = {'cities'   : _("Russian Cities"),
 
 precision = D('0.0000')
 
+# EMS accepts parcels not heavier than that, kg. Heavier baskets are
+# split to max weight parcels and the rest one and quoted parcel by parcel
+MAX_PARCEL_WEIGHT = D(getattr(settings, 'OSCAR_SHIPPING_EMS_MAX_WEIGHT', '31.5'))
+
+# EMS charges by weight only, so any container fits for parcel quotes
+PARCEL_CONTAINER = Container(0, 0, 0, 'EMS parcel')
+
 class ShippingFacade(AbstractShippingFacade):
     name = 'emspost'
     messages_template = "oscar_shipping/partials/emspost_messages.html"
@@ -38,12 +48,17 @@ class ShippingFacade(AbstractShippingFacade):
     def __init__(self, api_user=None, api_key=None):
         self.api = emspost.EmsAPI()
 
-    def validate_code(self, code):
+    def create_api(self):
+        return emspost.EmsAPI()
+
+    def validate_code(self, code, deadline=None):
         """
             Returns False if code is not valid PEC city code,
             if not, returns code casted to int
         """
-        qs = self.get_all_branches()
+        if self.get_location(code) is not None:
+            return code
+        qs = self.get_all_branches(deadline)
         if code in [i[0] for i in qs]:
             return code
         return None
@@ -53,6 +68,9 @@ class ShippingFacade(AbstractShippingFacade):
             Returns city or branch title if code valid EMS city code,
             if not, returns None
         """
+        location = self.get_location(code)
+        if location is not None:
+            return location.title
         qs = self.get_all_branches()
         for i in qs:
             if i[0] == code:
@@ -61,36 +79,94 @@ class ShippingFacade(AbstractShippingFacade):
 
 
 
-    def get_charge(self, origin, dest, packs, options=None):
-        res = errors = None
-        if not options:
-            options = API_CALC_OPTIONS
-            
-        options['from'] = origin
-        options['to'] = dest
-        options['weight'] = 0
-        
-        for pack in packs:
-            options['weight'] += float(pack['weight'])
-        
-        res, errors = self.api.calculate(options)
+    def build_charge_options(self, request):
+        # never touch module-wide defaults or options given as calls could run concurrently
+        options = copy.deepcopy(request.options or API_CALC_OPTIONS)
+        options['from'] = request.origin
+        options['to'] = request.dest
+        options['weight'] = sum([float(pack['weight']) for pack in request.packs])
+        return options
+
+    def split_parcels(self, weight):
+        """
+            Returns list of tuples (weight, count) of the parcels
+            not heavier than MAX_PARCEL_WEIGHT the weight given is split to
+        """
+        weight = D(weight)
+        count = int(weight // MAX_PARCEL_WEIGHT)
+        rest = (weight - MAX_PARCEL_WEIGHT * count).quantize(precision)
+        parcels = [(MAX_PARCEL_WEIGHT, count)] if count else []
+        if rest > 0:
+            parcels.append((rest, 1))
+        return parcels
+
+    def get_charge(self, origin, dest, packs, options=None, deadline=None):
+        parcels = self.split_parcels(sum([D(pack['weight']) for pack in packs]))
+        if len(parcels) > 1 or (parcels and parcels[0][1] > 1):
+            return self.get_parcels_charge(origin, dest, parcels, deadline)
+        return self.get_parcel_charge(origin, dest, packs, options, deadline)
+
+    def get_parcels_charge(self, origin, dest, parcels, deadline=None):
+        """
+            Quotes distinct parcel weights concurrently (cached quotes are reused)
+            and sums them up. Returns ChargeResult like get_charge() do
+            with per-parcel details in results['parcels'].
+        """
+        def quote(parcel):
+            weight, count = parcel
+            return parcel, self.get_cached_charge(origin, dest,
+                                                  [{'weight': weight, 'container': PARCEL_CONTAINER}],
+                                                  deadline)
+
+        total = D(0)
+        details = []
+        term = None
+        for (weight, count), (res, errors) in imap_concurrently(quote, parcels, len(parcels)):
+            if errors or not res:
+                return ChargeResult(res, errors or "No answer from API for %s kg parcel" % weight)
+            price = D(res['price'])
+            total += price * count
+            details.append({'weight': str(weight), 'count': count, 'price': str(price)})
+            if 'term' in res:
+                term = term or dict(res['term'])
+                term['min'] = max(term['min'], res['term']['min'])
+                term['max'] = max(term['max'], res['term']['max'])
+        res = {'price': str(total),
+               'parcels': sorted(details, key=lambda p: D(p['weight']), reverse=True),
+               'senderCityId': origin,
+               'receiverCityId': dest}
+        if term is not None:
+            res['term'] = term
+        return ChargeResult(res, False)
+
+    def get_parcel_charge(self, origin, dest, packs, options=None, deadline=None):
+        request = ChargeRequest(origin, dest, tuple(packs), options)
+        res, errors = self.call_api('calculate', self.build_charge_options(request),
+                                    deadline=deadline)
         
         if 'rsp' in res.keys() :
             if not res['rsp']['stat'] == 'ok':
                 raise CalculationError("%s(%s)" % (origin, dest), 
                                        res['rsp']['err'])        
             else:
-                res['rsp']['senderCityId'] = origin
-                res['rsp']['receiverCityId'] = dest
-                return res['rsp'], False
+                return ChargeResult(dict(res['rsp'], senderCityId=origin, receiverCityId=dest),
+                                    False)
         else:
             errors = "No answer from API. Result was: %s" % res
-        return res, errors        
-        
+        return ChargeResult(res, errors)
+
+    def get_batch_charge(self, origin, dest, packs):
+        try:
+            res, errors = self.get_charge(origin, dest, packs)
+        except CalculationError as e:
+            return ChargeResult(None, e.errors)
+        if not errors and self.get_quote_charge(res) is None:
+            errors = "No price found. Result was: %s" % res
+        return ChargeResult(res, errors)
         
-    def get_charges(self, weight, packs, origin, dest):
+    def get_charges(self, weight, packs, origin, dest, deadline=None):
         
-        if not self.api.is_online():
+        if not self.call_api('is_online', deadline=deadline):
             raise ApiOfflineError(_("Sorry. EMS API is offline right now"))
         
         # EMS origin and destination city or branch codes
@@ -99,12 +175,12 @@ class ShippingFacade(AbstractShippingFacade):
         calc_result = err = errors = None
         city = ''
         try:
-            origin_code, dest_code = self.get_city_codes(origin, dest)
+            origin_code, dest_code = self.get_city_codes(origin, dest, deadline)
         except:
             raise
        
         try:
-            calc_result, err = self.get_charge(origin_code, dest_code, packs)
+            calc_result, err = self.get_cached_charge(origin_code, dest_code, packs, deadline)
         except:
             raise
         if err:
@@ -164,7 +240,7 @@ class ShippingFacade(AbstractShippingFacade):
         packs = kwargs.get('packs', [])
         options = kwargs.get('options', False)
 
-        if results and results['price']>0:
+        if results and D(results['price']) > 0:
             origin_code = results['senderCityId']
             dest_code = results['receiverCityId']
             charge = D(results['price'])
@@ -173,6 +249,7 @@ class ShippingFacade(AbstractShippingFacade):
                        'destination' :  dest,
                        'total_weight' : D(weight).quantize(precision),
                        'packs' : packs,
+                       'parcels' : results.get('parcels', []),
                        }
 
             extra_form = self.get_extra_form(initial={'senderCityId': origin_code,
@@ -186,6 +263,11 @@ class ShippingFacade(AbstractShippingFacade):
             errors += "Errors during facade.get_charges() method %s" % results
         return charge, messages, errors, extra_form
     
+    def get_quote_charge(self, results):
+        if not results or not D(results.get('price', 0)) > 0:
+            return None
+        return D(results['price']), ''
+
     def get_queryset(self):
         """ Return normalized queryset-like list of dicts
             { 'id' : <city code>, 'branch' : <branch title>, 'text': <city title> }
@@ -193,6 +275,10 @@ class ShippingFacade(AbstractShippingFacade):
         branch_title = ''
         branch_id = ''
         n_qs = []
+        locations = self.get_locations()
+        if locations is not None:
+            return [self.location_to_dict(l) for l in locations]
+
         qs = self.get_all_branches()
         
         if not qs:
@@ -204,6 +290,32 @@ class ShippingFacade(AbstractShippingFacade):
                              'text' : item[1],
                                       })
         return n_qs
+
+    def iter_locations(self):
+        qs = self.get_all_branches()
+        if not isinstance(qs, list):
+            return
+        for item in qs:
+            yield {'code': item[0],
+                   'title': item[1],
+                   'region': item[2],
+                   'parent_code': ''}
+
+    def location_to_dict(self, location):
+        return {'id': location.code,
+                'type': location.region,
+                'text': location.title,
+                }
+
+    def get_record_region(self, record):
+        # EMS records hold object type ('cities', 'regions'...) instead of
+        # the region, so only region records could be matched by their titles
+        return record[1] if record[2] == 'regions' else ''
+
+    def get_city_records(self):
+        """ Return list of tuples (<city code>, <city title>, <object type>)
+        """
+        return [(i['id'], i['text'], i['type']) for i in self.get_queryset()]
     
     def format_objects(self, qs):
         """ Prepare data for select2 grouped option list.
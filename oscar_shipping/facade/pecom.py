@@ -1,3 +1,4 @@
+import copy
 import itertools
 
 from decimal import Decimal as D
@@ -12,7 +13,7 @@ from django.conf import settings
 from pecomsdk import pecom
 
 from ..utils import del_key
-from .base import AbstractShippingFacade
+from .base import AbstractShippingFacade, ChargeRequest, ChargeResult
 from ..exceptions import ( OriginCityNotFoundError, 
                            CityNotFoundError, 
                            ApiOfflineError, 
@@ -48,7 +49,10 @@ class ShippingFacade(AbstractShippingFacade):
         else:
             raise ImproperlyConfigured("No api credits specified for the shipping method 'pecom'")
 
-    def validate_code(self, code):
+    def create_api(self):
+        return pecom.PecomCabinet(self.api_user, self.api_key)
+
+    def validate_code(self, code, deadline=None):
         """
             Returns False if code is not valid PEC city code,
             if not, returns code casted to int
@@ -56,7 +60,9 @@ class ShippingFacade(AbstractShippingFacade):
         code_int = to_int(code)
         if not code_int:
             return False
-        qs = self.get_all_branches()
+        if self.get_location(code_int) is not None:
+            return code_int
+        qs = self.get_all_branches(deadline)
         for item in qs:
             if code_int == to_int(item['bitrixId']):
                 return code_int
@@ -74,6 +80,9 @@ class ShippingFacade(AbstractShippingFacade):
         code_int = to_int(code)
         if not code_int:
             return False
+        location = self.get_location(code_int)
+        if location is not None:
+            return location.region
         qs = self.get_all_branches()
         for item in qs:
             if code_int == to_int(item['bitrixId']):
@@ -84,45 +93,51 @@ class ShippingFacade(AbstractShippingFacade):
                     return item['title']
         return None
     
-    def get_charge(self, origin, dest, packs, options=None):
-        res = [] 
-        errors = None
-        if not options:
-            options = PECOM_CALC_OPTIONS
-            
-        options['senderCityId'] = origin
-        options['receiverCityId'] = dest
-        options['Cargos'] = []
-        for pack in packs:
-            options['Cargos'].append({"length": float(pack['container'].length), 
-                                      "width": float(pack['container'].width), 
-                                      "height": float(pack['container'].height),
-                                      "volume": float(pack['container'].volume), 
-                                      "maxSize": 3.2,
-                                      "isHP": False, 
-                                      "sealingPositionsCount": 0, 
-                                      "weight": float(pack['weight']),
-                                      "overSize": False
-                                      })
-        
-        res, errors = self.api.calculate(options)
-        # FIXME: if no result has been returned there should be an issue like
-        # 'NoneType' object does not support item assignment
-        # errors: PecomCabinetException(error(6, "Couldn't resolve host 'kabinet.pecom.ru'"),)
-        res['senderCityId'] = origin
-        res['receiverCityId'] = dest
-        return res, errors
-
-    def get_charges(self, weight, packs, origin, dest):
+    def build_charge_options(self, request):
+        # never touch module-wide defaults or options given as calls could run concurrently
+        options = copy.deepcopy(request.options or PECOM_CALC_OPTIONS)
+        options['senderCityId'] = request.origin
+        options['receiverCityId'] = request.dest
+        options['Cargos'] = [{"length": float(pack['container'].length), 
+                              "width": float(pack['container'].width), 
+                              "height": float(pack['container'].height),
+                              "volume": float(pack['container'].volume), 
+                              "maxSize": 3.2,
+                              "isHP": False, 
+                              "sealingPositionsCount": 0, 
+                              "weight": float(pack['weight']),
+                              "overSize": False
+                              } for pack in request.packs]
+        return options
+
+    def get_charge(self, origin, dest, packs, options=None, deadline=None):
+        request = ChargeRequest(origin, dest, tuple(packs), options)
+        res, errors = self.call_api('calculate', self.build_charge_options(request),
+                                    deadline=deadline)
+        # no result returned if API is unavailable, errors would be like
+        # PecomCabinetException(error(6, "Couldn't resolve host 'kabinet.pecom.ru'"),)
+        if isinstance(res, dict):
+            res = dict(res, senderCityId=origin, receiverCityId=dest)
+        return ChargeResult(res, errors)
+
+    def get_batch_charge(self, origin, dest, packs):
+        res, errors = self.get_charge(origin, dest, packs)
+        if errors:
+            return ChargeResult(None, errors)
+        if self.get_quote_charge(res) is None:
+            return ChargeResult(res, res.get('errorMessage') or "No transfers found. DEBUG: %s" % res)
+        return ChargeResult(res, None)
+
+    def get_charges(self, weight, packs, origin, dest, deadline=None):
         origin_code = dest_code = None  # origin and destination city codes
         calc_result = err = None
         city = ''
         
         try:
-            origin_code, dest_code = self.get_city_codes(origin, dest)
+            origin_code, dest_code = self.get_city_codes(origin, dest, deadline)
         except:
             raise
-        calc_result, err = self.get_charge(origin_code, dest_code, packs)
+        calc_result, err = self.get_cached_charge(origin_code, dest_code, packs, deadline)
 
         if err:
             return err
@@ -267,6 +282,30 @@ class ShippingFacade(AbstractShippingFacade):
    
         return charge, messages, errors, extra_form
 
+    def get_quote_charge(self, results):
+        """
+            Returns tuple (charge, transportingType) of the cheapest transfer
+        """
+        if not results or results.get('hasError', True):
+            return None
+        transfers = [t for t in results.get('transfers', []) if not t['hasError']]
+        if not transfers:
+            return None
+        best = min(transfers, key=lambda t: D(t['costTotal']))
+        return D(best['costTotal']), best['transportingType']
+
+    def get_quote_services(self, results):
+        if not results or results.get('hasError', True):
+            return []
+        return [(t['transportingType'], D(t['costTotal']))
+                for t in results.get('transfers', []) if not t['hasError']]
+
+    def get_estimate_form(self, origin_code, dest_code, service=None):
+        return self.get_extra_form(initial={'senderCityId': origin_code,
+                                            'receiverCityId': dest_code,
+                                            'transportingType': to_int(service) or None,
+                                            })
+
     def get_queryset(self):
         """ Return normalized queryset-like list of dicts
             { 'id' : <city code>, 'branch' : <branch title>, 'text': <city title> }
@@ -274,6 +313,10 @@ class ShippingFacade(AbstractShippingFacade):
         branch_title = ''
         branch_id = ''
         n_qs = []
+        locations = self.get_locations()
+        if locations is not None:
+            return [self.location_to_dict(l) for l in locations]
+
         qs = self.get_all_branches()
         
         if not qs:
@@ -295,6 +338,35 @@ class ShippingFacade(AbstractShippingFacade):
                                  'text': c['title'],
                                  })
         return n_qs
+
+    def iter_locations(self):
+        qs = self.get_all_branches()
+        if not isinstance(qs, list):
+            return
+        for item in qs:
+            branch_id = item['bitrixId']
+            yield {'code': branch_id,
+                   'title': item['title'],
+                   'region': item['title'],
+                   'parent_code': ''}
+            for c in item['cities']:
+                city_id = c.get('bitrixId', None)
+                if city_id and to_int(city_id) != to_int(branch_id):
+                    yield {'code': city_id,
+                           'title': c['title'],
+                           'region': item['title'],
+                           'parent_code': branch_id}
+
+    def location_to_dict(self, location):
+        return {'id': to_int(location.code),
+                'branch': location.region,
+                'text': location.title,
+                }
+
+    def get_city_records(self):
+        """ Return list of tuples (<city code>, <city title>, <branch title>)
+        """
+        return [(to_int(i['id']), i['text'], i['branch']) for i in self.get_queryset()]
     
     def format_objects(self, qs):
         """ Prepare data for select2 grouped option list.
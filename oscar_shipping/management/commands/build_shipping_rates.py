@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+import time
+import operator
+
+from functools import reduce
+from decimal import Decimal as D
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from django.utils.encoding import force_text
+
+from oscar.core.loading import get_model
+
+from oscar_shipping.facade.base import BACKGROUND_RATE_LIMIT_WAIT
+from oscar_shipping.packers import Packer
+from oscar_shipping.utils import get_top_destinations
+
+ShippingCompany = get_model('shipping', 'ShippingCompany')
+ShippingRate = get_model('shipping', 'ShippingRate')
+
+# bands of the rates table, kg and m3
+WEIGHT_BANDS = getattr(settings, 'OSCAR_SHIPPING_RATE_WEIGHT_BANDS', (1, 3, 5, 10, 20, 30, 50, 100))
+VOLUME_BANDS = getattr(settings, 'OSCAR_SHIPPING_RATE_VOLUME_BANDS', ('0.01', '0.05', '0.1', '0.25', '0.5', '1'))
+
+TOP_DESTINATIONS = getattr(settings, 'OSCAR_SHIPPING_RATE_TOP_DESTINATIONS', 50)
+PERIOD = getattr(settings, 'OSCAR_SHIPPING_WARM_PERIOD', 30)
+
+# rates aren't stored at all if greater part of requests failed (e.g. carrier outage)
+MAX_FAILURES = getattr(settings, 'OSCAR_SHIPPING_RATE_MAX_FAILURES', 0.5)
+
+
+class Command(BaseCommand):
+    help = ("Builds rates tables for active shipping methods quoting "
+            "the most popular destinations against weight and volume bands")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--codes', nargs='*', default=[],
+                            help="Destination codes to quote, e.g. --codes=pecom:-446 emspost:city--moskva")
+        parser.add_argument('--top', type=int, default=TOP_DESTINATIONS,
+                            help="Number of the most popular destinations to quote")
+        parser.add_argument('--days', type=int, default=PERIOD,
+                            help="Take destinations from the orders placed during that period")
+        parser.add_argument('--workers', type=int, default=4,
+                            help="Number of parallel API calls")
+        parser.add_argument('--max-failures', type=float, default=MAX_FAILURES,
+                            help="Don't store anything if greater part of requests failed")
+        parser.add_argument('--prune', action='store_true', default=False,
+                            help="Delete rates of the destinations not quoted this time")
+
+    def get_dest_codes(self, method, cities, codes):
+        facade = method.facade
+        res = set()
+        for c in codes:
+            api_type, _sep, code = c.partition(':')
+            if api_type == method.api_type:
+                res.add(code)
+        for city in cities:
+            found, errors = facade.get_cached_codes(facade.clean_city_name(city))
+            # ambiguous cities are skipped
+            if len(found) == 1:
+                res.add(found[0])
+        return res
+
+    def get_band_packs(self, weight, volume):
+        container = Packer([]).get_default_container(volume)
+        return [{'weight': D(weight), 'container': container}]
+
+    def build(self, method, cities, options):
+        facade = method.facade
+        facade.rate_limit_wait = BACKGROUND_RATE_LIMIT_WAIT
+        origin_code = facade.get_cached_origin_code(method.origin)
+        requests = []
+        for dest_code in self.get_dest_codes(method, cities, options['codes']):
+            for volume in VOLUME_BANDS:
+                for weight in WEIGHT_BANDS:
+                    requests.append((origin_code, dest_code,
+                                     self.get_band_packs(weight, volume),
+                                     D(weight), D(volume)))
+        rates = []
+        for request, results, errors in facade.get_charges_batch(requests, workers=options['workers']):
+            origin_code, dest_code, packs, weight, volume = request
+            quote = None if errors else facade.get_quote_charge(results)
+            if quote is None:
+                if options['verbosity'] > 1:
+                    self.stderr.write("%s: %s -> %s (%s kg, %s m3) failed: %s" % (method.name, origin_code,
+                                                                                 dest_code, weight, volume,
+                                                                                 errors))
+                continue
+            charge, service = quote
+            rates.append(ShippingRate(method=method,
+                                      origin_code=force_text(origin_code),
+                                      dest_code=force_text(dest_code),
+                                      weight=weight,
+                                      volume=volume,
+                                      charge=charge,
+                                      service=force_text(service)))
+        if requests and len(requests) - len(rates) > len(requests) * options['max_failures']:
+            # table is kept as is, estimates and fallbacks rely on it
+            self.stderr.write("%s: %d of %d requests failed, rates aren't updated" % (method.name,
+                                                                                     len(requests) - len(rates),
+                                                                                     len(requests)))
+            return len(requests), 0
+        with transaction.atomic():
+            self.store(method, rates, options['prune'])
+        return len(requests), len(rates)
+
+    def store(self, method, rates, prune=False):
+        """
+        Replaces rates of the bands quoted, the rest rows are kept
+        """
+        routes = {}
+        for r in rates:
+            routes.setdefault((r.origin_code, r.dest_code), []).append(r)
+        qs = ShippingRate.objects.filter(method=method)
+        for (origin_code, dest_code), route_rates in routes.items():
+            bands = reduce(operator.or_, [Q(weight=r.weight, volume=r.volume) for r in route_rates])
+            qs.filter(origin_code=origin_code, dest_code=dest_code).filter(bands).delete()
+        if prune and routes:
+            qs.exclude(dest_code__in=set(dest_code for o, dest_code in routes.keys())).delete()
+        ShippingRate.objects.bulk_create(rates)
+
+    def handle(self, *args, **options):
+        started = time.time()
+        cities = get_top_destinations(options['top'], options['days']) if options['top'] else []
+        for m in ShippingCompany.available.all():
+            if not m.api_type or m.status in (m.OFFLINE, m.DISABLED):
+                continue
+            if m.facade.is_circuit_open():
+                self.stdout.write("%s: API circuit is open, skipped" % m.name)
+                continue
+            method_started = time.time()
+            quoted, stored = self.build(m, cities, options)
+            self.stdout.write("%s: %d of %d rates stored in %.2fs" % (m.name, stored, quoted,
+                                                                     time.time() - method_started))
+        self.stdout.write("Done in %.2fs" % (time.time() - started))
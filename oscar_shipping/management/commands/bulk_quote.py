@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+import io
+import csv
+import json
+import time
+import itertools
+
+from decimal import Decimal as D
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.encoding import force_text
+from django.utils import six
+
+from oscar.core.loading import get_model
+
+from oscar_shipping.facade.base import BACKGROUND_RATE_LIMIT_WAIT
+from oscar_shipping.packers import Container
+from oscar_shipping.exceptions import FacadeError
+
+ShippingCompany = get_model('shipping', 'ShippingCompany')
+Order = get_model('order', 'Order')
+
+# rows are read, quoted and written by chunks of that size
+CHUNK_SIZE = getattr(settings, 'OSCAR_SHIPPING_BULK_QUOTE_CHUNK_SIZE', 100)
+
+
+class Command(BaseCommand):
+    help = ("Re-quotes orders or (origin, destination, dimensions, weight) rows "
+            "against current tariffs of active shipping methods. "
+            "Results are appended to the NDJSON output, so interrupted run "
+            "could be resumed with the same arguments.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('orders', nargs='*', type=int,
+                            help="Order IDs to quote")
+        parser.add_argument('--input',
+                            help="CSV or NDJSON file with id, origin, destination, "
+                                 "width, height, length (m), weight (kg) fields")
+        parser.add_argument('--output', required=True,
+                            help="NDJSON file to append results to")
+        parser.add_argument('--methods', nargs='*', default=[],
+                            help="Codes of the shipping methods to quote, all active if not set")
+        parser.add_argument('--workers', type=int, default=4,
+                            help="Number of parallel API calls per carrier")
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def get_methods(self, codes):
+        methods = []
+        for m in ShippingCompany.available.all():
+            if not m.api_type or (codes and m.code not in codes):
+                continue
+            m.facade.rate_limit_wait = BACKGROUND_RATE_LIMIT_WAIT
+            methods.append(m)
+        return methods
+
+    def read_done(self, path):
+        """
+        Returns set of (id, method code) already written to the output
+        """
+        done = set()
+        try:
+            with io.open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        r = json.loads(line)
+                    except ValueError:
+                        # the last line could be written partially
+                        continue
+                    done.add((force_text(r['id']), r['method']))
+        except IOError:
+            pass
+        return done
+
+    def iter_orders(self, ids):
+        for pk in ids:
+            try:
+                order = Order.objects.get(pk=pk)
+            except Order.DoesNotExist:
+                self.stderr.write("Order #%s not found" % pk)
+                continue
+            yield {'id': force_text(order.number),
+                   'order': order}
+
+    def iter_csv(self, path):
+        if six.PY2:
+            # python 2 csv module reads bytes only, cells are decoded one by one
+            with open(path, 'rb') as f:
+                for row in csv.DictReader(f):
+                    yield dict((k.decode('utf-8'), v.decode('utf-8') if v is not None else None)
+                               for k, v in row.items())
+        else:
+            with io.open(path, encoding='utf-8', newline='') as f:
+                for row in csv.DictReader(f):
+                    yield row
+
+    def iter_ndjson(self, path):
+        with io.open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def iter_file(self, path):
+        rows = self.iter_csv(path) if path.endswith('.csv') else self.iter_ndjson(path)
+        for i, row in enumerate(rows):
+            row.setdefault('id', force_text(i + 1))
+            yield row
+
+    def get_packs(self, method, row):
+        if 'order' in row:
+            return method.get_packer().pack_lines([(line.product, line.quantity)
+                                                   for line in row['order'].lines.all()])
+        container = Container(D(row['height']), D(row['width']), D(row['length']),
+                              'row %s' % row['id'])
+        return [{'weight': D(row['weight']), 'container': container}]
+
+    def get_codes(self, method, row):
+        facade = method.facade
+        if 'order' in row:
+            origin = method.origin
+            dest = row['order'].shipping_address
+        else:
+            origin = row['origin']
+            dest = row['destination']
+            if not facade.validate_code(dest):
+                # city name given
+                dest_codes, errors = facade.get_cached_codes(facade.clean_city_name(dest))
+                if len(dest_codes) != 1:
+                    raise FacadeError("Destination '%s' is ambiguous or not found" % dest)
+                dest = dest_codes[0]
+        if dest is None:
+            raise FacadeError("No shipping address")
+        return facade.validate_code(origin) or facade.get_cached_origin_code(origin), facade.get_dest_code(dest)
+
+    def quote_chunk(self, method, rows, workers):
+        """
+        Yields result dicts for the rows chunk given
+        """
+        facade = method.facade
+        requests = []
+        for row in rows:
+            try:
+                origin_code, dest_code = self.get_codes(method, row)
+                packs = self.get_packs(method, row)
+            except Exception as e:
+                yield {'id': row['id'], 'method': method.code, 'errors': force_text(e)}
+                continue
+            requests.append((origin_code, dest_code, packs, row))
+
+        for request, results, errors in facade.get_charges_batch(requests, workers=workers):
+            origin_code, dest_code, packs, row = request
+            res = {'id': row['id'],
+                   'method': method.code,
+                   'origin': force_text(origin_code),
+                   'destination': force_text(dest_code),
+                   'weight': force_text(sum([p['weight'] for p in packs]))}
+            quote = None if errors else facade.get_quote_charge(results)
+            if quote is None:
+                res['errors'] = force_text(errors or "No quote found")
+            else:
+                res['charge'] = force_text(quote[0])
+                res['service'] = force_text(quote[1])
+            yield res
+
+    def handle(self, *args, **options):
+        if not options['orders'] and not options['input']:
+            raise CommandError("Order IDs or input file required")
+        started = time.time()
+        methods = self.get_methods(options['methods'])
+        done = self.read_done(options['output'])
+        if options['input']:
+            rows = self.iter_file(options['input'])
+        else:
+            rows = self.iter_orders(options['orders'])
+
+        quoted = skipped = failed = 0
+        with io.open(options['output'], 'a', encoding='utf-8') as out:
+            while True:
+                chunk = list(itertools.islice(rows, options['chunk_size']))
+                if not chunk:
+                    break
+                for m in methods:
+                    todo = [r for r in chunk if (force_text(r['id']), m.code) not in done]
+                    skipped += len(chunk) - len(todo)
+                    if not todo:
+                        continue
+                    for res in self.quote_chunk(m, todo, options['workers']):
+                        out.write(force_text(json.dumps(res)) + u'\n')
+                        quoted += 1
+                        if 'errors' in res:
+                            failed += 1
+                out.flush()
+                if options['verbosity'] > 1:
+                    self.stdout.write("%d quoted, %d skipped in %.2fs" % (quoted, skipped,
+                                                                         time.time() - started))
+
+        self.stdout.write("%d quoted (%d failed), %d skipped as done before in %.2fs" % (quoted, failed, skipped,
+                                                                                       time.time() - started))
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils.encoding import force_text
+
+from oscar.core.loading import get_model
+
+from oscar_shipping.matching import normalize_city
+
+ShippingCompany = get_model('shipping', 'ShippingCompany')
+CarrierLocation = get_model('shipping', 'CarrierLocation')
+
+BATCH_SIZE = getattr(settings, 'OSCAR_SHIPPING_SYNC_BATCH_SIZE', 500)
+
+FIELDS = ('title', 'title_normalized', 'region', 'parent_code')
+
+
+class Command(BaseCommand):
+    help = "Syncs CarrierLocation table with the carrier directories loaded via APIs"
+
+    def add_arguments(self, parser):
+        parser.add_argument('carriers', nargs='*',
+                            help="API types to sync, all used by shipping methods if not set")
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--keep-removed', action='store_true', default=False,
+                            help="Don't delete locations which are not listed in the directory anymore")
+
+    def get_facades(self, carriers):
+        facades = {}
+        for m in ShippingCompany.objects.exclude(api_type=''):
+            if carriers and m.api_type not in carriers:
+                continue
+            facades.setdefault(m.api_type, m.facade)
+        return facades
+
+    def to_row(self, location):
+        return (force_text(location['title']),
+                normalize_city(location['title']),
+                force_text(location['region'] or ''),
+                force_text(location['parent_code'] or ''))
+
+    def replace(self, carrier, locations):
+        # changed rows are replaced by the batch in the sync transaction,
+        # nothing refers to them
+        CarrierLocation.objects.for_carrier(carrier)\
+                               .filter(code__in=[l.code for l in locations])\
+                               .delete()
+        CarrierLocation.objects.bulk_create(locations)
+
+    def sync(self, carrier, facade, batch_size, keep_removed):
+        created = updated = deleted = 0
+        res, errors = facade.fetch_branches()
+        if errors:
+            raise Exception(errors)
+
+        # current rows {code: (title, title_normalized, region, parent_code)}
+        existing = dict((r[0], tuple(r[1:])) for r in CarrierLocation.objects.for_carrier(carrier)
+                                                                              .values_list('code', *FIELDS)
+                                                                              .iterator())
+        seen = set()
+        new = []
+        changed = []
+        for location in facade.iter_locations():
+            code = force_text(location['code'])
+            if code in seen:
+                continue
+            seen.add(code)
+            row = self.to_row(location)
+            if code not in existing:
+                new.append(CarrierLocation(carrier=carrier, code=code, **dict(zip(FIELDS, row))))
+                if len(new) >= batch_size:
+                    CarrierLocation.objects.bulk_create(new)
+                    created += len(new)
+                    new = []
+            elif existing[code] != row:
+                changed.append(CarrierLocation(carrier=carrier, code=code, **dict(zip(FIELDS, row))))
+                if len(changed) >= batch_size:
+                    self.replace(carrier, changed)
+                    updated += len(changed)
+                    changed = []
+        if new:
+            CarrierLocation.objects.bulk_create(new)
+            created += len(new)
+        if changed:
+            self.replace(carrier, changed)
+            updated += len(changed)
+
+        if not keep_removed:
+            removed = [code for code in existing.keys() if code not in seen]
+            for i in range(0, len(removed), batch_size):
+                CarrierLocation.objects.for_carrier(carrier)\
+                                       .filter(code__in=removed[i:i + batch_size])\
+                                       .delete()
+            deleted = len(removed)
+        return created, updated, deleted
+
+    def handle(self, *args, **options):
+        facades = self.get_facades(options['carriers'])
+        for carrier, facade in facades.items():
+            started = time.time()
+            try:
+                with transaction.atomic():
+                    created, updated, deleted = self.sync(carrier, facade,
+                                                          options['batch_size'],
+                                                          options['keep_removed'])
+            except Exception as e:
+                self.stderr.write("%s: sync failed: %s" % (carrier, e))
+                continue
+            self.stdout.write("%s: %d created, %d updated, %d deleted in %.2fs" % (carrier,
+                                                                                 created,
+                                                                                 updated,
+                                                                                 deleted,
+                                                                                 time.time() - started))
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from oscar.core.loading import get_model
+
+from oscar_shipping.facade.base import BACKGROUND_RATE_LIMIT_WAIT
+from oscar_shipping.utils import imap_concurrently, get_top_destinations
+
+ShippingCompany = get_model('shipping', 'ShippingCompany')
+
+TOP_DESTINATIONS = getattr(settings, 'OSCAR_SHIPPING_WARM_TOP_DESTINATIONS', 100)
+PERIOD = getattr(settings, 'OSCAR_SHIPPING_WARM_PERIOD', 30)
+
+
+class Command(BaseCommand):
+    help = ("Loads carrier directories, origin codes and city codes "
+            "of the most popular destinations into the cache")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=TOP_DESTINATIONS,
+                            help="Number of the most popular destinations to resolve")
+        parser.add_argument('--days', type=int, default=PERIOD,
+                            help="Take destinations from the orders placed during that period")
+        parser.add_argument('--workers', type=int, default=4,
+                            help="Number of parallel API calls")
+        parser.add_argument('--force', action='store_true', default=False,
+                            help="Reload directories even if they are cached already")
+
+    def get_methods(self):
+        methods = []
+        for m in ShippingCompany.available.all():
+            if not m.api_type or m.status in (m.OFFLINE, m.DISABLED):
+                continue
+            if m.facade.is_circuit_open():
+                self.stdout.write("%s: API circuit is open, skipped" % m.name)
+                continue
+            m.facade.rate_limit_wait = BACKGROUND_RATE_LIMIT_WAIT
+            methods.append(m)
+        return methods
+
+    def timed(self, title, func, *args):
+        started = time.time()
+        try:
+            func(*args)
+        except Exception as e:
+            return title, time.time() - started, e
+        return title, time.time() - started, None
+
+    def load_directory(self, facade, force):
+        if force:
+            res, errors = facade.fetch_branches()
+        else:
+            res = facade.get_all_branches()
+            errors = None if res else "directory is not available"
+        if errors:
+            raise Exception(errors)
+
+    def handle(self, *args, **options):
+        started = time.time()
+        methods = self.get_methods()
+        tasks = []
+
+        # directories are shared by all methods of the same API type
+        facades = {}
+        for m in methods:
+            facades.setdefault(m.api_type, m.facade)
+        for name, facade in facades.items():
+            tasks.append(("%s: directory" % name,
+                          self.load_directory, facade, options['force']))
+        for m in methods:
+            tasks.append(("%s: origin '%s'" % (m.name, m.origin),
+                          m.facade.get_cached_origin_code, m.origin))
+
+        cities = get_top_destinations(options['top'], options['days'])
+        for name, facade in facades.items():
+            for city in cities:
+                tasks.append(("%s: destination '%s'" % (name, city),
+                              facade.get_cached_codes, facade.clean_city_name(city)))
+
+        failed = 0
+        for title, elapsed, error in imap_concurrently(lambda t: self.timed(*t),
+                                                       tasks,
+                                                       options['workers']):
+            if error:
+                failed += 1
+                self.stderr.write("%s failed in %.2fs: %s" % (title, elapsed, error))
+            elif options['verbosity'] > 1:
+                self.stdout.write("%s done in %.2fs" % (title, elapsed))
+
+        self.stdout.write("Warmed up %d of %d entries for %d carriers in %.2fs" % (len(tasks) - failed,
+                                                                                  len(tasks),
+                                                                                  len(facades),
+                                                                                  time.time() - started))
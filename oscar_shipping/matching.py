@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+import re
+
+from django.conf import settings
+from django.utils.encoding import force_text
+
+# abbreviated and full settlement types which could prefix (or suffix) city name
+# in the addresses filled via KLADR, Dadata etc, e.g. "г. Москва", "пос. Шушары"
+SETTLEMENT_TYPES = getattr(settings, 'OSCAR_SHIPPING_SETTLEMENT_TYPES',
+                           (u'г', u'гор', u'город',
+                            u'п', u'пос', u'поселок', u'пгт', u'рп', u'кп',
+                            u'с', u'село', u'д', u'дер', u'деревня',
+                            u'ст', u'станица', u'х', u'хут', u'хутор',
+                            u'аул', u'сл', u'слобода', u'мкр', u'нп'))
+
+# whitespaces, hyphens and dashes (U+2010..U+2015), dots, commas, brackets and quotes
+_separators = re.compile(u'[\\s\\-\u2010-\u2015.,()"]+', re.UNICODE)
+_settlement_types = frozenset(SETTLEMENT_TYPES)
+
+
+def normalize_city(title):
+    """
+    Returns city name prepared for comparison:
+    lower-cased, 'ё' replaced by 'е', settlement type stripped,
+    hyphens, dots and whitespaces collapsed to single space.
+    "г. Ростов-на-Дону" -> "ростов на дону"
+    Settlement type is stripped from the end of the name only if it's
+    abbreviated with dot ("Шушары пос."), as words like "село" or "деревня"
+    are part of the names, e.g. "Красное Село", "Новая Деревня".
+    """
+    title = force_text(title or '').lower().replace(u'ё', u'е')
+    dotted_suffix = title.rstrip().endswith(u'.')
+    # settlement types written with hyphen should be stripped before splitting
+    tokens = [t for t in _separators.split(title.replace(u'ст-ца', u'ст')) if t]
+    while len(tokens) > 1 and tokens[0] in _settlement_types:
+        tokens.pop(0)
+    if dotted_suffix and len(tokens) > 1 and tokens[-1] in _settlement_types:
+        tokens.pop()
+    return u' '.join(tokens)
+
+
+class CityIndex(object):
+    """
+    In-process index over the carrier's directory.
+    Records should be tuples like facades' findbytitle() return:
+    (<code>, <title>, <branch or type>, ...)
+    """
+    def __init__(self, records):
+        self.index = {}
+        for r in records:
+            self.index.setdefault(normalize_city(r[1]), []).append(tuple(r))
+
+    def __len__(self):
+        return len(self.index)
+
+    def lookup(self, title):
+        """
+        Returns list of records matched the title given
+        or None if index is not sure, so API should be asked.
+        """
+        records = self.index.get(normalize_city(title))
+        if not records:
+            return None
+        # the same code could be listed twice, e.g. as a branch and as a city
+        res = []
+        seen = set()
+        for r in records:
+            if r[0] not in seen:
+                seen.add(r[0])
+                res.append(r)
+        return res
+
+
+# region types to be stripped out of the region (state) names,
+# e.g. "Московская обл." -> "московская"
+REGION_TYPES = getattr(settings, 'OSCAR_SHIPPING_REGION_TYPES',
+                       (u'обл', u'область', u'край', u'респ', u'республика',
+                        u'ао', u'авт', u'автономный', u'автономная', u'округ',
+                        u'г', u'город', u'федерального', u'значения'))
+
+# optional mapping of the postcode prefixes to region names used
+# if no region (state) given in the address, e.g. {'101': u'Москва', '19': u'Санкт-Петербург'}
+POSTCODE_REGIONS = getattr(settings, 'OSCAR_SHIPPING_POSTCODE_REGIONS', {})
+
+_region_types = frozenset(REGION_TYPES)
+
+
+def normalize_region(title):
+    """
+    Returns list of significant words of the region name given
+    """
+    title = force_text(title or '').lower().replace(u'ё', u'е')
+    return [t for t in _separators.split(title) if len(t) > 2 and t not in _region_types]
+
+
+def region_words_match(a, b):
+    # region names and branch (region capital) names have common stem
+    # but different endings, e.g. "московская" and "москва", "тверская" and "тверь".
+    # Stem is the shorter word except for the last two letters, but not shorter
+    # than 4 letters, so "новгородская" and "новосибирск" don't match
+    shorter = min(len(a), len(b))
+    if shorter < 4:
+        return a == b
+    common = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        common += 1
+    return common >= max(4, shorter - 2)
+
+
+def get_postcode_region(postcode):
+    postcode = force_text(postcode or '').strip()
+    for l in range(len(postcode), 0, -1):
+        try:
+            return POSTCODE_REGIONS[postcode[:l]]
+        except KeyError:
+            pass
+    return None
+
+
+def narrow_by_region(records, region=None, postcode=None, get_region=lambda r: r[2]):
+    """
+    Filters directory records (see CityIndex) by the address region (state)
+    or by the region guessed from postcode.
+    Returns list of matched records or original list if nothing matched.
+    """
+    words = normalize_region(region or get_postcode_region(postcode))
+    if not words:
+        return records
+    matched = []
+    for r in records:
+        r_words = normalize_region(get_region(r))
+        if any(region_words_match(w, rw) for w in words for rw in r_words):
+            matched.append(r)
+    return matched or records
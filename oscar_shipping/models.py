@@ -1,58 +1,114 @@
 # -*- coding: utf-8 -*-
-from decimal import Decimal as D
+import uuid
+import datetime
 
-import importlib
+from decimal import Decimal as D, ROUND_CEILING
 
 from django.db import models
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.core.cache import cache
 from django.conf import settings
-from django.utils.encoding import python_2_unicode_compatible
+from django.utils.encoding import python_2_unicode_compatible, force_text
 from django.utils.translation import ugettext_lazy as _
+from django.utils.formats import date_format
+from django.utils import timezone
 from django.core.validators import MinValueValidator
 from django.core.exceptions import ImproperlyConfigured
-from django.core.urlresolvers import reverse_lazy
 
 from oscar.apps.shipping.abstract_models import AbstractWeightBased
-from oscar.core import prices, loading
 
-from .packers import Packer
-from .exceptions import (OriginCityNotFoundError,
-                         CityNotFoundError,
-                         ApiOfflineError,
-                         TooManyFoundError,
-                         CalculationError)
+from .packers import Packer, Container, VOLUMETRIC_DIVISORS, to_mm, mm3_to_m3
+from .calculator import ShippingCalculator, ShippingQuote, CHECKOUT_DEADLINE
+from .registry import registry, LazyChoices
+from .matching import normalize_city
+from .exceptions import FacadeError, ApiOfflineError
 
-weight_precision = getattr(settings, 'OSCAR_SHIPPING_WEIGHT_PRECISION', D('0.000')) 
-volume_precision = getattr(settings, 'OSCAR_SHIPPING_VOLUME_PRECISION', D('0.000'))
+DEFAULT_ORIGIN = getattr(settings, 'OSCAR_SHIPPING_DEFAULT_ORIGIN', 'Saint-Petersburg')
 
-Scale = loading.get_class('shipping.scales', 'Scale')
+# answer from precomputed rate tables (see build_shipping_rates command) if route is covered
+USE_RATE_TABLES = getattr(settings, 'OSCAR_SHIPPING_USE_RATE_TABLES', True)
 
-DEFAULT_ORIGIN = getattr(settings, 'OSCAR_SHIPPING_DEFAULT_ORIGIN', 'Saint-Petersburg')
+# last successful live quotes are stored per route and weight band and used
+# when API fails if they aren't older than max age (seconds), charge is marked up
+# (0.1 means +10%)
+FALLBACK_QUOTES = getattr(settings, 'OSCAR_SHIPPING_FALLBACK_QUOTES', True)
+FALLBACK_MAX_AGE = getattr(settings, 'OSCAR_SHIPPING_FALLBACK_MAX_AGE', 60 * 60 * 24 * 7)
+FALLBACK_MARKUP = D(getattr(settings, 'OSCAR_SHIPPING_FALLBACK_MARKUP', '0.1'))
+FALLBACK_WEIGHT_BANDS = getattr(settings, 'OSCAR_SHIPPING_FALLBACK_WEIGHT_BANDS',
+                                (1, 3, 5, 10, 20, 30, 50, 100))
 
-API_ENABLED = getattr(settings, 'OSCAR_SHIPPING_API_ENABLED', ['pecom', 'emspost'])
+# active methods configuration (rows, containers and parsed destination lists)
+# is kept in the shared cache for that time, seconds (0 disables the cache).
+# Any change of methods or containers makes the new version of it anyway
+METHODS_CACHE_TTL = getattr(settings, 'OSCAR_SHIPPING_METHODS_CACHE_TTL', 60 * 60 * 24)
+METHODS_VERSION_KEY = 'shipping_methods:version'
 
-API_AVAILABLE = {'pecom': _('PEC API ver. 1.0'), 
-                 'emspost': _('EMS Russian Post REST API'),
-                 'dhl': _('DHL API (not ready yet)'),
-                 'usps': _('USPS API (not ready yet)'),
-                 }
+# kept for backward compatibility, facades are imported lazily by the registry
+api_modules_pool = registry
 
-CHANGE_DESTINATION = getattr(settings, 'OSCAR_SHIPPING_CHANGE_DESTINATION', True)
 
+def get_enabled_api():
+    return registry.choices()
 
-def get_api_modules():
-    res = {}
-    for name in API_AVAILABLE.keys():
-        try:
-            res[name] = importlib.import_module(".facade.%s" % name, __package__)
-        except ImportError:
-            pass 
-    return res
 
-api_modules_pool = get_api_modules()
+def is_api_enabled(api_type):
+    # methods without API are always enabled
+    return not api_type or api_type in registry
 
 
-def get_enabled_api():
-    return [(a, API_AVAILABLE[a]) for a in (API_ENABLED and api_modules_pool.keys())]
+def get_methods_version():
+    version = cache.get(METHODS_VERSION_KEY)
+    if version is None:
+        cache.add(METHODS_VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(METHODS_VERSION_KEY)
+    return version
+
+
+class CredentialsCache(object):
+    """
+    API credentials aren't put to the shared cache, they are read from the db
+    on first use and kept in the process memory for the current methods
+    configuration version only
+    """
+    def __init__(self):
+        self.version = None
+        self.values = {}
+
+    def get(self, pk, version, read):
+        if version != self.version:
+            # configuration changed, credentials of the previous version are dropped
+            self.version, self.values = version, {}
+        values = self.values
+        if pk not in values:
+            values[pk] = read()
+        return values[pk]
+
+
+credentials_cache = CredentialsCache()
+
+
+class CredentialAttribute(object):
+    """
+    API credential field of the method restored from the cache (see from_cached_row())
+    is read on first access, so readers never get empty value instead of the stored one
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        if self.name not in instance.__dict__:
+            instance.load_credentials()
+        return instance.__dict__[self.name]
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.name] = value
+
+
+def invalidate_methods_cache(**kwargs):
+    # configuration cached under the previous version is not used anymore
+    cache.set(METHODS_VERSION_KEY, uuid.uuid4().hex, None)
 
 
 class ShippingCompanyManager(models.Manager):
@@ -69,8 +125,26 @@ class AvailableCompanyManager(ShippingCompanyManager):
         """
         Filter out inactive methods (shipping companies with outdated contracts etc)
         """
-        return super(AvailableCompanyManager, self).get_queryset().filter(is_active=True)
+        qs = super(AvailableCompanyManager, self).get_queryset().filter(is_active=True)
+        # methods of carriers not enabled in OSCAR_SHIPPING_API_ENABLED are skipped
+        return qs.filter(models.Q(api_type='') | models.Q(api_type__in=registry.keys()))
     
+    def cached(self):
+        """
+        Returns list of active methods built from the shared cache, so
+        no queries are made until methods configuration is changed
+        """
+        if not METHODS_CACHE_TTL:
+            return list(self.get_queryset())
+        version = get_methods_version()
+        cache_key = 'shipping_methods:%s' % version
+        rows = cache.get(cache_key)
+        if rows is None:
+            rows = [m.get_cached_row() for m in self.get_queryset().prefetch_related('containers')]
+            cache.set(cache_key, rows, METHODS_CACHE_TTL)
+        return [self.model.from_cached_row(row, version) for row in rows
+                if is_api_enabled(row['fields']['api_type'])]
+
     def for_address(self, addr):
         """
         Pre-populate destination field with the given address
@@ -78,7 +152,7 @@ class AvailableCompanyManager(ShippingCompanyManager):
         :param addr: oscar.apps.address.models.UserAddress or subclassed instance (object must have 'line4' attr)
         :returns: list of available shipping methods for Repository class
         """
-        methods = self.get_queryset()
+        methods = self.cached()
         available_methods = []
         for m in methods:
             m.set_destination(addr)
@@ -91,11 +165,28 @@ class ShippingCompany(AbstractWeightBased):
     """Shipping methods based on cargo companies APIs.
     """ 
     size_attributes = ('width', 'height', 'length')
+    # fields kept out of the shared methods cache
+    CREDENTIAL_FIELDS = ('api_user', 'api_key')
 
     destination = None  # not stored field used for charge calculation
+    # not stored Deadline shared by the calculations of the checkout request
+    deadline = None
 
     errors = None
     messages = None
+    # charge was estimated using the rate table, not calculated via API
+    is_estimate = False
+    # charge was taken from the last known good quote as API failed
+    is_fallback = False
+    # form returned by the facade with the last calculation
+    extra_form = None
+
+    _facade = None
+    _containers = None
+    _whitelist = None
+    _blacklist = None
+    # api_user and api_key are not restored by from_cached_row()
+    _methods_version = None
 
     ONLINE, OFFLINE, DISABLED = 'online', 'offline', 'disabled'
     API_STATUS_CHOICES = (
@@ -116,7 +207,7 @@ class ShippingCompany(AbstractWeightBased):
     api_key = models.CharField(_("API key"), max_length=255, blank=True)
     api_type = models.CharField(verbose_name=_('API type'),
                                 max_length=10, 
-                                choices=get_enabled_api(), 
+                                choices=LazyChoices(registry),
                                 blank=True)
     origin = models.CharField(_("City of origin"), max_length=255, blank=True, default=DEFAULT_ORIGIN)
     is_active = models.BooleanField(_('active'), default=False,
@@ -163,8 +254,81 @@ class ShippingCompany(AbstractWeightBased):
         super(ShippingCompany, self).__init__(*args, **kwargs)
         self.messages = []
         self.errors = []
-        if self.api_type:
-            self.facade = api_modules_pool[self.api_type].ShippingFacade(self.api_user, self.api_key)
+
+    def get_cached_row(self):
+        """
+        Returns picklable dict the method could be restored from
+        without queries (see from_cached_row())
+        """
+        return {'fields': dict((f.attname, getattr(self, f.attname))
+                               for f in self._meta.concrete_fields
+                               if f.attname not in self.CREDENTIAL_FIELDS),
+                'containers': self.get_containers(),
+                'whitelist': self.get_whitelist(),
+                'blacklist': self.get_blacklist()}
+
+    @classmethod
+    def from_cached_row(cls, row, version=None):
+        method = cls(**row['fields'])
+        method._state.adding = False
+        # credentials are read on first access
+        for name in cls.CREDENTIAL_FIELDS:
+            method.__dict__.pop(name, None)
+        method._methods_version = version
+        method._containers = row['containers']
+        method._whitelist = row['whitelist']
+        method._blacklist = row['blacklist']
+        return method
+
+    def read_credentials(self):
+        return type(self)._default_manager.filter(
+            pk=self.pk).values_list(*self.CREDENTIAL_FIELDS).first() or ('', '')
+
+    def load_credentials(self):
+        """
+        Reads API credentials of the method restored from the cache,
+        they are read once per process until configuration is changed
+        """
+        if all(name in self.__dict__ for name in self.CREDENTIAL_FIELDS):
+            return
+        if self._methods_version is None:
+            values = self.read_credentials()
+        else:
+            values = credentials_cache.get(self.pk, self._methods_version, self.read_credentials)
+        self.__dict__.update(zip(self.CREDENTIAL_FIELDS, values))
+
+    def save(self, *args, **kwargs):
+        # method restored from the cache shouldn't wipe out the credentials
+        self.load_credentials()
+        super(ShippingCompany, self).save(*args, **kwargs)
+
+    def parse_list(self, value):
+        return frozenset(value.split(self.LIST_SEPARATOR)) if value else frozenset()
+
+    def get_whitelist(self):
+        if self._whitelist is None:
+            self._whitelist = self.parse_list(self.destination_whitelist)
+        return self._whitelist
+
+    def get_blacklist(self):
+        if self._blacklist is None:
+            self._blacklist = self.parse_list(self.destination_blacklist)
+        return self._blacklist
+
+    def get_containers(self):
+        """
+        Returns list of packers.Container to pack baskets to
+        """
+        if self._containers is None:
+            self._containers = [Container.from_model(c) for c in self.containers.all()]
+        return self._containers
+
+    @property
+    def facade(self):
+        # facade module is imported on first use only
+        if self._facade is None and self.api_type:
+            self._facade = registry.get_facade(self.api_type, self.api_user, self.api_key)
+        return self._facade
 
     @property
     def is_prepaid(self):
@@ -187,164 +351,131 @@ class ShippingCompany(AbstractWeightBased):
         city = self.destination.line4
         if not city:
             return
-        dest_codes, errors = f.get_cached_codes(f.clean_city_name(city))
+        stored_code = f.get_stored_code(self.destination)
+        if stored_code:
+            dest_codes = [stored_code]
+        else:
+            try:
+                dest_codes, errors = f.get_cached_codes(f.clean_city_name(city))
+            except ApiOfflineError:
+                # method is listed, charge calculation handles the outage
+                return self.SHOW_IF_NOT_FOUND
         if not dest_codes:
             return self.SHOW_IF_NOT_FOUND
-        flags = []
+        return self.codes_allowed(dest_codes)
+
+    def codes_allowed(self, dest_codes):
+        """
+        Checks destination codes given against white and black lists.
+        Returns True, False or None if only some of codes are whitelisted
+        """
+        # lists are stored as text, codes could be integers
+        dest_codes = [force_text(code) for code in dest_codes]
         if self.destination_whitelist:
-            for code in dest_codes:
-                flags.append(code in self.destination_whitelist.split(self.LIST_SEPARATOR))
+            flags = [code in self.get_whitelist() for code in dest_codes]
             if all(flags):
                 return True
             elif any(flags):
                 return None
             else:
                 return False
-        flags = []
         if self.destination_blacklist:
-            for code in dest_codes:
-                flags.append(code in self.destination_blacklist.split(self.LIST_SEPARATOR))
-            if all(flags):
-                return False
-            else:
-                return True
-        else:
-            return True
+            return not all(code in self.get_blacklist() for code in dest_codes)
+        return True
+
+    def calculate(self, basket, options=None, destination=None):
+        """
+        Returns charge calculated by ShippingCalculator. Messages, errors
+        and the extra form of the quote are kept on the instance for templates.
+        """
+        quote = self.get_quote(basket, options, destination)
+        self.messages, self.errors = list(quote.messages), list(quote.errors)
+        self.extra_form = quote.extra_form
+        self.is_estimate = quote.provenance == ShippingQuote.ESTIMATE
+        self.is_fallback = quote.provenance == ShippingQuote.FALLBACK
+        return quote.price
+
+    def get_quote(self, basket, options=None, destination=None):
+        calculator = ShippingCalculator(self, deadline=self.deadline or CHECKOUT_DEADLINE)
+        return calculator.calculate(basket, destination or self.destination, options)
+
+    def get_packer(self):
+        return Packer(self.get_containers(),
+                      attribute_codes=self.size_attributes,
+                      weight_code=self.weight_attribute,
+                      default_weight=self.default_weight,
+                      volumetric_divisor=VOLUMETRIC_DIVISORS.get(self.api_type))
+
+    def estimate_charge(self, weight, packs, force=False, destination=None):
+        """
+        Returns tuple (charge, service, origin code, destination code)
+        estimated using the rate table or None if route is not covered.
+        Rate tables are used regardless of OSCAR_SHIPPING_USE_RATE_TABLES if force is set.
+        """
+        if not (USE_RATE_TABLES or force):
+            return None
+        origin_code, dest_code = self.facade.get_city_codes(self.origin, destination or self.destination)
+        volume = sum([p['container'].volume for p in packs])
+        estimate = ShippingRate.objects.estimate(self, origin_code, dest_code, weight, volume)
+        if estimate is None:
+            return None
+        return estimate + (origin_code, dest_code)
+
+    def use_estimate(self, estimate):
+        """
+        Returns tuple (charge, message, extra form, provenance) for the estimate given
+        """
+        charge, service, origin_code, dest_code = estimate
+        return (charge,
+                _(u"Price is estimated using the carrier's rates table"),
+                self.facade.get_estimate_form(origin_code, dest_code, service),
+                ShippingQuote.ESTIMATE)
+
+    def get_fallback_charge(self, weight, packs, destination, use_rates=False):
+        """
+        Returns tuple (charge, message, extra form, provenance) taken from the rates table
+        (if use_rates is set) or the last known good quote when API can't be used,
+        None if there is no one
+        """
+        try:
+            if use_rates:
+                estimate = self.estimate_charge(weight, packs, force=True, destination=destination)
+                if estimate is not None:
+                    return self.use_estimate(estimate)
+            if not FALLBACK_QUOTES:
+                return None
+            origin_code, dest_code = self.facade.get_city_codes(self.origin, destination)
+        except (FacadeError, ImproperlyConfigured):
+            # codes couldn't be resolved without API, origin lookup
+            # raises ImproperlyConfigured if API answered with errors
+            return None
+        quote = FallbackQuote.objects.lookup(self, origin_code, dest_code, weight, FALLBACK_MAX_AGE)
+        if quote is None:
+            return None
+        return ((quote.charge * (1 + FALLBACK_MARKUP)).quantize(D('0.01')),
+                _(u"Carrier's API is unavailable, price is based "
+                  u"on the carrier's quote of %s") % date_format(quote.date_updated),
+                None,
+                ShippingQuote.FALLBACK)
+
+    def store_quote(self, weight, results, destination):
+        """
+        Stores live quote results as the last known good one for the route and weight band
+        """
+        if not FALLBACK_QUOTES:
+            return
+        quote = self.facade.get_quote_charge(results)
+        if quote is None:
+            return
+        origin_code, dest_code = self.facade.get_city_codes(self.origin, destination)
+        charge, service = quote
+        FallbackQuote.objects.update_or_create(method=self,
+                                               origin_code=force_text(origin_code),
+                                               dest_code=force_text(dest_code),
+                                               weight=FallbackQuote.objects.get_band(weight),
+                                               defaults={'charge': charge,
+                                                         'service': force_text(service)})
 
-    def calculate(self, basket, options=None):
-        # TODO: move code to smth like ShippingCalculator class
-        results = []
-        charge = D('0.0')
-        self.messages = []
-        self.errors = []
-        # Note, when weighing the basket, we don't check whether the item
-        # requires shipping or not.  It is assumed that if something has a
-        # weight, then it requires shipping.
-        scale = Scale(attribute_code=self.weight_attribute,
-                      default_weight=self.default_weight)
-        packer = Packer(self.containers,
-                        attribute_codes=self.size_attributes,
-                        weight_code=self.weight_attribute, 
-                        default_weight=self.default_weight)
-        weight = scale.weigh_basket(basket).quantize(weight_precision)
-        # Should be a list of dicts { 'weight': weight, 'container' : container }
-        packs = packer.pack_basket(basket)  
-        facade = self.facade
-        if not self.destination: 
-            self.errors.append(_("ERROR! There is no shipping address for charge calculation!\n"))
-        else:
-            self.messages.append(_(u"""Approximated shipping price
-                                for {weight} kg from {origin} 
-                                to {destination}\n""").format(weight=weight, 
-                                                              origin=self.origin,
-                                                              destination=self.destination.city))
-            
-            # Assuming cases like http protocol suggests:
-            # e=200  - OK. Result contains charge value and extra info such as Branch code, etc
-            # e=404  - Result is empty, no destination found via API, redirect 
-            #          to address form or prompt to API city-codes selector
-            # e=503  - API is offline. Skip this method.
-            # e=300  - Too many choices found, Result contains list of charges-codes. 
-            #          Prompt to found dest-codes selector  
-
-            # an URL for AJAXed city-to-city charge lookup
-            details_url = reverse_lazy('shipping:charge-details', kwargs={'slug': self.code})
-            # an URL for AJAXed code by city lookup using Select2 widget
-            lookup_url = reverse_lazy('shipping:city-lookup', kwargs={'slug': self.code})
-            
-            # if options set make a short call to API for final calculation  
-            if options:
-                errors = None
-                try:
-                    results, errors = facade.get_charge(options['senderCityId'], 
-                                                        options['receiverCityId'],
-                                                        packs)
-                except CalculationError as e:
-                    self.errors.append("Post-calculation error: %s" % e.errors)
-                    self.messages.append(e.title)
-                except:
-                    raise
-                if not errors:
-                    (charge, msg,
-                     err, self.extra_form) = facade.parse_results(results,
-                                                                  options=options)
-                    if msg:
-                        self.messages.append(msg)
-                    if err:
-                        self.errors.append(err)
-                else:
-                    raise CalculationError("%s -> %s" % (options['senderCityId'], 
-                                                         options['receiverCityId']), 
-                                           errors)
-            else:            
-                try:          
-                    results = facade.get_charges(weight, packs, self.origin, self.destination)
-                except ApiOfflineError:
-                    self.errors.append(_(u"""%s API is offline. Can't
-                                         calculate anything. Sorry!""") % self.name)
-                    self.messages.append(_(u"Please, choose another shipping method!"))
-                except OriginCityNotFoundError as e: 
-                    # Paranoid mode as ImproperlyConfigured should be raised by facade
-                    self.errors.append(_(u"""City of origin '%s' not found
-                                      in the shipping company 
-                                      postcodes to calculate charge.""") % e.title)
-                    self.messages.append(_(u"""It seems like we couldn't find code
-                                        for the city of origin (%s).
-                                        Please, select it manually, choose another 
-                                        address or another shipping method.
-                                    """) % e.title)
-                except ImproperlyConfigured as e:  # upraised error handling
-                    self.errors.append("ImproperlyConfigured error (%s)" % e.message)
-                    self.messages.append("Please, select another shipping method or call site administrator!")
-                except CityNotFoundError as e: 
-                    self.errors.append(_(u"""Can't find destination city '{title}'
-                                      to calculate charge. 
-                                      Errors: {errors}""").format(title=e.title, errors=e.errors))
-                    self.messages.append(_(u"""It seems like we can't find code
-                                        for the city of destination (%s).
-                                        Please, choose
-                                        another address or another shipping method.
-                                    """) % e.title)
-                    if CHANGE_DESTINATION:
-                        self.messages.append(_("Also, you can choose city of destination manually"))
-                        self.extra_form = facade.get_extra_form(origin=self.origin,
-                                                                lookup_url=lookup_url,
-                                                                details_url=details_url)
-                except TooManyFoundError as e:
-                    self.errors.append(_(u"Found too many destinations for given city (%s)") % e.title)
-                    if CHANGE_DESTINATION:
-                        self.messages.append(_("Please refine your shipping address"))
-                        self.extra_form = facade.get_extra_form(origin=self.origin,
-                                                                choices=e.results,
-                                                                details_url=details_url)
-                except CalculationError as e:
-                    self.errors.append(_(u"""Error occurred during charge
-                                        calculation for given city (%s)""") % e.title)
-                    self.messages.append(_(u"API error was: %s") % e.errors)
-                    if CHANGE_DESTINATION:
-                        self.extra_form = facade.get_extra_form(origin=self.origin,
-                                                                details_url=details_url,
-                                                                lookup_url=lookup_url)
-                except:
-                    raise
-                else:
-                    (charge, msg,
-                     err, self.extra_form) = facade.parse_results(results,
-                                                                  origin=self.origin,
-                                                                  dest=self.destination,
-                                                                  weight=weight,
-                                                                  packs=packs)
-                    if msg:
-                        self.messages.append(msg)
-                    if err:
-                        self.errors.append(err)
-        
-        # Zero tax is assumed...
-        return prices.Price(
-            currency=basket.currency,
-            excl_tax=charge,
-            incl_tax=charge)
-    
     def set_destination(self, addr):
         self.destination = addr
         
@@ -355,6 +486,11 @@ class ShippingCompany(AbstractWeightBased):
         verbose_name_plural = _("API-based Shipping Methods")
 
 
+# credentials of the methods restored from the cache are read lazily
+ShippingCompany.api_user = CredentialAttribute('api_user')
+ShippingCompany.api_key = CredentialAttribute('api_key')
+
+
 @python_2_unicode_compatible
 class ShippingContainer(models.Model):
     name = models.CharField(_("Name"), max_length=128, unique=True)
@@ -379,9 +515,184 @@ class ShippingContainer(models.Model):
     
     @property
     def volume(self):
-        return D(self.height*self.width*self.length).quantize(volume_precision)
+        return mm3_to_m3(to_mm(self.height) * to_mm(self.width) * to_mm(self.length))
     
     class Meta:
         app_label = 'shipping'
         verbose_name = _("Shipping Container")
         verbose_name_plural = _("Shipping Containers")
+
+
+class CarrierLocationManager(models.Manager):
+
+    def for_carrier(self, carrier):
+        return self.get_queryset().filter(carrier=carrier)
+
+    def search(self, carrier, term):
+        """
+        Case and settlement type insensitive lookup by the beginning
+        of the city title, so (carrier, title_normalized) index is used
+        """
+        return self.for_carrier(carrier).filter(title_normalized__startswith=normalize_city(term))
+
+
+@python_2_unicode_compatible
+class CarrierLocation(models.Model):
+    """
+    Carrier's city or branch code synced from the API directory
+    by the sync_carrier_locations command
+    """
+    carrier = models.CharField(_("API type"), max_length=10)
+    code = models.CharField(_("Code"), max_length=64)
+    title = models.CharField(_("Title"), max_length=255)
+    title_normalized = models.CharField(_("Normalized title"), max_length=255)
+    region = models.CharField(_("Region or branch"), max_length=255, blank=True)
+    parent_code = models.CharField(_("Parent branch code"), max_length=64, blank=True)
+    date_updated = models.DateTimeField(_("Date updated"), auto_now=True)
+
+    objects = CarrierLocationManager()
+
+    def __str__(self):
+        return u"%s: %s (%s)" % (self.carrier, self.title, self.code)
+
+    class Meta:
+        app_label = 'shipping'
+        unique_together = (('carrier', 'code'),)
+        index_together = (('carrier', 'title_normalized'),)
+        verbose_name = _("Carrier Location")
+        verbose_name_plural = _("Carrier Locations")
+
+
+
+class ShippingRateManager(models.Manager):
+
+    def estimate(self, method, origin_code, dest_code, weight, volume):
+        """
+        Returns tuple (charge, service) for the weight and volume given
+        interpolated between the closest weight bands of the smallest
+        volume band enough for volume given, or None if route is not covered
+        """
+        rates = list(self.get_queryset().filter(method=method,
+                                                origin_code=force_text(origin_code),
+                                                dest_code=force_text(dest_code),
+                                                volume__gte=volume)
+                                        .order_by('volume', 'weight'))
+        if not rates:
+            return None
+        band = [r for r in rates if r.volume == rates[0].volume]
+        weight = D(weight)
+        lower = upper = None
+        for r in band:
+            if r.weight <= weight:
+                lower = r
+            elif upper is None:
+                upper = r
+        if upper is None:
+            # heavier than the largest band
+            if lower is not None and lower.weight == weight:
+                return lower.charge, lower.service
+            return None
+        if lower is None:
+            # carriers usually have minimal charge, so the lightest band is used
+            return upper.charge, upper.service
+        ratio = (weight - lower.weight) / (upper.weight - lower.weight)
+        charge = lower.charge + (upper.charge - lower.charge) * ratio
+        return charge.quantize(D('0.01')), upper.service
+
+
+@python_2_unicode_compatible
+class ShippingRate(models.Model):
+    """
+    Precomputed charge for the route, weight and volume band
+    built by the build_shipping_rates command
+    """
+    method = models.ForeignKey('ShippingCompany', related_name='rates',
+                               verbose_name=_("Shipping method"))
+    origin_code = models.CharField(_("Origin code"), max_length=64)
+    dest_code = models.CharField(_("Destination code"), max_length=64)
+    weight = models.DecimalField(_("Weight band, kg"), decimal_places=3, max_digits=12)
+    volume = models.DecimalField(_("Volume band, m3"), decimal_places=3, max_digits=12)
+    charge = models.DecimalField(_("Charge"), decimal_places=2, max_digits=12)
+    # carrier specific service code, e.g. PEC transportation type
+    service = models.CharField(_("Service"), max_length=64, blank=True)
+    date_updated = models.DateTimeField(_("Date updated"), auto_now=True)
+
+    objects = ShippingRateManager()
+
+    def __str__(self):
+        return u"%s: %s -> %s (%s kg, %s m3)" % (self.method, self.origin_code, self.dest_code,
+                                                 self.weight, self.volume)
+
+    class Meta:
+        app_label = 'shipping'
+        unique_together = (('method', 'origin_code', 'dest_code', 'volume', 'weight'),)
+        verbose_name = _("Shipping Rate")
+        verbose_name_plural = _("Shipping Rates")
+
+
+
+class FallbackQuoteManager(models.Manager):
+
+    def get_band(self, weight):
+        """
+        Returns the smallest weight band enough for the weight given
+        """
+        weight = D(weight)
+        for band in FALLBACK_WEIGHT_BANDS:
+            if weight <= D(band):
+                return D(band)
+        return weight.to_integral_value(rounding=ROUND_CEILING)
+
+    def lookup(self, method, origin_code, dest_code, weight, max_age):
+        """
+        Returns the last known good quote for the route and weight band
+        not older than max_age seconds or None
+        """
+        since = timezone.now() - datetime.timedelta(seconds=max_age)
+        return self.get_queryset().filter(method=method,
+                                          origin_code=force_text(origin_code),
+                                          dest_code=force_text(dest_code),
+                                          weight=self.get_band(weight),
+                                          date_updated__gte=since).first()
+
+
+@python_2_unicode_compatible
+class FallbackQuote(models.Model):
+    """
+    The last successful live quote for the route and weight band
+    used when carrier's API fails
+    """
+    method = models.ForeignKey('ShippingCompany', related_name='fallback_quotes',
+                               verbose_name=_("Shipping method"))
+    origin_code = models.CharField(_("Origin code"), max_length=64)
+    dest_code = models.CharField(_("Destination code"), max_length=64)
+    weight = models.DecimalField(_("Weight band, kg"), decimal_places=3, max_digits=12)
+    charge = models.DecimalField(_("Charge"), decimal_places=2, max_digits=12)
+    service = models.CharField(_("Service"), max_length=64, blank=True)
+    date_updated = models.DateTimeField(_("Date updated"), auto_now=True)
+
+    objects = FallbackQuoteManager()
+
+    def __str__(self):
+        return u"%s: %s -> %s (%s kg)" % (self.method, self.origin_code, self.dest_code, self.weight)
+
+    class Meta:
+        app_label = 'shipping'
+        unique_together = (('method', 'origin_code', 'dest_code', 'weight'),)
+        verbose_name = _("Fallback Quote")
+        verbose_name_plural = _("Fallback Quotes")
+
+
+# cached methods configuration is invalidated on any change of it
+post_save.connect(invalidate_methods_cache, sender=ShippingCompany,
+                  dispatch_uid='oscar_shipping_invalidate_methods_company')
+post_delete.connect(invalidate_methods_cache, sender=ShippingCompany,
+                    dispatch_uid='oscar_shipping_invalidate_methods_company')
+post_save.connect(invalidate_methods_cache, sender=ShippingContainer,
+                  dispatch_uid='oscar_shipping_invalidate_methods_container')
+post_delete.connect(invalidate_methods_cache, sender=ShippingContainer,
+                    dispatch_uid='oscar_shipping_invalidate_methods_container')
+m2m_changed.connect(invalidate_methods_cache, sender=ShippingCompany.containers.through,
+                    dispatch_uid='oscar_shipping_invalidate_methods_containers')
+
+from . import receivers  # noqa
@@ -1,7 +1,10 @@
-from decimal import Decimal as D
+from fractions import Fraction
+from decimal import Decimal as D, ROUND_HALF_UP
 
 from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
+from django.utils.encoding import force_text
 from django.utils.translation import ugettext_lazy as _
 
 from oscar.core import loading
@@ -22,55 +25,185 @@ DEFAULT_WEIGHT = getattr(settings, 'OSCAR_SHIPPING_DEFAULT_WEIGHT', 1)
 # basket volue * VOLUME_RATIO = estimated container(s) volume
 # very simple method
 VOLUME_RATIO = getattr(settings, 'OSCAR_SHIPPING_VOLUME_RATIO', D('1.3'))
-                    
+
+# carriers bill the greater of actual and volumetric weight,
+# volumetric weight (kg) = volume (cm3) / divisor, {<API type>: <divisor>}
+VOLUMETRIC_DIVISORS = getattr(settings, 'OSCAR_SHIPPING_VOLUMETRIC_DIVISORS', {'pecom': 4000,
+                                                                               'emspost': 5000})
+
+# max number of containers of the same type basket could be packed to
+MAX_PACKS = getattr(settings, 'OSCAR_SHIPPING_MAX_PACKS', 10)
+
+# products' sizes and weights are cached for that time, seconds (0 disables the cache)
+PRODUCT_PROFILE_TTL = getattr(settings, 'OSCAR_SHIPPING_PRODUCT_PROFILE_TTL', 60 * 60 * 24 * 7)
+
+
+# packing works on integer millimetres, cubic millimetres and grams,
+# Decimal metres and kilograms are used at the API boundary only
+MM_IN_M = 1000
+G_IN_KG = 1000
+
+
+def to_int_units(value, ratio):
+    return int((D(str(value)) * ratio).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def to_mm(metres):
+    return to_int_units(metres or 0, MM_IN_M)
+
+
+def to_grams(kg):
+    return to_int_units(kg or 0, G_IN_KG)
+
+
+def grams_to_kg(grams):
+    return (D(grams) / G_IN_KG).quantize(weight_precision)
+
+
+def mm3_to_m3(mm3):
+    return (D(mm3) / MM_IN_M ** 3).quantize(volume_precision)
+
+
+def ceil_div(a, b):
+    return -(-a // b)
+
+
+DEFAULT_BOX_MM = (to_mm(DEFAULT_BOX['height']),
+                  to_mm(DEFAULT_BOX['width']),
+                  to_mm(DEFAULT_BOX['length']))
+
+VOLUME_FRACTION = Fraction(str(VOLUME_RATIO))
+
+
+def make_profile_cache_key(product_id, revision):
+    return "shipping_profile:%s:%s" % (product_id, force_text('' if revision is None else revision))
+
+
+def get_profile_cache_key(product):
+    # product revision is the part of the key, attribute values changes
+    # are handled by receivers.invalidate_product_profile()
+    return make_profile_cache_key(product.pk, getattr(product, 'date_updated', None))
+
+
+def read_product_profile(product, size_codes, weight_code, default_weight):
+    """
+    Returns tuple (height, width, length (mm), weight (g), default box used)
+    read from the product attributes
+    """
+    scale = Scale(attribute_code=weight_code,
+                  default_weight=default_weight)
+    try:
+        width, height, length = [to_mm(product.attribute_values.get(attribute__code=attr).value)
+                                 for attr in size_codes]
+        default_box = False
+    except ObjectDoesNotExist:
+        (height, width, length), default_box = DEFAULT_BOX_MM, True
+    return height, width, length, to_grams(scale.weigh_product(product)), default_box
+
+
+def get_product_profiles(products, size_codes=('width', 'height', 'length'),
+                         weight_code='weight', default_weight=DEFAULT_WEIGHT):
+    """
+    Returns dict {product id: profile} of the products given
+    (see read_product_profile()) taken from the cache at once if possible
+    """
+    variant = u'%s|%s|%s' % (u','.join(size_codes), weight_code, default_weight)
+    keys = dict((get_profile_cache_key(p), p) for p in products)
+    cached = cache.get_many(list(keys.keys())) if PRODUCT_PROFILE_TTL else {}
+    profiles = {}
+    for cache_key, product in keys.items():
+        # profiles read with different attribute codes are stored together
+        stored = cached.get(cache_key) or {}
+        profile = stored.get(variant)
+        if profile is None:
+            profile = stored[variant] = read_product_profile(product, size_codes,
+                                                             weight_code, default_weight)
+            if PRODUCT_PROFILE_TTL:
+                cache.set(cache_key, stored, PRODUCT_PROFILE_TTL)
+        profiles[product.pk] = profile
+    return profiles
+
 
 class Box(object):
-    
-    height = 0
-    width = 0
-    length = 0
+    """
+    Sizes are stored as integer millimetres,
+    Decimal metres are returned by the properties
+    """
+    __slots__ = ('height_mm', 'width_mm', 'length_mm')
 
     def __init__(self, h, w, l):
-        self.height, self.width, self.length = h, w, l
-    
+        self.height_mm, self.width_mm, self.length_mm = to_mm(h), to_mm(w), to_mm(l)
+
+    @property
+    def height(self):
+        return D(self.height_mm) / MM_IN_M
+
+    @property
+    def width(self):
+        return D(self.width_mm) / MM_IN_M
+
+    @property
+    def length(self):
+        return D(self.length_mm) / MM_IN_M
+
+    @property
+    def volume_mm3(self):
+        return self.height_mm * self.width_mm * self.length_mm
+
     @property    
     def volume(self):
-        return D(self.height*self.width*self.length).quantize(volume_precision)
+        return mm3_to_m3(self.volume_mm3)
 
 
 class Container(Box):
-    name = ''
+    __slots__ = ('name', 'max_load_g')
 
-    def __init__(self, h, w, l, name):
+    def __init__(self, h, w, l, name, max_load=0):
         self.name = name
+        self.max_load_g = to_grams(max_load)
         super(Container, self).__init__(h, w, l)
 
+    @classmethod
+    def from_model(cls, container):
+        return cls(container.height, container.width, container.length,
+                   container.name, container.max_load)
+
+    @classmethod
+    def cube(cls, volume_mm3, name):
+        """
+        Returns cube container not smaller than volume given
+        """
+        side = int(round(volume_mm3 ** (1 / 3.0)))
+        while side ** 3 < volume_mm3:
+            side += 1
+        box = cls(0, 0, 0, name)
+        box.height_mm = box.width_mm = box.length_mm = side
+        return box
+
 
 class ProductBox(Box):
     """
     'Packs' given product to the virtual box and scale it.
     Takes size and weight from product attributes (if present)
+    or the cached profile given.
     """    
-    weight = 0
+    __slots__ = ('weight_g', 'default_box')
     
     def __init__(self, 
                  product, 
                  size_codes=('width', 'height', 'length'),
                  weight_code='weight',
-                 default_weight=DEFAULT_WEIGHT):
-        self.attributes = size_codes
-        attr_vals = {}
-        scale = Scale(attribute_code=weight_code,
-                      default_weight=default_weight)
-        try:
-            for attr in self.attributes:
-                attr_vals[attr] = product.attribute_values.get(
-                                                attribute__code=attr).value
-        except ObjectDoesNotExist:
-            attr_vals = DEFAULT_BOX
-        self.weight = scale.weigh_product(product)
-        for attr in attr_vals.keys():
-            setattr(self, attr, attr_vals[attr])
+                 default_weight=DEFAULT_WEIGHT,
+                 profile=None):
+        if profile is None:
+            profile = get_product_profiles([product], size_codes, weight_code,
+                                           default_weight)[product.pk]
+        (self.height_mm, self.width_mm, self.length_mm,
+         self.weight_g, self.default_box) = profile
+
+    @property
+    def weight(self):
+        return grams_to_kg(self.weight_g)
 
 
 class Packer(object):
@@ -86,44 +219,106 @@ class Packer(object):
         self.attributes = kwargs.get('attribute_codes', ('width', 'height', 'length'))
         self.weight_code = kwargs.get('weight_code', 'weight')
         self.default_weight = kwargs.get('default_weight', DEFAULT_WEIGHT)
+        # cm3 per kg, actual weight is charged if not set
+        self.volumetric_divisor = kwargs.get('volumetric_divisor', None)
+
+    def get_containers(self):
+        # containers could be given as the related manager, queryset
+        # or plain list (e.g. restored from the cache)
+        containers = self.containers.all() if hasattr(self.containers, 'all') else self.containers
+        return [c if isinstance(c, Container) else Container.from_model(c) for c in containers]
 
     def get_default_container(self, volume):
         """Generates _virtual_ cube container which does not exists in the db
             but enough to calculate estimated shipping charge
-            for the basket's volume given
+            for the basket's volume (m3) given
         """
-        side = float(volume) ** (1 / 3.0)
-        return Container(side, side, side, _('virtual volume (%s)') % volume)
+        return Container.cube(to_int_units(volume, MM_IN_M ** 3), _('virtual volume (%s)') % volume)
     
-    def box_product(self, product):
-        return ProductBox(product, self.attributes, self.weight_code, self.default_weight)
+    def box_product(self, product, profile=None):
+        return ProductBox(product, self.attributes, self.weight_code, self.default_weight, profile)
+
+    def weigh_lines(self, lines):
+        """
+        Returns total weight (kg) of list of tuples (product, quantity) given
+        taken from the cached product profiles
+        """
+        lines = list(lines)
+        profiles = get_product_profiles([product for product, quantity in lines],
+                                        self.attributes, self.weight_code, self.default_weight)
+        return grams_to_kg(sum([profiles[product.pk][3] * quantity for product, quantity in lines]))
+
+    def weigh_basket(self, basket):
+        return self.weigh_lines([(line.product, line.quantity) for line in basket.lines.all()])
 
     def pack_basket(self, basket):
+        return self.pack_lines([(line.product, line.quantity) for line in basket.lines.all()])
+
+    def pack_product(self, product, quantity=1):
+        return self.pack_lines([(product, quantity)])
+
+    def pack_lines(self, lines):
+        """
+        Packs list of tuples (product, quantity) given.
+        Returns list of dicts { 'weight': weight, 'container' : container }
+        """
         # First attempt but very weird 
-        volume = 0
-        weight = 0
-        box = container = matched = None
-        
-        for line in basket.lines.all():
-            box = self.box_product(line.product)
-            volume += box.volume * line.quantity
-            weight += box.weight * line.quantity
-            del box
-        volume = volume * VOLUME_RATIO
-        
-        # Calc container volume during DB query excution
-        # source: http://stackoverflow.com/questions/1652577/django-ordering-queryset-by-a-calculated-field
-        # as we can't use computed values in the WHERE clause
-        # we will filter containers as python list 
-        # container = self.containers.extra(select={'volume': 'height*width*lenght'})\
-        #                           .extra(order_by=['volume'])\
-        #                           .extra(where=['"volume">%s'], params=[volume])[0]
-        
-        # select containers which volumes greater than summarized basket volume
-        matched = [c for c in self.containers.all() if c.volume >= volume]
-        if len(matched) > 0:
-            container = matched[0]
-            # TODO: count container's weight - add it to model        
-        else:
-            container = self.get_default_container(volume)
-        return [{'weight': D(weight).quantize(weight_precision), 'container': container}]
+        volume_mm3 = 0
+        weight_g = 0
+        lines = list(lines)
+        profiles = get_product_profiles([product for product, quantity in lines],
+                                        self.attributes, self.weight_code, self.default_weight)
+        for product, quantity in lines:
+            box = self.box_product(product, profiles[product.pk])
+            volume_mm3 += box.volume_mm3 * quantity
+            weight_g += box.weight_g * quantity
+        # estimated container(s) volume
+        volume_mm3 = int(volume_mm3 * VOLUME_FRACTION)
+        return self.choose_packs(volume_mm3, weight_g)
+
+    def get_chargeable_grams(self, weight_g, container):
+        if not self.volumetric_divisor:
+            return weight_g
+        # cm3 / divisor = kg, so mm3 / divisor = g
+        return max(weight_g, ceil_div(container.volume_mm3, self.volumetric_divisor))
+
+    def get_chargeable_weight(self, packs):
+        """
+        Returns sum of the greater of actual and volumetric weights (kg) of the packs given
+        """
+        return grams_to_kg(sum([self.get_chargeable_grams(to_grams(p['weight']), p['container'])
+                                for p in packs]))
+
+    def get_candidates(self, volume_mm3, weight_g):
+        """
+        Yields tuples (container, count) the volume and weight given could be packed to:
+        as many containers of the same type as required by volume and max load
+        """
+        for container in self.get_containers():
+            if not container.volume_mm3:
+                continue
+            count = ceil_div(volume_mm3, container.volume_mm3)
+            if container.max_load_g:
+                count = max(count, ceil_div(weight_g, container.max_load_g))
+            count = max(count, 1)
+            if count <= MAX_PACKS:
+                yield container, count
+
+    def choose_packs(self, volume_mm3, weight_g):
+        """
+        Returns packs of the cheapest candidate by chargeable weight, then by number
+        of packs and their volume. Default container is used if there is no candidate.
+        """
+        best = best_score = None
+        for container, count in self.get_candidates(volume_mm3, weight_g):
+            pack_g = ceil_div(weight_g, count)
+            score = (self.get_chargeable_grams(pack_g, container) * count,
+                     count,
+                     container.volume_mm3 * count)
+            if best_score is None or score < best_score:
+                best, best_score = (container, count), score
+        if best is None:
+            best = (Container.cube(volume_mm3, _('virtual volume (%s)') % mm3_to_m3(volume_mm3)), 1)
+        container, count = best
+        pack_weight = grams_to_kg(ceil_div(weight_g, count))
+        return [{'weight': pack_weight, 'container': container} for i in range(count)]
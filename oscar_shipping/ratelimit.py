@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+# per-carrier limits of the outbound API calls shared by all workers:
+# {<facade name>: (<calls per second>, <burst>)}, carriers not listed are not limited
+RATE_LIMITS = getattr(settings, 'OSCAR_SHIPPING_RATE_LIMITS', {})
+
+# bucket state is changed under the lock kept in the shared cache,
+# stale lock of the crashed worker expires in that time, seconds
+LOCK_TIMEOUT = 1
+# how long to wait for the lock before the next attempt, seconds
+LOCK_RETRY = 0.005
+
+
+class TokenBucket(object):
+    """
+    Cluster-wide token bucket backed by the shared cache.
+    Bucket holds up to burst tokens and gets rate tokens per second,
+    every call takes one. State (tokens, last refill time) is changed
+    under the cache lock, so all workers share the same bucket
+    and no more than burst calls are made at once.
+    """
+    def __init__(self, name, rate, burst=None):
+        self.name = name
+        self.rate = float(rate)
+        self.burst = int(burst or rate)
+        # idle bucket is full again after that time, its state could expire then
+        self.state_timeout = int(self.burst / self.rate) + 1
+
+    def get_cache_key(self):
+        return "%s_ratelimit" % self.name
+
+    def get_lock_key(self):
+        return "%s_ratelimit_lock" % self.name
+
+    def reserve(self, now=None):
+        """
+        Takes a token if available. Returns 0 on success or
+        the time to wait for the next token, seconds.
+        """
+        now = now or time.time()
+        lock_key = self.get_lock_key()
+        if not cache.add(lock_key, 1, LOCK_TIMEOUT):
+            return LOCK_RETRY
+        try:
+            cache_key = self.get_cache_key()
+            tokens, updated = cache.get(cache_key) or (self.burst, now)
+            # clocks of the workers could differ a bit
+            tokens = min(self.burst, tokens + max(0, now - updated) * self.rate)
+            if tokens < 1 - 1e-9:
+                cache.set(cache_key, (tokens, now), self.state_timeout)
+                return (1 - tokens) / self.rate
+            cache.set(cache_key, (tokens - 1, now), self.state_timeout)
+            return 0
+        finally:
+            cache.delete(lock_key)
+
+    def take(self, now=None):
+        """
+        Takes a token if available. Returns True on success.
+        """
+        return self.reserve(now) == 0
+
+    def acquire(self, wait=0):
+        """
+        Takes a token waiting for refill not longer than wait seconds.
+        Returns False if no token could be taken in time.
+        """
+        deadline = time.time() + wait
+        while True:
+            now = time.time()
+            delay = self.reserve(now)
+            if not delay:
+                return True
+            if now + delay > deadline:
+                return False
+            time.sleep(delay)
+
+
+class NoLimit(object):
+
+    def acquire(self, wait=0):
+        return True
+
+
+def get_bucket(name):
+    try:
+        rate, burst = RATE_LIMITS[name]
+    except KeyError:
+        return NoLimit()
+    return TokenBucket(name, rate, burst)
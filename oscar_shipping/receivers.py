@@ -0,0 +1,184 @@
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete, class_prepared
+
+from oscar.apps.address.abstract_models import AbstractShippingAddress
+from oscar.apps.basket.abstract_models import AbstractLine
+from oscar.core.loading import get_model
+
+from .utils import get_task_runner
+from .packers import make_profile_cache_key, PRODUCT_PROFILE_TTL
+
+try:
+    from django.apps import apps
+except ImportError:
+    # Django < 1.7, models are announced by class_prepared only
+    apps = None
+
+logger = logging.getLogger('oscar_shipping')
+
+# resolve and store carriers' destination codes in background
+# when user's or order's shipping address is saved
+RESOLVE_ON_ADDRESS_SAVE = getattr(settings, 'OSCAR_SHIPPING_RESOLVE_ON_ADDRESS_SAVE', False)
+
+# quote the basket in background for user's default shipping address
+# when basket lines are added, changed or removed
+PREQUOTE_ON_BASKET_CHANGE = getattr(settings, 'OSCAR_SHIPPING_PREQUOTE_ON_BASKET_CHANGE', False)
+
+# dotted path to callable runner(func, *args) used for background tasks,
+# e.g. wrapper sending them to the task queue. Runs them in the local thread by default
+TASK_RUNNER = getattr(settings, 'OSCAR_SHIPPING_TASK_RUNNER', None)
+
+# basket changes made before the scheduled prequote task has started
+# are quoted by that task, unless it hasn't started within that time, seconds
+PREQUOTE_DEBOUNCE = getattr(settings, 'OSCAR_SHIPPING_PREQUOTE_DEBOUNCE', 30)
+
+
+def get_prequote_key(basket_id):
+    return 'prequote:%s' % basket_id
+
+
+def resolve_address_codes(address):
+    ShippingCompany = get_model('shipping', 'ShippingCompany')
+    resolved = set()
+    for method in ShippingCompany.available.cached():
+        if not method.api_type or method.api_type in resolved:
+            continue
+        resolved.add(method.api_type)
+        try:
+            method.facade.resolve_address_code(address)
+        except Exception:
+            logger.exception("Can't resolve %s destination code for address #%s",
+                             method.api_type, address.pk)
+
+
+def resolve_saved_address_codes(app_label, model_name, address_id):
+    """
+    Resolves destination codes of the address saved.
+    Takes model name and id only to be usable with any task runner.
+    """
+    Address = get_model(app_label, model_name)
+    try:
+        address = Address.objects.get(pk=address_id)
+    except Address.DoesNotExist:
+        return
+    resolve_address_codes(address)
+
+
+def run_after_commit(func, *args):
+    """
+    Sends task to the configured runner once the current transaction
+    is committed, so the task sees the saved data.
+    Nothing is scheduled if Django can't tell when it's committed
+    (no transaction.on_commit()), the task would read stale rows otherwise.
+    Returns True if task was scheduled.
+    """
+    on_commit = getattr(transaction, 'on_commit', None)
+    if on_commit is None:
+        return False
+    runner = get_task_runner(TASK_RUNNER)
+    on_commit(lambda: runner(func, *args))
+    return True
+
+
+def resolve_codes_on_address_save(sender, instance, **kwargs):
+    if kwargs.get('raw') or not isinstance(instance, AbstractShippingAddress):
+        return
+    run_after_commit(resolve_saved_address_codes,
+                     instance._meta.app_label, instance._meta.model_name, instance.pk)
+
+
+if RESOLVE_ON_ADDRESS_SAVE:
+    # both address.UserAddress and order.ShippingAddress are subclasses
+    # of AbstractShippingAddress, models aren't loaded yet to be used as senders
+    post_save.connect(resolve_codes_on_address_save,
+                      dispatch_uid='oscar_shipping_resolve_address_codes')
+
+
+def invalidate_product_profile(sender, instance, **kwargs):
+    if kwargs.get('raw'):
+        return
+    # product revision is read without loading the product
+    Product = get_model('catalogue', 'Product')
+    revision = Product.objects.filter(pk=instance.product_id)\
+                              .values_list('date_updated', flat=True).first()
+    cache.delete(make_profile_cache_key(instance.product_id, revision))
+
+
+def connect_profile_invalidation(sender, **kwargs):
+    # the same as get_model('catalogue', 'ProductAttributeValue'),
+    # which can't be called until all models are loaded
+    if sender._meta.app_label != 'catalogue' or sender.__name__ != 'ProductAttributeValue':
+        return
+    post_save.connect(invalidate_product_profile, sender=sender,
+                      dispatch_uid='oscar_shipping_invalidate_product_profile')
+    post_delete.connect(invalidate_product_profile, sender=sender,
+                        dispatch_uid='oscar_shipping_invalidate_product_profile')
+
+
+if PRODUCT_PROFILE_TTL:
+    # catalogue models could be loaded before or after this module
+    if apps is not None:
+        for model in list(apps.all_models.get('catalogue', {}).values()):
+            connect_profile_invalidation(model)
+    class_prepared.connect(connect_profile_invalidation,
+                           dispatch_uid='oscar_shipping_connect_profile_invalidation')
+
+
+def prequote_basket(basket_id):
+    """
+    Quotes the basket for its owner's default shipping address by every
+    active API-based method, so quotes cache is warm on the checkout.
+    Takes ids only to be usable with any task runner.
+    """
+    from .calculator import ShippingCalculator
+    from .facade.base import BACKGROUND_RATE_LIMIT_WAIT
+
+    Basket = get_model('basket', 'Basket')
+    UserAddress = get_model('address', 'UserAddress')
+    ShippingCompany = get_model('shipping', 'ShippingCompany')
+    # changes made since now need another task
+    cache.delete(get_prequote_key(basket_id))
+    try:
+        basket = Basket.objects.get(pk=basket_id)
+    except Basket.DoesNotExist:
+        return
+    if not basket.owner_id or basket.is_empty:
+        return
+    address = UserAddress.objects.filter(user_id=basket.owner_id,
+                                         is_default_for_shipping=True).first()
+    if address is None:
+        return
+    for method in ShippingCompany.available.for_address(address):
+        if not method.api_type:
+            continue
+        # nobody waits for the answer, so wait for the rate limiter
+        # instead of falling back to estimates
+        method.facade.rate_limit_wait = BACKGROUND_RATE_LIMIT_WAIT
+        try:
+            ShippingCalculator(method, deadline=None).calculate_many([(basket, address, None)])
+        except Exception:
+            logger.exception("Can't prequote basket #%s by %s", basket_id, method.code)
+
+
+def prequote_on_basket_change(sender, instance, **kwargs):
+    if kwargs.get('raw') or not isinstance(instance, AbstractLine):
+        return
+    basket_id = instance.basket_id
+    # every line of the basket is saved on merge, quantity changes etc,
+    # the task is scheduled unless there is pending one for the basket already
+    if not cache.add(get_prequote_key(basket_id), 1, PREQUOTE_DEBOUNCE):
+        return
+    if not run_after_commit(prequote_basket, basket_id):
+        cache.delete(get_prequote_key(basket_id))
+
+
+if PREQUOTE_ON_BASKET_CHANGE:
+    # basket models aren't loaded yet to be used as senders
+    post_save.connect(prequote_on_basket_change,
+                      dispatch_uid='oscar_shipping_prequote_on_basket_change')
+    post_delete.connect(prequote_on_basket_change,
+                        dispatch_uid='oscar_shipping_prequote_on_basket_change')
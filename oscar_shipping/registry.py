@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+import importlib
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.translation import ugettext_lazy as _
+
+API_ENABLED = getattr(settings, 'OSCAR_SHIPPING_API_ENABLED', ['pecom', 'emspost'])
+
+# third-party packages can provide their own facades declaring
+# an entry point in this group, e.g. in setup.py:
+#   entry_points={'oscar_shipping.facades': ['dhl = dhl_oscar.facade']}
+# the module must provide ShippingFacade class like built-in ones do
+ENTRY_POINT_GROUP = 'oscar_shipping.facades'
+
+
+def iter_entry_points(group):
+    """
+    Yields tuples (name, module path) of the entry points of the group given
+    """
+    try:
+        from importlib import metadata
+    except ImportError:
+        metadata = None
+    if metadata is not None:
+        eps = metadata.entry_points()
+        if hasattr(eps, 'select'):
+            eps = eps.select(group=group)
+        else:
+            eps = eps.get(group, [])
+        for ep in eps:
+            yield ep.name, ep.value.split(':')[0].strip()
+        return
+    try:
+        import pkg_resources
+    except ImportError:
+        return
+    for ep in pkg_resources.iter_entry_points(group):
+        yield ep.name, ep.module_name
+
+
+class FacadeRegistry(object):
+    """
+    Registry of the shipping API facades.
+    Only dotted paths are stored, so facade module (and the carrier's SDK)
+    is imported on first use, not at Django startup.
+    """
+    def __init__(self, enabled=None):
+        self.enabled = enabled
+        self._paths = {}
+        self._titles = {}
+        self._modules = {}
+        self._entry_points_loaded = False
+
+    def register(self, name, path, title=None):
+        self._paths[name] = path
+        self._titles[name] = title or name
+        self._modules.pop(name, None)
+
+    def load_entry_points(self):
+        # entry points are scanned on first lookup only, not at Django startup
+        if self._entry_points_loaded:
+            return
+        self._entry_points_loaded = True
+        for name, path in iter_entry_points(ENTRY_POINT_GROUP):
+            # built-in facades can't be overridden that way
+            if name not in self._paths:
+                self.register(name, path)
+
+    def is_enabled(self, name):
+        return self.enabled is None or name in self.enabled
+
+    def keys(self):
+        self.load_entry_points()
+        return [n for n in self._paths.keys() if self.is_enabled(n)]
+
+    def choices(self):
+        return [(n, self._titles[n]) for n in self.keys()]
+
+    def __contains__(self, name):
+        return name in self.keys()
+
+    def __getitem__(self, name):
+        """
+        Returns facade module imported by its registered name
+        """
+        if name not in self:
+            raise KeyError(name)
+        try:
+            return self._modules[name]
+        except KeyError:
+            pass
+        try:
+            module = importlib.import_module(self._paths[name])
+        except ImportError as e:
+            raise ImproperlyConfigured("Shipping facade '%s' (%s) couldn't be imported: %s" % (name,
+                                                                                                self._paths[name],
+                                                                                                e))
+        self._modules[name] = module
+        return module
+
+    def get_facade(self, name, api_user=None, api_key=None):
+        try:
+            module = self[name]
+        except KeyError:
+            raise ImproperlyConfigured("Shipping facade '%s' is not registered or "
+                                       "not enabled in OSCAR_SHIPPING_API_ENABLED" % name)
+        return module.ShippingFacade(api_user, api_key)
+
+
+class LazyChoices(object):
+    """
+    Choices of the registered facades evaluated on iteration,
+    so entry points aren't scanned while models are defined
+    """
+    def __init__(self, registry):
+        self.registry = registry
+
+    def __iter__(self):
+        return iter(self.registry.choices())
+
+    def __bool__(self):
+        # Field.__init__() tests choices, don't evaluate them for that
+        return True
+    __nonzero__ = __bool__
+
+
+registry = FacadeRegistry(enabled=API_ENABLED)
+registry.register('pecom', 'oscar_shipping.facade.pecom', _('PEC API ver. 1.0'))
+registry.register('emspost', 'oscar_shipping.facade.emspost', _('EMS Russian Post REST API'))
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Local on-disk snapshots of the carrier directories.
+Workers can start warm (or survive API outage) with empty shared cache
+loading directory from the snapshot instead of calling API.
+"""
+import os
+import json
+import errno
+import tempfile
+
+from django.conf import settings
+
+# directory for snapshot files, feature is disabled if not set
+SNAPSHOT_DIR = getattr(settings, 'OSCAR_SHIPPING_SNAPSHOT_DIR', None)
+
+# bump it on snapshot format changes, files of other versions are ignored
+SNAPSHOT_VERSION = 1
+
+# process-wide parsed snapshots {name: (mtime, snapshot)}
+_loaded = {}
+
+
+def get_snapshot_path(name):
+    return os.path.join(SNAPSHOT_DIR, "%s.v%s.json" % (name, SNAPSHOT_VERSION))
+
+
+def write_snapshot(name, data, ts):
+    """
+    Atomically replaces snapshot of the directory given.
+    Returns True on success.
+    """
+    if not SNAPSHOT_DIR:
+        return False
+    try:
+        os.makedirs(SNAPSHOT_DIR)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            return False
+    path = get_snapshot_path(name)
+    fd, tmp_path = tempfile.mkstemp(dir=SNAPSHOT_DIR, prefix='.%s.' % name)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'version': SNAPSHOT_VERSION,
+                       'name': name,
+                       'ts': ts,
+                       'data': data}, f, separators=(',', ':'))
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # Windows can't rename over existing file
+            os.remove(path)
+            os.rename(tmp_path, path)
+    except (IOError, OSError, TypeError, ValueError):
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        return False
+    _loaded.pop(name, None)
+    return True
+
+
+def read_snapshot(name):
+    """
+    Returns tuple (timestamp, data) of the directory snapshot
+    or None if there is no valid snapshot.
+    """
+    if not SNAPSHOT_DIR:
+        return None
+    path = get_snapshot_path(name)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    try:
+        loaded_mtime, snapshot = _loaded[name]
+    except KeyError:
+        loaded_mtime = snapshot = None
+    if loaded_mtime != mtime:
+        try:
+            with open(path) as f:
+                snapshot = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if snapshot.get('version') != SNAPSHOT_VERSION or snapshot.get('name') != name:
+            return None
+        _loaded[name] = (mtime, snapshot)
+    return snapshot['ts'], snapshot['data']
@@ -1,6 +1,135 @@
+import time
+import datetime
+import collections
+import threading
+import importlib
+
+from multiprocessing.pool import ThreadPool
+
+
 def del_key(dict, key):
     """Delete a pair key-value from dict given 
     """
     for k in list(dict.keys()):
         if k == key:
-            del dict[k]
\ No newline at end of file
+            del dict[k]
+
+
+def run_in_background(func, *args, **kwargs):
+    """Run callable given in the separate daemon thread
+    """
+    t = threading.Thread(target=func, args=args, kwargs=kwargs)
+    t.daemon = True
+    t.start()
+    return t
+
+
+def run_task(func, *args):
+    """Run task given closing the thread's own DB connection then
+    """
+    from django.db import connection
+
+    try:
+        func(*args)
+    finally:
+        connection.close()
+
+
+def run_task_in_background(func, *args):
+    """Run task given in the separate daemon thread
+    """
+    return run_in_background(run_task, func, *args)
+
+
+def get_task_runner(path=None):
+    """Returns callable runner(func, *args) imported by dotted path given
+    or run_task_in_background() if no path
+    """
+    if not path:
+        return run_task_in_background
+    module, name = path.rsplit('.', 1)
+    return getattr(importlib.import_module(module), name)
+
+
+def imap_concurrently(func, items, workers=4):
+    """Apply func to every item using the pool of threads given size.
+    Results are yielded as soon as they are ready, not in order of items.
+    """
+    pool = ThreadPool(max(1, workers))
+    try:
+        for res in pool.imap_unordered(func, items):
+            yield res
+    finally:
+        pool.terminate()
+
+
+def get_top_destinations(top, days):
+    """Returns list of the most popular cities of destination
+    taken from the orders placed during the period given
+    """
+    from django.db.models import Count
+    from django.utils import timezone
+    from oscar.core.loading import get_model
+
+    ShippingAddress = get_model('order', 'ShippingAddress')
+    since = timezone.now() - datetime.timedelta(days=days)
+    qs = ShippingAddress.objects.filter(order__date_placed__gte=since)\
+                                .exclude(line4='')\
+                                .values('line4')\
+                                .annotate(num=Count('id'))\
+                                .order_by('-num')[:top]
+    return [r['line4'] for r in qs]
+
+
+class Throttle(object):
+    """Process-wide limiter of the calls rate.
+    wait() blocks caller until the next call allowed.
+    """
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_call = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.time()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Deadline(object):
+    """Point in time the work should be done before.
+    Passed down to API calls to cap their duration.
+    """
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.expires = time.time() + timeout
+
+    def remaining(self):
+        return max(0, self.expires - time.time())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+
+class LatencyTracker(object):
+    """Keeps the latest durations of calls to estimate percentiles
+    """
+    def __init__(self, size=100):
+        self.samples = collections.deque(maxlen=size)
+
+    def add(self, elapsed):
+        self.samples.append(elapsed)
+
+    def percentile(self, p, min_samples=20):
+        """Returns p-th percentile of the latencies tracked
+        or None if there are too few samples
+        """
+        samples = sorted(self.samples)
+        if len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * p / 100.0))]
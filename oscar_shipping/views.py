@@ -1,20 +1,24 @@
 # -*- coding: UTF-8 -*-
 import json
+import hashlib
 
-from django.shortcuts import render
+from django.conf import settings
+from django.core.cache import cache
+from django.shortcuts import render, get_object_or_404
 from django.contrib import messages
 from django.http import HttpResponse, HttpResponseBadRequest
 from django.views.generic.base import View
 from django.utils.translation import ugettext_lazy as _
+from django.utils.encoding import force_text
+from django.core.exceptions import ImproperlyConfigured
 from django.template.loader import render_to_string
 from django.template import Context, Template
 
 from oscar.core import ajax
-from oscar.core.loading import get_class
+from oscar.core.loading import get_class, get_model
 
-from .models import api_modules_pool
-from .packers import Packer
-from .exceptions import (OriginCityNotFoundError,
+from .exceptions import (FacadeError,
+                         OriginCityNotFoundError,
                          CityNotFoundError,
                          ApiOfflineError,
                          TooManyFoundError,
@@ -23,7 +27,17 @@ from .exceptions import (OriginCityNotFoundError,
 from .checkout.session import CheckoutSessionMixin
 
 Repository = get_class('shipping.repository', 'Repository')
-Scale = get_class('shipping.scales', 'Scale')
+ShippingCompany = get_model('shipping', 'ShippingCompany')
+ShippingRate = get_model('shipping', 'ShippingRate')
+Product = get_model('catalogue', 'Product')
+
+# product page estimates are cached for that time, seconds
+ESTIMATE_CACHE_TTL = getattr(settings, 'OSCAR_SHIPPING_ESTIMATE_CACHE_TTL', 60 * 60)
+# quantity is rounded up to the closest band, so estimates are shared between close quantities
+ESTIMATE_QTY_BANDS = getattr(settings, 'OSCAR_SHIPPING_ESTIMATE_QTY_BANDS', (1, 2, 3, 5, 10, 20, 50, 100))
+# call carrier's API (both for city lookups and quotes) if estimate is not found
+# in the rates tables and quotes cache. Estimates are public, so it's off by default
+ESTIMATE_LIVE_QUOTES = getattr(settings, 'OSCAR_SHIPPING_ESTIMATE_LIVE_QUOTES', False)
 
 
 # this is a workaround for currency tag which can be overloaded in the project
@@ -56,8 +70,7 @@ class CityLookupView(CheckoutSessionMixin, View):
         if not hasattr(self.method, 'api_type'):
             return []
         
-        self.facade = api_modules_pool[self.method.api_type].\
-            ShippingFacade(self.method.api_user, self.method.api_key)
+        self.facade = self.method.facade
         return self.facade.get_queryset()
          
     def format_object(self, qs):
@@ -74,8 +87,14 @@ class CityLookupView(CheckoutSessionMixin, View):
     def initial_filter(self, qs, value):
         return self.filter(qs, lambda k, v: k == "id" and v in value.split(','))
 
-    def lookup_filter(self, qs, term):
-        return self.filter(qs, lambda k, v: k == "text" and term.lower() in v.lower())
+    def lookup_queryset(self, term):
+        """ Return normalized queryset-like list of dicts matched the term
+            using facade's lookup (indexed query if location table is used)
+        """
+        if not hasattr(self.method, 'api_type'):
+            return []
+        self.facade = self.method.facade
+        return self.facade.lookup(term)
 
     def paginate(self, qs, page, page_limit):
         total = len(qs)
@@ -101,17 +120,21 @@ class CityLookupView(CheckoutSessionMixin, View):
             if m.code == method_code:
                 self.method = m
         
-        qs = self.get_queryset()
-
         initial, q, page, page_limit = self.get_args()
 
-        if initial:
-            qs = list(self.initial_filter(qs, initial))
-            more = False
-        else:
-            if q:
-                qs = list(self.lookup_filter(qs, q))
-            qs, more = self.paginate(qs, page, page_limit)
+        try:
+            if initial:
+                qs = list(self.initial_filter(self.get_queryset(), initial))
+                more = False
+            else:
+                if q:
+                    qs = self.lookup_queryset(q)
+                else:
+                    qs = self.get_queryset()
+                qs, more = self.paginate(qs, page, page_limit)
+        except ApiOfflineError:
+            # API is offline, busy or too slow, nothing to choose from
+            qs, more = [], False
 
         return HttpResponse(json.dumps({
             'results': self.format_object(qs),
@@ -161,20 +184,15 @@ class ShippingDetailsView(CheckoutSessionMixin, View):
                 ctx['method_code'] = method_code
         if not method:
             return HttpResponseBadRequest('Bad shipping method code!')
-        facade = api_modules_pool[method.api_type].ShippingFacade(method.api_user, method.api_key)
+        facade = method.facade
         fromID, toID = self.get_args()
         if not fromID or not toID:
             return HttpResponseBadRequest('Required parameters not found in the query string!')
         origin = facade.get_by_code(fromID)
         dest = facade.get_by_code(toID)
        
-        scale = Scale(attribute_code=method.weight_attribute,
-                      default_weight=method.default_weight)
-        packer = Packer(method.containers,
-                        attribute_codes=method.size_attributes,
-                        weight_code=method.weight_attribute,
-                        default_weight=method.default_weight)
-        weight = scale.weigh_basket(request.basket)
+        packer = method.get_packer()
+        weight = packer.weigh_basket(request.basket)
         # Should be a list of dicts { 'weight': weight, 'container' : container }
         packs = packer.pack_basket(request.basket)  
         flash_messages = ajax.FlashMessages()
@@ -207,3 +225,123 @@ class ShippingDetailsView(CheckoutSessionMixin, View):
         else:
             messages.error(request, msg)
             return render(request, self.template, ctx, content_type="text/html")
+
+
+class ShippingEstimateView(View):
+    """
+    Returns JSON with shipping charges estimated for the product
+    for each active API-based method.
+    Usage example:
+    /shipping/estimate/[PRODUCT_ID]/?qty=2&city=Москва
+    /shipping/estimate/[PRODUCT_ID]/?qty=2&to=[DESTINATION_CODE]
+    Answers from the rates tables or quotes cache if possible.
+    """
+    def get_args(self):
+        GET = self.request.GET
+        try:
+            qty = max(1, int(GET.get('qty', 1)))
+        except ValueError:
+            qty = 1
+        return (qty,
+                GET.get('city', None),
+                GET.get('to', None))
+
+    def get_qty_band(self, qty):
+        for band in ESTIMATE_QTY_BANDS:
+            if qty <= band:
+                return band
+        return qty
+
+    def get_methods(self):
+        # methods checkout wouldn't offer are skipped
+        return [m for m in ShippingCompany.available.cached()
+                if m.api_type and m.status not in (m.OFFLINE, m.DISABLED)]
+
+    def get_dest_code(self, method, city, code):
+        facade = method.facade
+        if code:
+            dest_code = facade.validate_code(code) or None
+        else:
+            dest_codes, errors = facade.get_cached_codes(facade.clean_city_name(city),
+                                                         use_api=ESTIMATE_LIVE_QUOTES)
+            dest_code = dest_codes[0] if len(dest_codes) == 1 else None
+        if dest_code and method.codes_allowed([dest_code]) is False:
+            return None
+        return dest_code
+
+    def get_cache_key(self, method, packs, dest_code):
+        # packs are built from the cached product profile, so changed
+        # dimensions or weight give the new key
+        key = u':'.join([method.code, force_text(dest_code)] +
+                        [u'%s/%s' % (p['container'].name, p['weight']) for p in packs])
+        return "shipping_estimate:%s" % hashlib.md5(key.encode('utf-8')).hexdigest()
+
+    def estimate(self, method, product, qty, city, code):
+        """
+        Returns dict with estimated charge or None
+        """
+        facade = method.facade
+        dest_code = self.get_dest_code(method, city, code)
+        if not dest_code:
+            return None
+        packs = method.get_packer().pack_product(product, qty)
+        cache_key = self.get_cache_key(method, packs, dest_code)
+        res = cache.get(cache_key)
+        if res is not None:
+            return dict(res, qty=qty) if res else None
+
+        origin_code = facade.get_cached_origin_code(method.origin)
+        weight = sum([p['weight'] for p in packs])
+        volume = sum([p['container'].volume for p in packs])
+
+        charge = None
+        source = 'table'
+        # only routes carrier has answered about are final misses,
+        # API errors, rate limits etc shouldn't hide estimates for the cache TTL
+        answered = False
+        estimate = ShippingRate.objects.estimate(method, origin_code, dest_code, weight, volume)
+        if estimate is not None:
+            charge = estimate[0]
+        else:
+            cached, pending = facade.split_cached_requests([(origin_code, dest_code, packs)])
+            if cached:
+                source = 'cache'
+                charge = facade.get_quote_charge(cached[0][1])[0]
+            elif ESTIMATE_LIVE_QUOTES and not facade.is_circuit_open():
+                source = 'quote'
+                for reqs, results, errors in facade.quote_requests(pending):
+                    answered = results is not None
+                    quote = None if errors else facade.get_quote_charge(results)
+                    if quote is not None:
+                        charge = quote[0]
+        if charge is None:
+            if answered:
+                cache.set(cache_key, {}, ESTIMATE_CACHE_TTL)
+            return None
+        res = {'method_code': method.code,
+               'name': force_text(method.name),
+               'charge': currency(charge),
+               'charge_value': force_text(charge),
+               'qty': qty,
+               'source': source,
+               }
+        cache.set(cache_key, res, ESTIMATE_CACHE_TTL)
+        return res
+
+    def get(self, request, **kwargs):
+        self.request = request
+        product = get_object_or_404(Product, pk=kwargs['pk'])
+        qty, city, code = self.get_args()
+        if not city and not code:
+            return HttpResponseBadRequest('Required parameters not found in the query string!')
+        qty = self.get_qty_band(qty)
+        results = []
+        for method in self.get_methods():
+            try:
+                res = self.estimate(method, product, qty, city, code)
+            except (FacadeError, ImproperlyConfigured):
+                res = None
+            if res:
+                results.append(res)
+        return HttpResponse(json.dumps({'results': results}),
+                            content_type='application/json')
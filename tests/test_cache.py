@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_django-oscar-shipping
+------------
+
+Tests for `django-oscar-shipping` cache module.
+"""
+
+import uuid
+import unittest
+
+import mock
+
+from django.core.cache import cache
+
+from oscar_shipping import cache as large_cache
+
+
+class TestLargeValues(unittest.TestCase):
+
+    def setUp(self):
+        cache.clear()
+        # poorly compressible value split into some chunks
+        self.value = [uuid.uuid4().hex for i in range(20)]
+        self.patcher = mock.patch.object(large_cache, 'CHUNK_SIZE', 64)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        cache.clear()
+
+    def test_value_is_stored_in_chunks(self):
+        large_cache.set_large('directory', self.value)
+        manifest = cache.get('directory')
+        self.assertTrue(manifest['chunks'] > 1)
+        self.assertEqual(large_cache.get_large('directory'), self.value)
+
+    def test_small_value(self):
+        large_cache.set_large('directory', {'a': 1})
+        self.assertEqual(cache.get('directory')['chunks'], 1)
+        self.assertEqual(large_cache.get_large('directory'), {'a': 1})
+
+    def test_missing_value(self):
+        self.assertEqual(large_cache.get_large('directory', 'default'), 'default')
+
+    def test_missing_chunk(self):
+        large_cache.set_large('directory', self.value)
+        manifest = cache.get('directory')
+        cache.delete(large_cache.get_chunk_keys('directory', manifest)[-1])
+        self.assertEqual(large_cache.get_large('directory'), None)
+
+    def test_previous_chunks_are_deleted(self):
+        large_cache.set_large('directory', self.value)
+        previous = cache.get('directory')
+        large_cache.set_large('directory', self.value[:5])
+        self.assertEqual(cache.get_many(large_cache.get_chunk_keys('directory', previous)), {})
+        self.assertEqual(large_cache.get_large('directory'), self.value[:5])
+
+    def test_meta(self):
+        large_cache.set_large('directory', self.value, meta={'ts': 10})
+        self.assertEqual(large_cache.get_large_meta('directory'), {'ts': 10})
+        large_cache.set_large('directory', self.value)
+        self.assertEqual(large_cache.get_large_meta('directory', 'default'), 'default')
+
+    def test_delete(self):
+        large_cache.set_large('directory', self.value)
+        manifest = cache.get('directory')
+        large_cache.delete_large('directory')
+        self.assertEqual(cache.get('directory'), None)
+        self.assertEqual(cache.get_many(large_cache.get_chunk_keys('directory', manifest)), {})
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_django-oscar-shipping
+------------
+
+Tests for `django-oscar-shipping` calculator module.
+"""
+
+import unittest
+
+from decimal import Decimal as D
+
+import mock
+
+from oscar_shipping.calculator import ShippingCalculator, ShippingQuote
+from oscar_shipping.utils import Deadline
+from oscar_shipping.exceptions import (ApiOfflineError, DeadlineExceeded,
+                                       RateLimitExceeded)
+
+OPTIONS = {'senderCityId': '1', 'receiverCityId': '2'}
+PROFILE = (D('1.000'), [])
+
+
+def make_method():
+    method = mock.Mock()
+    method.code = 'fake'
+    method.name = 'Fake'
+    method.origin = u'Санкт-Петербург'
+    method.estimate_charge.return_value = None
+    method.get_fallback_charge.return_value = None
+    method.facade.parse_results.return_value = (D('100.00'), '', '', None)
+    method.facade.get_quote_services.return_value = ()
+    return method
+
+
+class TestCalculateWithOptions(unittest.TestCase):
+    """
+    Final calculation for the codes chosen by user (preview and place order)
+    """
+    def setUp(self):
+        self.method = make_method()
+        self.facade = self.method.facade
+        self.basket = mock.Mock(currency='RUB', pk=1)
+        self.destination = mock.Mock(city=u'Москва')
+        self.calculator = ShippingCalculator(self.method, Deadline(5))
+
+    def calculate(self):
+        return self.calculator.calculate(self.basket, self.destination, OPTIONS, PROFILE)
+
+    def test_live(self):
+        self.facade.get_charge.return_value = ({'price': 100}, False)
+        quote = self.calculate()
+        self.assertTrue(quote.is_valid)
+        self.assertEqual(quote.charge, D('100.00'))
+        self.assertEqual(quote.provenance, ShippingQuote.LIVE)
+        self.assertEqual(self.facade.get_charge.call_args[0][:2], ('1', '2'))
+
+    def test_deadline_exceeded(self):
+        self.facade.get_charge.side_effect = DeadlineExceeded('fake')
+        quote = self.calculate()
+        self.assertFalse(quote.is_valid)
+        self.assertEqual(quote.charge, D('0.0'))
+        self.method.get_fallback_charge.assert_called_once_with(PROFILE[0], PROFILE[1],
+                                                                self.destination, use_rates=True)
+
+    def test_rate_limit_fallback(self):
+        self.facade.get_charge.side_effect = RateLimitExceeded('fake')
+        self.method.get_fallback_charge.return_value = (D('300.00'), 'fallback', None,
+                                                        ShippingQuote.FALLBACK)
+        quote = self.calculate()
+        self.assertTrue(quote.is_valid)
+        self.assertEqual(quote.charge, D('300.00'))
+        self.assertEqual(quote.provenance, ShippingQuote.FALLBACK)
+
+    def test_api_offline(self):
+        self.facade.get_charge.side_effect = ApiOfflineError('fake')
+        quote = self.calculate()
+        self.assertFalse(quote.is_valid)
+        self.method.get_fallback_charge.assert_called_once_with(PROFILE[0], PROFILE[1],
+                                                                self.destination)
+
+    def test_api_errors(self):
+        self.facade.get_charge.return_value = (None, 'bad request')
+        quote = self.calculate()
+        self.assertFalse(quote.is_valid)
+        self.assertFalse(self.facade.parse_results.called)
+
+
+class TestCalculateMany(unittest.TestCase):
+
+    def setUp(self):
+        self.method = make_method()
+        self.facade = self.method.facade
+        self.facade.split_cached_requests.side_effect = lambda reqs: ([], [('key', reqs)])
+        self.facade.quote_requests.side_effect = lambda pending, workers: [
+            (reqs, {'price': 100}, False) for key, reqs in pending]
+        self.calculator = ShippingCalculator(self.method, Deadline(5))
+        self.calculator.get_profile = mock.Mock(return_value=PROFILE)
+
+    def make_job(self, city):
+        return (mock.Mock(currency='RUB', pk=1), mock.Mock(city=city), None)
+
+    def test_failed_job_does_not_abort_batch(self):
+        def get_city_codes(origin, destination, deadline):
+            if destination.city == u'Тверь':
+                raise ValueError('SDK failure')
+            return '1', '2'
+        self.facade.get_city_codes.side_effect = get_city_codes
+        quotes = self.calculator.calculate_many([self.make_job(u'Тверь'),
+                                                 self.make_job(u'Москва')])
+        self.assertFalse(quotes[0].is_valid)
+        self.assertTrue(quotes[1].is_valid)
+        self.assertEqual(quotes[1].charge, D('100.00'))
+
+    def test_deadline_is_shared(self):
+        self.facade.get_city_codes.return_value = ('1', '2')
+        self.calculator.calculate_many([self.make_job(u'Тверь'), self.make_job(u'Москва')])
+        deadlines = set(id(c[0][2]) for c in self.facade.get_city_codes.call_args_list)
+        self.assertEqual(len(deadlines), 1)
+
+    def test_batch_errors_reported_per_job(self):
+        self.facade.get_city_codes.return_value = ('1', '2')
+        self.facade.quote_requests.side_effect = lambda pending, workers: [
+            (reqs, None, ApiOfflineError('fake')) for key, reqs in pending]
+        quotes = self.calculator.calculate_many([self.make_job(u'Москва')])
+        self.assertFalse(quotes[0].is_valid)
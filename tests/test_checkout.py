@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_django-oscar-shipping
+------------
+
+Tests for `django-oscar-shipping` checkout session mixin.
+"""
+
+import unittest
+
+import mock
+
+from oscar_shipping.checkout import session
+from oscar_shipping.utils import Deadline
+
+
+class FakeMethod(object):
+    deadline = None
+
+    def calculate(self, basket, options=None):
+        self.used_deadline = self.deadline
+        return 'price'
+
+
+class TestShippingDeadline(unittest.TestCase):
+
+    def setUp(self):
+        self.view = session.CheckoutSessionMixin()
+        self.view.request = mock.Mock(spec=[])
+        self.view.checkout_session = mock.Mock()
+        self.view.checkout_session._get.return_value = {'senderCityId': '1'}
+
+    def test_deadline_is_shared_by_request(self):
+        methods = self.view.use_shipping_deadline([FakeMethod(), FakeMethod()])
+        self.assertTrue(isinstance(methods[0].deadline, Deadline))
+        self.assertTrue(methods[0].deadline is methods[1].deadline)
+        self.assertTrue(self.view.get_shipping_deadline() is methods[0].deadline)
+
+    def test_no_deadline(self):
+        with mock.patch.object(session, 'CHECKOUT_DEADLINE', None):
+            methods = self.view.use_shipping_deadline([FakeMethod()])
+        self.assertEqual(methods[0].deadline, None)
+
+    def test_final_calculation_has_own_deadline(self):
+        method, = self.view.use_shipping_deadline([FakeMethod()])
+        shared = method.deadline
+        self.assertEqual(self.view.calculate_shipping_charge(method, mock.Mock()), 'price')
+        self.assertTrue(isinstance(method.used_deadline, Deadline))
+        self.assertFalse(method.used_deadline is shared)
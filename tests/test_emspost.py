@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_django-oscar-shipping
+------------
+
+Tests for `django-oscar-shipping` emspost facade.
+"""
+
+import unittest
+
+from decimal import Decimal as D
+
+from oscar_shipping.facade import emspost
+
+
+class TestSplitParcels(unittest.TestCase):
+
+    def setUp(self):
+        self.facade = emspost.ShippingFacade()
+        self.max_weight = emspost.MAX_PARCEL_WEIGHT
+
+    def test_light(self):
+        self.assertEqual(self.facade.split_parcels(D('10')), [(D('10'), 1)])
+
+    def test_max_weight(self):
+        self.assertEqual(self.facade.split_parcels(self.max_weight), [(self.max_weight, 1)])
+
+    def test_heavy(self):
+        weight = self.max_weight * 2 + D('7.25')
+        self.assertEqual(self.facade.split_parcels(weight),
+                         [(self.max_weight, 2), (D('7.25'), 1)])
+
+    def test_multiple_of_max_weight(self):
+        self.assertEqual(self.facade.split_parcels(self.max_weight * 3), [(self.max_weight, 3)])
+
+    def test_weight_given_as_string(self):
+        self.assertEqual(self.facade.split_parcels('1.5'), [(D('1.5'), 1)])
+
+    def test_empty(self):
+        self.assertEqual(self.facade.split_parcels(0), [])
@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_django-oscar-shipping
+------------
+
+Tests for `django-oscar-shipping` facade base module.
+"""
+
+import threading
+import unittest
+
+import mock
+
+from django.core.cache import cache
+
+from oscar_shipping.facade import base
+from oscar_shipping.exceptions import (ApiOfflineError, RateLimitExceeded,
+                                       DeadlineExceeded)
+
+
+class FakeDeadline(object):
+    """
+    Deadline with the remaining time given instead of the clock
+    """
+    def __init__(self, remaining):
+        self.seconds = remaining
+
+    def remaining(self):
+        return max(0, self.seconds)
+
+    def expired(self):
+        return self.seconds <= 0
+
+
+class FakeAPI(object):
+    """
+    Stands for the SDK client. The first call of slow client
+    waits until released, so the deadline and hedging could be tested
+    """
+    def __init__(self, answer=('result', False), slow=False):
+        self.answer = answer
+        self.slow = slow
+        self.release = threading.Event()
+        self.calls = []
+
+    def calculate(self, *args):
+        self.calls.append(args)
+        if self.slow and len(self.calls) == 1:
+            self.release.wait(5)
+        if isinstance(self.answer, Exception):
+            raise self.answer
+        return self.answer
+
+
+class FakeFacade(base.AbstractShippingFacade):
+    name = 'fake'
+
+    def __init__(self, api):
+        self.api = api
+        self.created = []
+
+    def create_api(self):
+        api = FakeAPI(self.api.answer)
+        self.created.append(api)
+        return api
+
+
+class TestCallApi(unittest.TestCase):
+
+    def setUp(self):
+        cache.clear()
+        base.latencies.clear()
+        self.api = FakeAPI()
+        self.facade = FakeFacade(self.api)
+
+    def tearDown(self):
+        self.api.release.set()
+        cache.clear()
+
+    def get_failures(self):
+        return cache.get(self.facade.get_circuit_cache_key()) or 0
+
+    def test_answer(self):
+        self.assertEqual(self.facade.call_api('calculate', 1, 2), ('result', False))
+        self.assertEqual(self.api.calls, [(1, 2)])
+
+    def test_answer_with_deadline(self):
+        self.assertEqual(self.facade.call_api('calculate', 1, deadline=FakeDeadline(5)),
+                         ('result', False))
+
+    def test_expired_deadline(self):
+        with self.assertRaises(DeadlineExceeded):
+            self.facade.call_api('calculate', deadline=FakeDeadline(0))
+        self.assertEqual(self.api.calls, [])
+
+    def test_deadline_exceeded(self):
+        self.api.slow = True
+        with self.assertRaises(DeadlineExceeded):
+            self.facade.call_api('calculate', deadline=FakeDeadline(0.05))
+        self.assertEqual(self.get_failures(), 1)
+
+    def test_rate_limit(self):
+        bucket = mock.Mock()
+        bucket.acquire.return_value = False
+        with mock.patch.object(base, 'get_bucket', return_value=bucket):
+            with self.assertRaises(RateLimitExceeded):
+                self.facade.call_api('calculate')
+            res, errors = self.facade.call_lookup_api('calculate')
+        self.assertEqual(res, None)
+        self.assertTrue(isinstance(errors, ApiOfflineError))
+        self.assertEqual(self.api.calls, [])
+
+    def test_rate_limit_wait_is_capped_by_deadline(self):
+        bucket = mock.Mock()
+        with mock.patch.object(base, 'get_bucket', return_value=bucket):
+            self.facade.call_api('calculate', deadline=FakeDeadline(0.5))
+        bucket.acquire.assert_called_once_with(0.5)
+
+    def test_sdk_exception(self):
+        self.api.answer = ValueError('broken')
+        with self.assertRaises(ValueError):
+            self.facade.call_api('calculate', deadline=FakeDeadline(5))
+        self.assertEqual(self.get_failures(), 1)
+
+    def test_failed_answer(self):
+        self.api.answer = (None, IOError('unreachable'))
+        self.assertEqual(self.facade.call_api('calculate'), self.api.answer)
+        self.assertEqual(self.get_failures(), 1)
+
+    def test_circuit_breaker(self):
+        self.api.answer = (None, IOError('unreachable'))
+        for i in range(base.CIRCUIT_FAILURES):
+            self.assertFalse(self.facade.is_circuit_open())
+            self.facade.call_api('calculate')
+        self.assertTrue(self.facade.is_circuit_open())
+        # any successful call resets the counter
+        self.api.answer = ('result', False)
+        self.facade.call_api('calculate')
+        self.assertFalse(self.facade.is_circuit_open())
+
+    def test_hedged_call(self):
+        self.api.slow = True
+        with mock.patch.object(base, 'HEDGE_REQUESTS', True), \
+                mock.patch.object(base, 'HEDGE_DELAY', 0.01):
+            res = self.facade.call_api('calculate', 1, deadline=FakeDeadline(5))
+        self.assertEqual(res, ('result', False))
+        # hedged call is sent with its own client
+        self.assertEqual(len(self.facade.created), 1)
+        self.assertEqual(self.facade.created[0].calls, [(1,)])
+
+    def test_not_hedged_without_deadline(self):
+        with mock.patch.object(base, 'HEDGE_REQUESTS', True), \
+                mock.patch.object(base, 'HEDGE_DELAY', 0.01):
+            self.facade.call_api('calculate')
+        self.assertEqual(self.facade.created, [])
+
+
+class TestQuoteRequests(unittest.TestCase):
+
+    def setUp(self):
+        cache.clear()
+        base.throttles.clear()
+        self.facade = FakeFacade(FakeAPI())
+        self.facade.get_batch_charge = mock.Mock(return_value=({'price': 100}, False))
+
+    def tearDown(self):
+        cache.clear()
+        base.throttles.clear()
+
+    def quote(self, rate):
+        pending = [('key', [('1', '2', [], 0)])]
+        return list(self.facade.quote_requests(pending, workers=1, rate=rate))
+
+    def test_results(self):
+        self.assertEqual(self.quote(100), [([('1', '2', [], 0)], {'price': 100}, False)])
+
+    def test_throttle_per_rate(self):
+        self.quote(100)
+        throttle = base.throttles[('fake', 100)]
+        self.quote(100)
+        self.assertTrue(base.throttles[('fake', 100)] is throttle)
+        self.quote(50)
+        self.assertEqual(base.throttles[('fake', 50)].interval, 1.0 / 50)
+
+    def test_sdk_exception_reported(self):
+        self.facade.get_batch_charge.side_effect = ValueError('broken')
+        reqs, results, errors = self.quote(100)[0]
+        self.assertEqual(results, None)
+        self.assertTrue(isinstance(errors, ValueError))
+
+
+class Clock(object):
+    """
+    Stands for the time module
+    """
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+class TestStaleWhileRevalidate(unittest.TestCase):
+
+    def setUp(self):
+        cache.clear()
+        base.directories.clear()
+        self.api = FakeAPI()
+        self.api.get_branches = mock.Mock(return_value=(['first'], False))
+        self.facade = FakeFacade(self.api)
+        self.clock = Clock(1000.0)
+        self.background = []
+        patchers = [mock.patch.object(base, 'time', self.clock),
+                    mock.patch.object(base, 'run_in_background', self.background.append),
+                    mock.patch.object(base, 'read_snapshot', return_value=None),
+                    mock.patch.object(base, 'write_snapshot')]
+        for patcher in patchers:
+            patcher.start()
+        self.patchers = patchers
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        cache.clear()
+        base.directories.clear()
+
+    def make_stale(self):
+        self.facade.get_all_branches()
+        self.clock.now += base.DIRECTORY_SOFT_TTL + 1
+        self.api.get_branches.return_value = (['second'], False)
+
+    def test_cold_cache_fetched(self):
+        self.assertEqual(self.facade.get_all_branches(), ['first'])
+        self.assertEqual(self.facade.get_all_branches(), ['first'])
+        self.assertEqual(self.api.get_branches.call_count, 1)
+        self.assertEqual(self.facade.branches_updated, 1000.0)
+        self.assertEqual(self.background, [])
+
+    def test_cold_cache_api_error(self):
+        self.api.get_branches.return_value = (None, IOError('unreachable'))
+        self.assertEqual(self.facade.get_all_branches(), [])
+        self.assertEqual(self.facade.read_branches(), None)
+
+    def test_snapshot_used(self):
+        base.read_snapshot.return_value = (990.0, ['snapshot'])
+        self.assertEqual(self.facade.get_all_branches(), ['snapshot'])
+        self.assertFalse(self.api.get_branches.called)
+        self.assertEqual(self.facade.read_branches(), (990.0, ['snapshot']))
+
+    def test_fresh_not_refreshed(self):
+        self.facade.get_all_branches()
+        self.clock.now += base.DIRECTORY_SOFT_TTL - 1
+        self.assertEqual(self.facade.get_all_branches(), ['first'])
+        self.assertEqual(self.background, [])
+
+    def test_stale_served_and_refreshed_once(self):
+        self.make_stale()
+        self.assertEqual(self.facade.get_all_branches(), ['first'])
+        self.assertEqual(self.facade.get_all_branches(), ['first'])
+        self.assertEqual(self.background, [self.facade.refresh_branches])
+        self.background[0]()
+        self.assertEqual(self.facade.get_all_branches(), ['second'])
+        self.assertEqual(self.facade.branches_updated, self.clock.now)
+        # the refresh lock is released on success
+        self.assertEqual(cache.get(self.facade.get_branches_cache_key() + '_refresh'), None)
+
+    def test_failed_refresh_keeps_stale(self):
+        self.make_stale()
+        self.api.get_branches.return_value = (None, IOError('unreachable'))
+        self.facade.get_all_branches()
+        self.background[0]()
+        self.assertEqual(self.facade.get_all_branches(), ['first'])
+        # next attempt isn't made until the lock expires
+        self.assertEqual(len(self.background), 1)
+
+    def test_decoded_copy_reused(self):
+        self.facade.get_all_branches()
+        local = base.directories['fake']
+        with mock.patch.object(base, 'get_large') as get_large:
+            self.assertTrue(self.facade.read_branches() is local)
+        self.assertFalse(get_large.called)
+
+    def test_changed_directory_decoded(self):
+        self.facade.get_all_branches()
+        base.directories['fake'] = (1.0, ['outdated'])
+        self.assertEqual(self.facade.read_branches(), (1000.0, ['first']))
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_django-oscar-shipping
+------------
+
+Tests for `django-oscar-shipping` matching module.
+"""
+
+import unittest
+
+import mock
+
+from oscar_shipping import matching
+
+
+class TestNormalizeCity(unittest.TestCase):
+
+    def test_case_and_yo(self):
+        self.assertEqual(matching.normalize_city(u'Королёв'), u'королев')
+
+    def test_settlement_type_stripped(self):
+        self.assertEqual(matching.normalize_city(u'г. Москва'), u'москва')
+        self.assertEqual(matching.normalize_city(u'пос. Шушары'), u'шушары')
+        self.assertEqual(matching.normalize_city(u'Шушары пос.'), u'шушары')
+        self.assertEqual(matching.normalize_city(u'ст-ца Каневская'), u'каневская')
+
+    def test_settlement_type_in_name(self):
+        # different places shouldn't be merged
+        self.assertEqual(matching.normalize_city(u'Красное Село'), u'красное село')
+        self.assertEqual(matching.normalize_city(u'г. Царское Село'), u'царское село')
+        self.assertEqual(matching.normalize_city(u'Новая Деревня'), u'новая деревня')
+        self.assertEqual(matching.normalize_city(u'Шушары пос'), u'шушары пос')
+
+    def test_separators_collapsed(self):
+        self.assertEqual(matching.normalize_city(u'г. Ростов-на-Дону'), u'ростов на дону')
+        self.assertEqual(matching.normalize_city(u'  Ростов  на—Дону '), u'ростов на дону')
+
+    def test_settlement_type_only(self):
+        # the only word is kept, it could be the city name itself
+        self.assertEqual(matching.normalize_city(u'Город'), u'город')
+
+    def test_empty(self):
+        self.assertEqual(matching.normalize_city(None), u'')
+        self.assertEqual(matching.normalize_city(u''), u'')
+
+
+class TestCityIndex(unittest.TestCase):
+
+    def test_lookup(self):
+        index = matching.CityIndex([(1, u'Москва', u'Москва'),
+                                    (1, u'г. Москва', u'Москва'),
+                                    (2, u'Королёв', u'Москва')])
+        self.assertEqual(index.lookup(u'москва'), [(1, u'Москва', u'Москва')])
+        self.assertEqual(index.lookup(u'Королев'), [(2, u'Королёв', u'Москва')])
+        self.assertEqual(index.lookup(u'Тверь'), None)
+
+
+class TestNarrowByRegion(unittest.TestCase):
+
+    records = [(1, u'Кировск', u'Мурманская обл.'),
+               (2, u'Кировск', u'Ленинградская обл.')]
+
+    def test_region_matched(self):
+        self.assertEqual(matching.narrow_by_region(self.records, u'Ленинградская область'),
+                         [self.records[1]])
+
+    def test_region_matched_by_stem(self):
+        # branch names are region capitals, e.g. "Мурманск"
+        records = [(1, u'Кировск', u'Мурманск'),
+                   (2, u'Кировск', u'Санкт-Петербург')]
+        self.assertEqual(matching.narrow_by_region(records, u'Мурманская обл.'),
+                         [records[0]])
+
+    def test_region_words_match(self):
+        self.assertTrue(matching.region_words_match(u'московская', u'москва'))
+        self.assertTrue(matching.region_words_match(u'тверская', u'тверь'))
+        self.assertTrue(matching.region_words_match(u'новгородская', u'новгород'))
+        self.assertFalse(matching.region_words_match(u'новгородская', u'новосибирск'))
+        self.assertFalse(matching.region_words_match(u'курганская', u'курск'))
+        # short words match exactly only
+        self.assertTrue(matching.region_words_match(u'ханты', u'ханты'))
+        self.assertFalse(matching.region_words_match(u'уфа', u'уфимская'))
+
+    def test_similar_regions_not_merged(self):
+        records = [(1, u'Кировск', u'Новосибирск'),
+                   (2, u'Кировск', u'Великий Новгород')]
+        self.assertEqual(matching.narrow_by_region(records, u'Новгородская обл.'),
+                         [records[1]])
+
+    def test_nothing_matched(self):
+        self.assertEqual(matching.narrow_by_region(self.records, u'Тверская обл.'),
+                         self.records)
+
+    def test_no_region(self):
+        self.assertEqual(matching.narrow_by_region(self.records), self.records)
+
+    def test_postcode(self):
+        with mock.patch.object(matching, 'POSTCODE_REGIONS', {'184': u'Мурманская обл.'}):
+            self.assertEqual(matching.narrow_by_region(self.records, postcode='184250'),
+                             [self.records[0]])
+            self.assertEqual(matching.narrow_by_region(self.records, postcode='101000'),
+                             self.records)
+
+    def test_get_region(self):
+        records = [{'region': u'Мурманская обл.'}, {'region': u'Ленинградская обл.'}]
+        self.assertEqual(matching.narrow_by_region(records, u'Ленинградская',
+                                                   get_region=lambda r: r['region']),
+                         [records[1]])
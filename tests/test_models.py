@@ -12,7 +12,16 @@ import os
 import shutil
 import unittest
 
-from oscar_shipping import models
+from collections import namedtuple
+from decimal import Decimal as D
+
+import mock
+
+from django.core.cache import cache
+
+from oscar_shipping import models, registry
+
+Rate = namedtuple('Rate', ('volume', 'weight', 'charge', 'service'))
 
 
 class TestOscar_shipping(unittest.TestCase):
@@ -25,3 +34,125 @@ class TestOscar_shipping(unittest.TestCase):
 
     def tearDown(self):
         pass
+
+
+class TestIsApiEnabled(unittest.TestCase):
+
+    def test_enabled(self):
+        reg = registry.FacadeRegistry(enabled=['pecom'])
+        reg.register('pecom', 'oscar_shipping.facade.pecom')
+        reg.register('emspost', 'oscar_shipping.facade.emspost')
+        with mock.patch.object(registry, 'iter_entry_points', return_value=iter([])), \
+                mock.patch.object(models, 'registry', reg):
+            self.assertTrue(models.is_api_enabled('pecom'))
+            self.assertFalse(models.is_api_enabled('emspost'))
+            # methods without API are always enabled
+            self.assertTrue(models.is_api_enabled(''))
+
+
+class TestShippingRateEstimate(unittest.TestCase):
+
+    def estimate(self, rates, weight, volume=D('0.01')):
+        # rates are given as filtered and ordered by the volume and weight
+        qs = mock.Mock()
+        qs.filter.return_value.order_by.return_value = rates
+        with mock.patch.object(models.ShippingRateManager, 'get_queryset', return_value=qs):
+            return models.ShippingRate.objects.estimate(None, 1, 2, weight, volume)
+
+    def setUp(self):
+        self.rates = [Rate(D('0.01'), D('1'), D('100.00'), 'auto'),
+                      Rate(D('0.01'), D('3'), D('200.00'), 'auto'),
+                      Rate(D('0.01'), D('5'), D('300.00'), 'avia'),
+                      Rate(D('0.05'), D('1'), D('150.00'), 'auto'),
+                      Rate(D('0.05'), D('10'), D('900.00'), 'auto')]
+
+    def test_interpolated(self):
+        self.assertEqual(self.estimate(self.rates, D('2')), (D('150.00'), 'auto'))
+        self.assertEqual(self.estimate(self.rates, D('3.5')), (D('225.00'), 'avia'))
+
+    def test_band_weight(self):
+        self.assertEqual(self.estimate(self.rates, D('3')), (D('200.00'), 'avia'))
+        self.assertEqual(self.estimate(self.rates, D('5')), (D('300.00'), 'avia'))
+
+    def test_lighter_than_lightest_band(self):
+        self.assertEqual(self.estimate(self.rates, D('0.5')), (D('100.00'), 'auto'))
+
+    def test_heavier_than_largest_band(self):
+        # the smallest volume band is used only
+        self.assertEqual(self.estimate(self.rates, D('6')), None)
+
+    def test_route_not_covered(self):
+        self.assertEqual(self.estimate([], D('1')), None)
+
+
+class TestCachedMethods(unittest.TestCase):
+
+    def setUp(self):
+        cache.clear()
+        models.credentials_cache.__init__()
+        self.method = models.ShippingCompany(pk=1, code='fake', name='Fake', api_type='',
+                                             api_user='user', api_key='secret')
+        self.method._containers = []
+
+    def tearDown(self):
+        cache.clear()
+
+    def restore(self, version='v1'):
+        return models.ShippingCompany.from_cached_row(self.method.get_cached_row(), version)
+
+    def test_credentials_not_cached(self):
+        row = self.method.get_cached_row()
+        self.assertFalse('api_user' in row['fields'])
+        self.assertFalse('api_key' in row['fields'])
+        self.assertEqual(row['fields']['code'], 'fake')
+
+    def test_credentials_read_on_access(self):
+        with mock.patch.object(models.ShippingCompany, 'read_credentials',
+                               return_value=('user', 'secret')) as read:
+            method = self.restore()
+            self.assertFalse(read.called)
+            self.assertEqual((method.api_user, method.api_key), ('user', 'secret'))
+            # the other copy of the same configuration reads them from the process memory
+            self.assertEqual(self.restore().api_key, 'secret')
+        self.assertEqual(read.call_count, 1)
+
+    def test_credentials_of_previous_version_dropped(self):
+        with mock.patch.object(models.ShippingCompany, 'read_credentials',
+                               return_value=('user', 'secret')) as read:
+            self.restore('v1').api_key
+            self.restore('v2').api_key
+        self.assertEqual(read.call_count, 2)
+        self.assertEqual(list(models.credentials_cache.values.keys()), [1])
+        self.assertEqual(models.credentials_cache.version, 'v2')
+
+    def test_credentials_loaded_before_save(self):
+        method = self.restore()
+        with mock.patch.object(models.ShippingCompany, 'read_credentials',
+                               return_value=('user', 'secret')), \
+                mock.patch.object(models.AbstractWeightBased, 'save') as save:
+            method.save()
+        self.assertTrue(save.called)
+        self.assertEqual(method.__dict__['api_key'], 'secret')
+
+    def test_cached(self):
+        qs = mock.Mock()
+        qs.prefetch_related.return_value = [self.method]
+        with mock.patch.object(models.AvailableCompanyManager, 'get_queryset',
+                               return_value=qs) as get_queryset, \
+                mock.patch.object(models, 'METHODS_CACHE_TTL', 60):
+            first = models.ShippingCompany.available.cached()
+            second = models.ShippingCompany.available.cached()
+        self.assertEqual(get_queryset.call_count, 1)
+        self.assertEqual([m.code for m in second], ['fake'])
+        self.assertFalse(first[0] is second[0])
+
+    def test_cached_after_change(self):
+        qs = mock.Mock()
+        qs.prefetch_related.return_value = [self.method]
+        with mock.patch.object(models.AvailableCompanyManager, 'get_queryset',
+                               return_value=qs) as get_queryset, \
+                mock.patch.object(models, 'METHODS_CACHE_TTL', 60):
+            models.ShippingCompany.available.cached()
+            models.invalidate_methods_cache()
+            models.ShippingCompany.available.cached()
+        self.assertEqual(get_queryset.call_count, 2)
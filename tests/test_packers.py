@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_django-oscar-shipping
+------------
+
+Tests for `django-oscar-shipping` packers module.
+"""
+
+import unittest
+
+from decimal import Decimal as D
+
+from oscar_shipping.packers import (Packer, Container, to_mm, to_grams,
+                                    grams_to_kg, mm3_to_m3)
+
+
+class TestChoosePacks(unittest.TestCase):
+
+    def setUp(self):
+        # 1 000 000 and 1 000 000 000 mm3
+        self.small = Container(D('0.1'), D('0.1'), D('0.1'), 'small')
+        self.big = Container(D('1'), D('1'), D('1'), 'big')
+
+    def test_least_chargeable_weight(self):
+        # volumetric weight of the big box is 200 kg
+        packer = Packer([self.big, self.small], volumetric_divisor=5000)
+        packs = packer.choose_packs(500000, 1000)
+        self.assertEqual([(p['container'].name, p['weight']) for p in packs],
+                         [('small', D('1.000'))])
+
+    def test_several_packs(self):
+        packer = Packer([self.big, self.small], volumetric_divisor=5000)
+        packs = packer.choose_packs(2500000, 3000)
+        self.assertEqual([(p['container'].name, p['weight']) for p in packs],
+                         [('small', D('1.000'))] * 3)
+
+    def test_max_load(self):
+        light = Container(D('0.1'), D('0.1'), D('0.1'), 'light', max_load=D('0.5'))
+        packs = Packer([light]).choose_packs(500000, 2000)
+        self.assertEqual([(p['container'].name, p['weight']) for p in packs],
+                         [('light', D('0.500'))] * 4)
+
+    def test_fewer_packs_preferred(self):
+        # actual weight is charged without divisor, so both are the same
+        packer = Packer([self.small, self.big])
+        packs = packer.choose_packs(2500000, 3000)
+        self.assertEqual([p['container'].name for p in packs], ['big'])
+
+    def test_smaller_container_preferred(self):
+        packer = Packer([self.big, self.small])
+        packs = packer.choose_packs(500000, 1000)
+        self.assertEqual([p['container'].name for p in packs], ['small'])
+
+    def test_virtual_container(self):
+        packs = Packer([]).choose_packs(8000000, 1500)
+        self.assertEqual(len(packs), 1)
+        self.assertEqual(packs[0]['container'].volume_mm3, 8000000)
+        self.assertEqual(packs[0]['weight'], D('1.500'))
+
+    def test_too_many_packs(self):
+        # 20 small boxes are required, that's more than OSCAR_SHIPPING_MAX_PACKS
+        packs = Packer([self.small]).choose_packs(20000000, 1000)
+        self.assertEqual(len(packs), 1)
+        self.assertNotEqual(packs[0]['container'].name, 'small')
+
+    def test_chargeable_weight(self):
+        packer = Packer([self.small], volumetric_divisor=5000)
+        # 1 000 000 mm3 / 5000 = 200 g
+        self.assertEqual(packer.get_chargeable_weight([{'weight': D('0.1'), 'container': self.small},
+                                                       {'weight': D('1'), 'container': self.small}]),
+                         D('1.200'))
+
+
+class TestUnits(unittest.TestCase):
+
+    def test_to_int_units(self):
+        self.assertEqual(to_mm(D('0.1')), 100)
+        self.assertEqual(to_mm(0.1), 100)
+        self.assertEqual(to_mm(None), 0)
+        self.assertEqual(to_grams('1.2345'), 1235)
+        self.assertEqual(to_grams(D('0.0004')), 0)
+
+    def test_from_int_units(self):
+        self.assertEqual(grams_to_kg(1500), D('1.500'))
+        self.assertEqual(mm3_to_m3(1000000), D('0.001'))
+
+    def test_container(self):
+        box = Container(D('0.1'), '0.2', 0.3, 'box', max_load=D('2.5'))
+        self.assertEqual((box.height_mm, box.width_mm, box.length_mm), (100, 200, 300))
+        self.assertEqual(box.volume_mm3, 6000000)
+        self.assertEqual(box.volume, D('0.006'))
+        self.assertEqual(box.max_load_g, 2500)
+
+    def test_cube(self):
+        box = Container.cube(1000001, 'cube')
+        self.assertEqual(box.height_mm, 101)
+        self.assertTrue(box.volume_mm3 >= 1000001)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_django-oscar-shipping
+------------
+
+Tests for `django-oscar-shipping` ratelimit module.
+"""
+
+import unittest
+
+import mock
+
+from django.core.cache import cache
+
+from oscar_shipping import ratelimit
+
+
+class Clock(object):
+    """
+    Stands for the time module, sleep() moves the time forward
+    """
+    def __init__(self, now):
+        self.now = now
+        self.slept = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def setUp(self):
+        cache.clear()
+        # 5 tokens per second, 10 at once
+        self.bucket = ratelimit.TokenBucket('test', 5, 10)
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_burst(self):
+        now = 1000.0
+        self.assertEqual([self.bucket.take(now) for i in range(11)], [True] * 10 + [False])
+
+    def test_refill(self):
+        now = 1000.0
+        for i in range(10):
+            self.bucket.take(now)
+        self.assertFalse(self.bucket.take(now + 0.1))
+        self.assertTrue(self.bucket.take(now + 0.2))
+        self.assertFalse(self.bucket.take(now + 0.2))
+
+    def test_no_double_burst(self):
+        # fixed windows would allow another burst right after the window boundary
+        for i in range(10):
+            self.bucket.take(1001.99)
+        self.assertFalse(self.bucket.take(1002.01))
+
+    def test_full_after_idle(self):
+        now = 1000.0
+        for i in range(10):
+            self.bucket.take(now)
+        self.assertEqual([self.bucket.take(now + 60) for i in range(11)], [True] * 10 + [False])
+
+    def test_buckets_are_separate(self):
+        now = 1000.0
+        for i in range(10):
+            self.bucket.take(now)
+        self.assertTrue(ratelimit.TokenBucket('other', 5, 10).take(now))
+
+    def test_locked(self):
+        cache.add(self.bucket.get_lock_key(), 1)
+        self.assertEqual(self.bucket.reserve(1000.0), ratelimit.LOCK_RETRY)
+
+    def test_acquire_waits_for_refill(self):
+        clock = Clock(1000.5)
+        with mock.patch.object(ratelimit, 'time', clock):
+            for i in range(10):
+                self.assertTrue(self.bucket.acquire())
+            self.assertTrue(self.bucket.acquire(wait=1))
+        self.assertEqual(len(clock.slept), 1)
+        self.assertAlmostEqual(clock.slept[0], 0.2)
+
+    def test_acquire_gives_up(self):
+        clock = Clock(1000.5)
+        with mock.patch.object(ratelimit, 'time', clock):
+            for i in range(10):
+                self.bucket.acquire()
+            self.assertFalse(self.bucket.acquire(wait=0.1))
+            self.assertFalse(self.bucket.acquire())
+        self.assertEqual(clock.slept, [])
+
+    def test_not_limited(self):
+        self.assertTrue(isinstance(ratelimit.get_bucket('unknown'), ratelimit.NoLimit))
+        self.assertTrue(ratelimit.get_bucket('unknown').acquire())
+
+    def test_not_limited_by_default(self):
+        self.assertEqual(ratelimit.RATE_LIMITS, {})
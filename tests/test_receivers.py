@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_django-oscar-shipping
+------------
+
+Tests for `django-oscar-shipping` receivers module.
+"""
+
+import unittest
+
+import mock
+
+from django.core.cache import cache
+
+from oscar.apps.address.abstract_models import AbstractShippingAddress
+from oscar.apps.basket.abstract_models import AbstractLine
+
+from oscar_shipping import receivers, utils
+from oscar_shipping.packers import make_profile_cache_key
+
+
+class TestRunAfterCommit(unittest.TestCase):
+
+    def setUp(self):
+        self.runner = mock.Mock()
+        patcher = mock.patch.object(receivers, 'get_task_runner', return_value=self.runner)
+        patcher.start()
+        self.patchers = [patcher]
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+
+    def test_scheduled_on_commit(self):
+        callbacks = []
+        transaction = mock.Mock()
+        transaction.on_commit.side_effect = callbacks.append
+        with mock.patch.object(receivers, 'transaction', transaction):
+            self.assertTrue(receivers.run_after_commit(len, 1))
+        self.assertFalse(self.runner.called)
+        callbacks[0]()
+        self.runner.assert_called_once_with(len, 1)
+
+    def test_not_scheduled_without_on_commit(self):
+        # the task would read rows not committed yet
+        with mock.patch.object(receivers, 'transaction', mock.Mock(spec=[])):
+            self.assertFalse(receivers.run_after_commit(len, 1))
+        self.assertFalse(self.runner.called)
+
+
+class TestRunTask(unittest.TestCase):
+
+    def test_connection_closed(self):
+        func = mock.Mock()
+        with mock.patch('django.db.connection') as connection:
+            utils.run_task(func, 1, 2)
+        func.assert_called_once_with(1, 2)
+        self.assertTrue(connection.close.called)
+
+    def test_connection_closed_on_error(self):
+        func = mock.Mock(side_effect=ValueError)
+        with mock.patch('django.db.connection') as connection:
+            with self.assertRaises(ValueError):
+                utils.run_task(func)
+        self.assertTrue(connection.close.called)
+
+    def test_default_runner(self):
+        self.assertTrue(utils.get_task_runner(None) is utils.run_task_in_background)
+
+
+class TestPrequoteOnBasketChange(unittest.TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.line = mock.Mock(spec=AbstractLine)
+        self.line.basket_id = 7
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_debounced(self):
+        with mock.patch.object(receivers, 'run_after_commit', return_value=True) as run:
+            receivers.prequote_on_basket_change(None, self.line)
+            receivers.prequote_on_basket_change(None, self.line)
+        run.assert_called_once_with(receivers.prequote_basket, 7)
+
+    def test_scheduled_again_once_started(self):
+        with mock.patch.object(receivers, 'run_after_commit', return_value=True) as run:
+            receivers.prequote_on_basket_change(None, self.line)
+            with mock.patch.object(receivers, 'get_model') as get_model:
+                get_model.return_value.DoesNotExist = KeyError
+                get_model.return_value.objects.get.side_effect = KeyError
+                receivers.prequote_basket(7)
+            receivers.prequote_on_basket_change(None, self.line)
+        self.assertEqual(run.call_count, 2)
+
+    def test_not_scheduled(self):
+        with mock.patch.object(receivers, 'run_after_commit', return_value=False) as run:
+            receivers.prequote_on_basket_change(None, self.line)
+            receivers.prequote_on_basket_change(None, self.line)
+        self.assertEqual(run.call_count, 2)
+
+    def test_other_models_skipped(self):
+        with mock.patch.object(receivers, 'run_after_commit') as run:
+            receivers.prequote_on_basket_change(None, mock.Mock())
+            receivers.prequote_on_basket_change(None, self.line, raw=True)
+        self.assertFalse(run.called)
+
+
+class TestResolveCodesOnAddressSave(unittest.TestCase):
+
+    def test_ids_passed(self):
+        address = mock.Mock(spec=AbstractShippingAddress)
+        address.pk = 3
+        address._meta = mock.Mock(app_label='address', model_name='useraddress')
+        with mock.patch.object(receivers, 'run_after_commit') as run:
+            receivers.resolve_codes_on_address_save(None, address)
+        run.assert_called_once_with(receivers.resolve_saved_address_codes,
+                                    'address', 'useraddress', 3)
+
+
+class TestInvalidateProductProfile(unittest.TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_profile_deleted(self):
+        revision = '2016-01-01 00:00:00'
+        cache.set(make_profile_cache_key(5, revision), {'profile': 1})
+        # product isn't loaded, only its revision is read
+        value = mock.Mock(spec=['product_id'])
+        value.product_id = 5
+        with mock.patch.object(receivers, 'get_model') as get_model:
+            qs = get_model.return_value.objects.filter.return_value
+            qs.values_list.return_value.first.return_value = revision
+            receivers.invalidate_product_profile(None, value)
+        get_model.return_value.objects.filter.assert_called_once_with(pk=5)
+        self.assertEqual(cache.get(make_profile_cache_key(5, revision)), None)
+
+    def test_connected_to_attribute_values_only(self):
+        def make_model(app_label, name):
+            return type(str(name), (object,), {'_meta': mock.Mock(app_label=app_label)})
+
+        with mock.patch.object(receivers, 'post_save') as post_save, \
+                mock.patch.object(receivers, 'post_delete') as post_delete:
+            receivers.connect_profile_invalidation(make_model('catalogue', 'Product'))
+            receivers.connect_profile_invalidation(make_model('shipping', 'ProductAttributeValue'))
+            self.assertFalse(post_save.connect.called)
+            model = make_model('catalogue', 'ProductAttributeValue')
+            receivers.connect_profile_invalidation(model)
+        self.assertEqual(post_save.connect.call_args[1]['sender'], model)
+        self.assertEqual(post_delete.connect.call_args[1]['sender'], model)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_django-oscar-shipping
+------------
+
+Tests for `django-oscar-shipping` registry module.
+"""
+
+import unittest
+
+import mock
+
+from django.core.exceptions import ImproperlyConfigured
+
+from oscar_shipping import registry
+
+
+class TestFacadeRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = registry.FacadeRegistry(enabled=['pecom', 'dhl'])
+        self.registry.register('pecom', 'oscar_shipping.facade.pecom', 'PEC')
+        self.registry.register('emspost', 'oscar_shipping.facade.emspost')
+        self.entry_points = [('dhl', 'dhl_oscar.facade'),
+                             ('pecom', 'other.facade')]
+        patcher = mock.patch.object(registry, 'iter_entry_points',
+                                    side_effect=lambda group: iter(self.entry_points))
+        self.iter_entry_points = patcher.start()
+        self.patchers = [patcher]
+        patcher = mock.patch.object(registry.importlib, 'import_module')
+        self.import_module = patcher.start()
+        self.patchers.append(patcher)
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+
+    def test_enabled_only(self):
+        self.assertEqual(sorted(self.registry.keys()), ['dhl', 'pecom'])
+        self.assertEqual(dict(self.registry.choices())['pecom'], 'PEC')
+        self.assertFalse('emspost' in self.registry)
+
+    def test_entry_points_scanned_once(self):
+        self.assertFalse(self.iter_entry_points.called)
+        self.registry.keys()
+        self.registry.keys()
+        self.iter_entry_points.assert_called_once_with(registry.ENTRY_POINT_GROUP)
+
+    def test_builtin_not_overridden(self):
+        self.registry['pecom']
+        self.import_module.assert_called_once_with('oscar_shipping.facade.pecom')
+
+    def test_imported_on_first_use(self):
+        self.assertFalse(self.import_module.called)
+        module = self.registry['dhl']
+        self.assertTrue(self.registry['dhl'] is module)
+        self.import_module.assert_called_once_with('dhl_oscar.facade')
+
+    def test_get_facade(self):
+        facade = self.registry.get_facade('pecom', 'user', 'key')
+        self.import_module.return_value.ShippingFacade.assert_called_once_with('user', 'key')
+        self.assertTrue(facade is self.import_module.return_value.ShippingFacade.return_value)
+
+    def test_disabled_facade(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.registry.get_facade('emspost')
+        self.assertFalse(self.import_module.called)
+
+    def test_import_error(self):
+        self.import_module.side_effect = ImportError('No module named dhl_oscar')
+        with self.assertRaises(ImproperlyConfigured):
+            self.registry.get_facade('dhl')
+
+    def test_all_enabled(self):
+        self.registry.enabled = None
+        self.assertEqual(sorted(self.registry.keys()), ['dhl', 'emspost', 'pecom'])
+
+
+class TestLazyChoices(unittest.TestCase):
+
+    def test_evaluated_on_iteration(self):
+        reg = mock.Mock()
+        reg.choices.return_value = [('pecom', 'PEC')]
+        choices = registry.LazyChoices(reg)
+        self.assertTrue(choices)
+        self.assertFalse(reg.choices.called)
+        self.assertEqual(list(choices), [('pecom', 'PEC')])
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_django-oscar-shipping
+------------
+
+Tests for `django-oscar-shipping` snapshots module.
+"""
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from oscar_shipping import snapshots
+
+
+class TestSnapshots(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.snapshot_dir = os.path.join(self.tmp_dir, 'snapshots')
+        self.patcher = mock.patch.object(snapshots, 'SNAPSHOT_DIR', self.snapshot_dir)
+        self.patcher.start()
+        snapshots._loaded.clear()
+
+    def tearDown(self):
+        self.patcher.stop()
+        snapshots._loaded.clear()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_round_trip(self):
+        self.assertTrue(snapshots.write_snapshot('pecom', [{'id': 1}], 1000.0))
+        self.assertEqual(snapshots.read_snapshot('pecom'), (1000.0, [{'id': 1}]))
+        self.assertEqual(snapshots.read_snapshot('emspost'), None)
+
+    def test_replaced(self):
+        snapshots.write_snapshot('pecom', ['first'], 1000.0)
+        snapshots.read_snapshot('pecom')
+        snapshots.write_snapshot('pecom', ['second'], 2000.0)
+        self.assertEqual(snapshots.read_snapshot('pecom'), (2000.0, ['second']))
+        # temporary files aren't left
+        self.assertEqual(os.listdir(self.snapshot_dir),
+                         [os.path.basename(snapshots.get_snapshot_path('pecom'))])
+
+    def test_parsed_once(self):
+        snapshots.write_snapshot('pecom', ['first'], 1000.0)
+        snapshots.read_snapshot('pecom')
+        with mock.patch.object(snapshots.json, 'load') as load:
+            self.assertEqual(snapshots.read_snapshot('pecom'), (1000.0, ['first']))
+        self.assertFalse(load.called)
+
+    def test_not_serializable(self):
+        self.assertFalse(snapshots.write_snapshot('pecom', [object()], 1000.0))
+        self.assertEqual(os.listdir(self.snapshot_dir), [])
+        self.assertEqual(snapshots.read_snapshot('pecom'), None)
+
+    def test_broken_file(self):
+        os.makedirs(self.snapshot_dir)
+        with open(snapshots.get_snapshot_path('pecom'), 'w') as f:
+            f.write('{"version": 1, "na')
+        self.assertEqual(snapshots.read_snapshot('pecom'), None)
+
+    def test_other_version_ignored(self):
+        os.makedirs(self.snapshot_dir)
+        with open(snapshots.get_snapshot_path('pecom'), 'w') as f:
+            json.dump({'version': snapshots.SNAPSHOT_VERSION + 1, 'name': 'pecom',
+                       'ts': 1000.0, 'data': []}, f)
+        self.assertEqual(snapshots.read_snapshot('pecom'), None)
+
+    def test_disabled(self):
+        with mock.patch.object(snapshots, 'SNAPSHOT_DIR', None):
+            self.assertFalse(snapshots.write_snapshot('pecom', [], 1000.0))
+            self.assertEqual(snapshots.read_snapshot('pecom'), None)